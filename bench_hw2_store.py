@@ -0,0 +1,136 @@
+"""
+hw2 評分分析庫量測
+
+產生模擬的歷史評分（多位專員、跨數個月、每月多次執行），量測：
+  - 批次交易寫入的速度（對照逐筆 commit）
+  - 彙總 / 趨勢查詢的延遲，並印出查詢計畫確認走涵蓋索引
+  - 對照：把同樣的資料存成每次執行一份 CSV，再用 pandas 全部讀回計算同一個趨勢
+
+用法：
+    python bench_hw2_store.py --runs 400 --rows 250
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+import pandas as pd
+
+import hw2_store
+
+ITEMS = [
+    "溝通技巧（語速與音量適當性）", "溝通技巧（語言表達流暢性）", "溝通技巧（親和力與禮貌性）",
+    "問題解決（資訊確認與收集能力）", "問題解決（快速應對與反應力）", "問題解決（解決方案的適當性）",
+    "專業知識（業務熟悉度）", "專業知識（流程規範遵循度）", "主動服務（需求確認與提醒）",
+    "耐心與情緒管理（冷靜處理衝突）", "貴賓體驗提升（額外建議與推薦）",
+]
+CRITERION = "耐心與情緒管理"
+
+
+def make_runs(runs: int, rows: int, agents: int, months: int, seed: int = 0):
+    """ 回傳 [(評分時間, 專員, [評分 dict...])]，時間平均分布在最近 months 個月 """
+    rng = random.Random(seed)
+    now = time.time()
+    plan = []
+    for r in range(runs):
+        scored_at = now - rng.random() * months * 30 * 86400
+        agent = f"專員{r % agents:02d}"
+        results = [{item: str(rng.randint(1, 5)) for item in ITEMS} for _ in range(rows)]
+        plan.append((scored_at, agent, results))
+    return plan
+
+
+def timed(fn, repeat: int = 20):
+    """ 回傳 (結果, 中位數毫秒) """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測 hw2 評分分析庫的寫入與查詢延遲")
+    parser.add_argument("--runs", type=int, default=400, help="模擬的 hw2 執行次數")
+    parser.add_argument("--rows", type=int, default=250, help="每次執行的逐字稿筆數")
+    parser.add_argument("--agents", type=int, default=20)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--batch", type=int, default=10, help="每個交易寫入的逐字稿筆數（hw2 每批 10 筆）")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_hw2_store_")
+    plan = make_runs(args.runs, args.rows, args.agents, args.months)
+    total_scores = args.runs * args.rows * len(ITEMS)
+    print(f"{args.runs} 次執行 × {args.rows} 筆 × {len(ITEMS)} 項 = {total_scores} 筆分數")
+    try:
+        # --- 寫入：每 batch 筆一個交易 ---
+        store = hw2_store.ScoreStore(os.path.join(work_dir, "scores.db"))
+        start = time.perf_counter()
+        for scored_at, agent, results in plan:
+            run_id = store.start_run("bench.csv", "bench", scored_at)
+            for i in range(0, len(results), args.batch):
+                store.add_scores(run_id, [(i + j, result, "bench.csv", agent)
+                                          for j, result in enumerate(results[i:i + args.batch])], scored_at)
+        seconds = time.perf_counter() - start
+        print(f"批次交易寫入：{seconds:.2f} 秒（{total_scores / seconds:,.0f} 筆/秒）")
+
+        # 對照：逐筆一個交易（只寫一次執行的量，避免耗時過久）
+        single = hw2_store.ScoreStore(os.path.join(work_dir, "single.db"))
+        scored_at, agent, results = plan[0]
+        run_id = single.start_run("bench.csv", "bench", scored_at)
+        start = time.perf_counter()
+        for i, result in enumerate(results):
+            single.add_scores(run_id, [(i, result, "bench.csv", agent)], scored_at)
+        seconds = time.perf_counter() - start
+        print(f"逐筆交易寫入：{len(results) * len(ITEMS) / seconds:,.0f} 筆/秒")
+        single.close()
+
+        # --- 查詢 ---
+        agent = "專員03"
+        queries = [
+            ("全體各項平均", lambda: store.rollup()),
+            ("各專員各項平均（近 90 天）", lambda: store.rollup("agent", since=time.time() - 90 * 86400)),
+            ("單次執行各項平均", lambda: store.rollup("run", run_id=args.runs // 2)),
+            (f"{agent}「{CRITERION}」逐月趨勢", lambda: store.trend(CRITERION, agent)),
+            (f"全體「{CRITERION}」逐週趨勢", lambda: store.trend(CRITERION, period="week")),
+        ]
+        for label, query in queries:
+            rows, ms = timed(query)
+            print(f"  {label}：{ms:.2f} 毫秒（{len(rows)} 列）")
+        cid = store._criterion_filter(CRITERION)[0][0]
+        plan_text = store.explain(
+            "SELECT AVG(score) FROM scores WHERE criterion_id = ? AND agent = ? GROUP BY scored_at",
+            (cid, agent))
+        print(f"  趨勢查詢計畫：{'; '.join(plan_text)}")
+        store.close()
+
+        # --- 對照：每次執行一份 CSV，用 pandas 重讀 ---
+        csv_dir = os.path.join(work_dir, "csv")
+        os.makedirs(csv_dir)
+        for index, (scored_at, agent_name, results) in enumerate(plan):
+            df = pd.DataFrame(results)
+            df["agent"] = agent_name
+            df["scored_at"] = scored_at
+            df.to_csv(os.path.join(csv_dir, f"run{index}.csv"), index=False, encoding="utf-8-sig")
+        item = next(i for i in ITEMS if CRITERION in i)
+
+        def pandas_trend():
+            frames = [pd.read_csv(os.path.join(csv_dir, name), encoding="utf-8-sig")
+                      for name in os.listdir(csv_dir)]
+            df = pd.concat(frames)
+            df = df[df["agent"] == agent]
+            month = pd.to_datetime(df["scored_at"], unit="s").dt.strftime("%Y-%m")
+            return df.groupby(month)[item].mean()
+
+        _, ms = timed(pandas_trend, repeat=3)
+        print(f"對照：pandas 重讀 {len(plan)} 份 CSV 計算同一趨勢：{ms:.0f} 毫秒")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+hw3 批次模式吞吐量量測
+
+在本機啟動模擬 ChatGPT 的對話頁 (hw3_standin.html)：回答先等待 latency 秒，再分段串流送出，
+頁面另引用緩慢載入的圖片、字型與追蹤程式。以不同的 context 數執行 hw3.run_batch，
+量測每分鐘可處理的問題數、首段回答時間，並比較攔截非必要資源與否的差異。
+原本的流程每題固定等待 5 + 10 秒，最多約 4 題/分鐘，且與實際回答速度無關。
+
+用法：
+    python bench_hw3.py --prompts 24 --contexts 1 2 4 --latency 1.5
+    python bench_hw3.py --contexts 2 --compare-blocking
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import hw3
+
+STANDIN_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hw3_standin.html")
+# 原本 hw3.py 每題固定等待的秒數
+FIXED_WAIT_SECONDS = 5 + 10
+STATIC_TYPES = {".png": "image/png", ".woff2": "font/woff2", ".js": "text/javascript"}
+
+
+class StandInServer:
+    """
+    提供模擬對話頁與 /backend-api/conversation：
+    回答在 latency ± jitter 秒後開始，分成 chunks 段、每段間隔 chunk_delay 秒串流送出；
+    /static/ 下的資源（圖片、字型、追蹤程式）每個延遲 asset_delay 秒才回應。
+    """
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.5, chunks: int = 10,
+                 chunk_delay: float = 0.1, asset_delay: float = 0.5, port: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.asset_delay = asset_delay
+        self.requests = 0
+        self.asset_requests = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def answer(self, prompt: str) -> str:
+        return f"關於「{prompt}」的模擬回答。" * 3
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path.startswith("/static/"):
+                    with server._lock:
+                        server.asset_requests += 1
+                    time.sleep(server.asset_delay)
+                    content_type = STATIC_TYPES.get(os.path.splitext(path)[1], "application/octet-stream")
+                    self._send(200, b"\0" * 20000, content_type)
+                    return
+                if path not in ("/", "/index.html"):
+                    self._send(404, b"not found", "text/plain")
+                    return
+                with open(STANDIN_PAGE, "rb") as f:
+                    self._send(200, f.read(), "text/html; charset=utf-8")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                prompt = json.loads(self.rfile.read(length) or b"{}").get("prompt", "")
+                with server._lock:
+                    server.requests += 1
+                time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+                # 不給 Content-Length，逐段寫出後關閉連線（HTTP/1.0 串流）
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.end_headers()
+                answer = server.answer(prompt)
+                size = max(1, -(-len(answer) // server.chunks))
+                for i in range(0, len(answer), size):
+                    self.wfile.write(answer[i:i + size].encode("utf-8"))
+                    self.wfile.flush()
+                    time.sleep(server.chunk_delay)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測 hw3 批次模式的每分鐘問題數")
+    parser.add_argument("--prompts", type=int, default=24, help="問題數")
+    parser.add_argument("--contexts", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--latency", type=float, default=1.5, help="模擬回答延遲（秒）")
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--chunks", type=int, default=10, help="回答分幾段串流")
+    parser.add_argument("--chunk-delay", type=float, default=0.1, help="每段間隔（秒）")
+    parser.add_argument("--asset-delay", type=float, default=0.5, help="圖片/字型/追蹤程式的回應延遲（秒）")
+    parser.add_argument("--compare-blocking", action="store_true", help="另跑一次不攔截資源的對照組")
+    args = parser.parse_args()
+
+    server = StandInServer(args.latency, args.jitter, args.chunks, args.chunk_delay,
+                           args.asset_delay).start()
+    work_dir = tempfile.mkdtemp(prefix="bench_hw3_")
+    prompts = [f"第 {i + 1} 個測試問題" for i in range(args.prompts)]
+    stream_seconds = args.chunks * args.chunk_delay
+    print(f"模擬頁 {server.url}，{len(prompts)} 題，回答延遲 {args.latency}±{args.jitter} 秒"
+          f" + 串流 {stream_seconds:.1f} 秒")
+    print(f"原本固定等待流程：每題至少 {FIXED_WAIT_SECONDS} 秒，約 {60 / FIXED_WAIT_SECONDS:.1f} 題/分鐘")
+    modes = [True, False] if args.compare_blocking else [hw3.BLOCK_RESOURCES]
+    try:
+        for block in modes:
+            for contexts in args.contexts:
+                label = f"{contexts}_{'block' if block else 'noblock'}"
+                out_path = os.path.join(work_dir, f"answers_{label}.jsonl")
+                assets_before = server.asset_requests
+                succeeded, seconds = asyncio.run(hw3.run_batch(
+                    prompts, out_path, contexts, server.url,
+                    profile_dir=os.path.join(work_dir, f"profiles_{label}"), block=block))
+                with open(out_path, "r", encoding="utf-8") as f:
+                    records = [json.loads(line) for line in f]
+                per_prompt = [r["seconds"] for r in records if "answer" in r]
+                first = [r["first_chunk_seconds"] for r in records if r.get("first_chunk_seconds")]
+                complete = sum(1 for r in records if r.get("answer") == server.answer(r["prompt"]))
+                print(f"== {contexts} 個 context，{'攔截' if block else '不攔截'}資源："
+                      f"成功 {succeeded}/{len(prompts)}（完整 {complete}），耗時 {seconds:.1f} 秒，"
+                      f"{len(prompts) / seconds * 60:.1f} 題/分鐘")
+                if per_prompt:
+                    print(f"   每題平均 {sum(per_prompt) / len(per_prompt):.2f} 秒"
+                          f"（首段 {sum(first) / max(len(first), 1):.2f} 秒），"
+                          f"靜態資源請求 {server.asset_requests - assets_before} 個")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
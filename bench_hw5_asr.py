@@ -0,0 +1,147 @@
+"""
+hw5 轉錄後端量測
+
+在本機樣本集上比較各轉錄後端的速度與準確度。樣本資料夾中每個音檔需有同名的 .txt 參考逐字稿
+（例如 call01.wav + call01.txt）。每個音檔只解碼一次，所有後端都吃同一份 16 kHz 緩衝區，
+因此量到的是純推論時間：
+  - 載入時間：模型匯入 + 載入
+  - RTF (real-time factor)：轉錄耗時 / 音訊長度，越小越快，< 1 代表比即時快
+  - WER：以空白分詞的詞錯誤率；CER：去除空白與標點後的字錯誤率（中文以 CER 為準）
+
+用法：
+    python bench_hw5_asr.py samples/ --backends whisper:medium faster-whisper:medium:int8
+    python bench_hw5_asr.py samples/ --backends faster-whisper:small --threads 4 --trim --json asr.json
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+import hw5_asr
+import hw5_audio
+
+AUDIO_EXTS = {'.wav', '.mp3', '.m4a', '.ogg', '.flac', '.mp4', '.mov', '.avi', '.mkv'}
+PUNCTUATION = re.compile(r"[^\w\s]|_")
+
+
+def collect_samples(sample_dir: str):
+    """ 回傳 [(音檔路徑, 參考逐字稿)]，沒有對應 .txt 的音檔略過 """
+    samples = []
+    for name in sorted(os.listdir(sample_dir)):
+        stem, ext = os.path.splitext(name)
+        ref_path = os.path.join(sample_dir, stem + ".txt")
+        if ext.lower() in AUDIO_EXTS and os.path.exists(ref_path):
+            with open(ref_path, "r", encoding="utf-8") as f:
+                samples.append((os.path.join(sample_dir, name), f.read()))
+    return samples
+
+
+def edit_distance(ref, hyp) -> int:
+    """ Levenshtein 距離（逐列動態規劃，只保留一列） """
+    row = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (r != h))
+    return row[-1]
+
+
+def normalize(text: str) -> str:
+    return PUNCTUATION.sub(" ", text.lower())
+
+
+def word_tokens(text: str):
+    return normalize(text).split()
+
+
+def char_tokens(text: str):
+    return list("".join(normalize(text).split()))
+
+
+def error_counts(ref: str, hyp: str):
+    """ 回傳 (詞錯誤數, 參考詞數, 字錯誤數, 參考字數)，合計後再相除得到整體 WER/CER """
+    ref_words, ref_chars = word_tokens(ref), char_tokens(ref)
+    return (edit_distance(ref_words, word_tokens(hyp)), len(ref_words),
+            edit_distance(ref_chars, char_tokens(hyp)), len(ref_chars))
+
+
+def load_samples(samples, trim: bool):
+    """ 每個音檔解碼一次並複製到記憶體，回傳 [(名稱, 音訊, 原始秒數, 參考逐字稿)] """
+    loaded = []
+    for path, reference in samples:
+        with hw5_audio.PreprocessedAudio(path, trim=trim) as pre:
+            loaded.append((os.path.basename(path), np.array(pre.trimmed),
+                           pre.original_seconds, reference))
+    return loaded
+
+
+def bench_backend(backend, loaded, language: str):
+    start = time.perf_counter()
+    backend.load()
+    load_time = time.perf_counter() - start
+    print(f"\n== {backend.describe()}：載入 {load_time:.1f} 秒")
+
+    total_audio = total_time = 0.0
+    word_err = words = char_err = chars = 0
+    for name, audio, seconds, reference in loaded:
+        start = time.perf_counter()
+        text = backend.transcribe(audio, language=language)["text"] if len(audio) else ""
+        elapsed = time.perf_counter() - start
+        we, wn, ce, cn = error_counts(reference, text)
+        total_audio += seconds
+        total_time += elapsed
+        word_err, words, char_err, chars = word_err + we, words + wn, char_err + ce, chars + cn
+        print(f"{name}: {seconds:.1f} 秒音訊，轉錄 {elapsed:.1f} 秒 (RTF {elapsed / seconds:.3f})，"
+              f"WER {we / max(wn, 1):.3f}，CER {ce / max(cn, 1):.3f}")
+
+    return {"backend": backend.describe(), "load_seconds": round(load_time, 2),
+            "audio_seconds": round(total_audio, 1), "transcribe_seconds": round(total_time, 2),
+            "rtf": round(total_time / total_audio, 4) if total_audio else None,
+            "wer": round(word_err / max(words, 1), 4), "cer": round(char_err / max(chars, 1), 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較轉錄後端的 RTF 與 WER/CER")
+    parser.add_argument("sample_dir", help="含音檔與同名 .txt 參考逐字稿的資料夾")
+    parser.add_argument("--backends", nargs="+", default=["whisper", "faster-whisper"],
+                        help="後端規格 引擎[:模型[:精度]]，例如 faster-whisper:small:int8")
+    parser.add_argument("--threads", type=int, default=None, help="推論執行緒數（預設依 HW5_ASR_THREADS）")
+    parser.add_argument("--language", default="zh")
+    parser.add_argument("--trim", action="store_true", help="先裁切靜音再轉錄（與 hw5 預設流程相同）")
+    parser.add_argument("--json", help="將結果另存為 JSON")
+    args = parser.parse_args()
+
+    samples = collect_samples(args.sample_dir)
+    if not samples:
+        parser.error("資料夾中沒有找到「音檔 + 同名 .txt」的樣本")
+    loaded = load_samples(samples, args.trim)
+    print(f"共 {len(loaded)} 個樣本，音訊合計 {sum(item[2] for item in loaded):.1f} 秒")
+
+    results = []
+    for spec in args.backends:
+        backend = hw5_asr.parse_spec(spec)
+        if args.threads is not None:
+            backend.threads = args.threads
+        try:
+            results.append(bench_backend(backend, loaded, args.language))
+        except Exception as e:
+            print(f"{spec} 量測失敗: {e}")
+            results.append({"backend": spec, "error": str(e)})
+
+    print(f"\n{'後端':<42}{'載入(秒)':>10}{'RTF':>8}{'WER':>8}{'CER':>8}")
+    for row in results:
+        if "error" in row:
+            print(f"{row['backend']:<42}  失敗：{row['error']}")
+        else:
+            print(f"{row['backend']:<42}{row['load_seconds']:>10.1f}{row['rtf']:>8.3f}"
+                  f"{row['wer']:>8.3f}{row['cer']:>8.3f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
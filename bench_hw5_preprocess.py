@@ -0,0 +1,110 @@
+"""
+hw5 音訊前處理量測
+
+對每個音檔量測：
+  - 一次解碼 + 裁切靜音的耗時
+  - 原始秒數、裁切後秒數與省下的音訊秒數
+  - (可選 --transcribe) Whisper 直接吃原始檔 vs 吃裁切後緩衝區的轉錄耗時與加速倍率
+
+用法：
+    python bench_hw5_preprocess.py recordings/ --transcribe --model small
+    python bench_hw5_preprocess.py --synthetic 120     # 產生 120 秒含長靜音的測試音檔
+"""
+import argparse
+import os
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+import hw5_audio
+
+AUDIO_EXTS = {'.wav', '.mp3', '.m4a', '.ogg', '.flac', '.mp4', '.mov', '.avi', '.mkv'}
+
+
+def make_synthetic(seconds: int, path: str):
+    """ 產生「語音（調變音）與長靜音交錯」的 16 kHz wav，模擬客服錄音中的等待時間 """
+    rng = np.random.default_rng(0)
+    sr = hw5_audio.SAMPLE_RATE
+    pieces = []
+    total = 0
+    while total < seconds * sr:
+        talk = int(rng.uniform(2, 8) * sr)
+        t = np.arange(talk) / sr
+        pieces.append(0.3 * np.sin(2 * np.pi * 220 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)))
+        quiet = int(rng.uniform(1, 12) * sr)
+        pieces.append(rng.normal(0, 0.002, quiet))
+        total += talk + quiet
+    audio = np.clip(np.concatenate(pieces)[:seconds * sr], -1, 1)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes((audio * 32767).astype(np.int16).tobytes())
+
+
+def collect(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if os.path.splitext(name)[1].lower() in AUDIO_EXTS)
+        else:
+            files.append(path)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測解碼與裁切靜音省下的音訊秒數與轉錄加速")
+    parser.add_argument("paths", nargs="*", help="音檔或資料夾")
+    parser.add_argument("--synthetic", type=int, default=0, help="產生指定秒數的測試音檔")
+    parser.add_argument("--transcribe", action="store_true", help="一併比較 Whisper 轉錄耗時")
+    parser.add_argument("--model", default="base", help="--transcribe 使用的 Whisper 模型")
+    args = parser.parse_args()
+
+    files = collect(args.paths)
+    if args.synthetic:
+        path = os.path.join(tempfile.mkdtemp(prefix="bench_pre_"), "synthetic.wav")
+        make_synthetic(args.synthetic, path)
+        files.append(path)
+    if not files:
+        parser.error("請提供音檔、資料夾或 --synthetic")
+
+    model = None
+    if args.transcribe:
+        import whisper
+        model = whisper.load_model(args.model, device="cpu")
+
+    total_original = total_trimmed = total_raw_asr = total_trim_asr = 0.0
+    for path in files:
+        start = time.perf_counter()
+        with hw5_audio.PreprocessedAudio(path) as pre:
+            prep_time = time.perf_counter() - start
+            total_original += pre.original_seconds
+            total_trimmed += pre.trimmed_seconds
+            line = f"{os.path.basename(path)}: {pre.summary()}，前處理 {prep_time:.2f} 秒"
+            if model is not None:
+                start = time.perf_counter()
+                model.transcribe(path, language="zh", fp16=False)
+                raw_asr = time.perf_counter() - start
+                start = time.perf_counter()
+                if len(pre.trimmed):
+                    model.transcribe(pre.trimmed, language="zh", fp16=False)
+                trim_asr = time.perf_counter() + prep_time - start
+                total_raw_asr += raw_asr
+                total_trim_asr += trim_asr
+                line += (f"，轉錄 原始 {raw_asr:.1f} 秒 / 前處理+裁切後 {trim_asr:.1f} 秒"
+                         f"（{raw_asr / trim_asr:.2f}x）")
+        print(line)
+
+    saved = total_original - total_trimmed
+    print(f"\n合計：音訊 {total_original:.1f} 秒 -> {total_trimmed:.1f} 秒，省下 {saved:.1f} 秒"
+          f"（{saved / total_original * 100 if total_original else 0:.0f}%）")
+    if model is not None and total_trim_asr:
+        print(f"轉錄總耗時：{total_raw_asr:.1f} 秒 -> {total_trim_asr:.1f} 秒"
+              f"（{total_raw_asr / total_trim_asr:.2f}x）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+hw5 轉錄服務負載量測
+
+啟動 hw5_whisper_service 子行程，以多個並行客戶端送出長短混合的錄音，量測：
+  - 每個請求的端到端延遲（短錄音 / 長錄音分開統計 p50 / p95）
+  - 吞吐量（每秒處理的音訊秒數）與服務端平均排隊時間
+  - 服務行程的常駐記憶體（模型只載入一份，與 UI worker 數無關）
+預設比較 sjf（短工作優先）與 fifo 兩種排程；預設使用 stub 後端，不需要 Whisper 即可量測排程行為。
+
+用法：
+    python bench_hw5_service.py --clients 8 --requests 4
+    python bench_hw5_service.py --backend faster-whisper:small:int8 --samples recordings/ --policies sjf
+"""
+import argparse
+import os
+import random
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+import hw5_audio
+import hw5_whisper_service
+
+
+def make_tone(path: str, seconds: float):
+    sr = hw5_audio.SAMPLE_RATE
+    t = np.arange(int(seconds * sr)) / sr
+    audio = 0.3 * np.sin(2 * np.pi * 220 * t)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes((audio * 32767).astype(np.int16).tobytes())
+
+
+def make_samples(work_dir: str, short_s: float, long_s: float):
+    """ 產生長短兩種測試音檔，回傳 [(路徑, 類別)] """
+    samples = []
+    for i in range(3):
+        for kind, seconds in (("short", short_s), ("long", long_s)):
+            path = os.path.join(work_dir, f"{kind}{i}.wav")
+            make_tone(path, seconds)
+            samples.append((path, kind))
+    return samples
+
+
+def collect_samples(sample_dir: str, long_threshold: float):
+    samples = []
+    for name in sorted(os.listdir(sample_dir)):
+        path = os.path.join(sample_dir, name)
+        seconds = hw5_audio.audio_duration(path)
+        if seconds:
+            samples.append((path, "long" if seconds >= long_threshold else "short"))
+    return samples
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_service(address: str, backend: str, policy: str, workers: int, trim: bool):
+    # 服務與本行程的客戶端共用一把隨機密鑰，不寫入使用者的密鑰檔
+    os.environ.setdefault("HW5_ASR_SERVICE_KEY", secrets.token_hex(32))
+    cmd = [sys.executable, "hw5_whisper_service.py", "serve", "--address", address,
+           "--backend", backend, "--policy", policy, "--workers", str(workers)]
+    if not trim:
+        cmd.append("--no-trim")
+    proc = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL)
+    deadline = time.time() + 600  # 真實模型載入可能需要數分鐘
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("轉錄服務啟動失敗")
+        try:
+            hw5_whisper_service.service_info(address)
+            return proc
+        except hw5_whisper_service.ServiceError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("等待轉錄服務啟動逾時")
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def run_load(address: str, samples, clients: int, requests: int, seed: int = 0):
+    """ clients 個執行緒各送 requests 個請求，回傳 (每筆 (類別, 延遲, 是否成功), 總耗時) """
+    rng = random.Random(seed)
+    plan = [[rng.choice(samples) for _ in range(requests)] for _ in range(clients)]
+    results = []
+    lock = threading.Lock()
+
+    def client(jobs):
+        for path, kind in jobs:
+            start = time.perf_counter()
+            try:
+                hw5_whisper_service.transcribe_remote(path, address=address)
+                ok = True
+            except hw5_whisper_service.ServiceError:
+                ok = False
+            with lock:
+                results.append((kind, time.perf_counter() - start, ok))
+
+    threads = [threading.Thread(target=client, args=(jobs,)) for jobs in plan]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def service_rss_mb(pid: int):
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / 2 ** 20
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測共用轉錄服務在並行負載下的延遲與吞吐量")
+    parser.add_argument("--backend", default="stub", help="服務端後端規格，預設 stub")
+    parser.add_argument("--samples", help="使用資料夾中的真實音檔（預設產生測試音檔）")
+    parser.add_argument("--clients", type=int, default=6, help="並行客戶端數（模擬 UI worker）")
+    parser.add_argument("--requests", type=int, default=4, help="每個客戶端送出的請求數")
+    parser.add_argument("--workers", type=int, default=1, help="服務端推論執行緒數")
+    parser.add_argument("--policies", nargs="+", default=["sjf", "fifo"])
+    parser.add_argument("--short", type=float, default=10.0, help="測試短音檔秒數")
+    parser.add_argument("--long", type=float, default=120.0, help="測試長音檔秒數")
+    parser.add_argument("--stub-rtf", default="0.02", help="stub 後端的模擬 RTF")
+    args = parser.parse_args()
+
+    os.environ.setdefault("HW5_ASR_STUB_RTF", args.stub_rtf)
+    if args.samples:
+        samples = collect_samples(args.samples, (args.short + args.long) / 2)
+        trim = True
+    else:
+        samples = make_samples(tempfile.mkdtemp(prefix="bench_svc_"), args.short, args.long)
+        trim = False  # 測試音檔是純音，不需裁切，也不需要 ffmpeg
+    if not samples:
+        parser.error("沒有可用的音檔")
+
+    print(f"後端 {args.backend}，{args.clients} 個客戶端 × {args.requests} 個請求，"
+          f"服務端 {args.workers} 個推論執行緒")
+    for policy in args.policies:
+        address = f"127.0.0.1:{free_port()}"
+        proc = start_service(address, args.backend, policy, args.workers, trim)
+        try:
+            results, wall = run_load(address, samples, args.clients, args.requests)
+            stats = hw5_whisper_service.request("stats", address, timeout=10)
+            rss = service_rss_mb(proc.pid)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+        print(f"\n== 排程 {policy}")
+        for kind in ("short", "long"):
+            latencies = [lat for k, lat, ok in results if k == kind and ok]
+            if latencies:
+                print(f"  {kind:<5} n={len(latencies):<3} p50 {percentile(latencies, 50):6.2f} 秒  "
+                      f"p95 {percentile(latencies, 95):6.2f} 秒  平均 {statistics.mean(latencies):6.2f} 秒")
+        failures = sum(1 for _, _, ok in results if not ok)
+        print(f"  總耗時 {wall:.1f} 秒，吞吐量 {stats['audio_seconds'] / wall:.1f} 音訊秒/秒，"
+              f"平均排隊 {stats['avg_queue_seconds']:.2f} 秒，失敗 {failures} 筆")
+        if rss is not None:
+            print(f"  服務行程記憶體 {rss:.0f} MB（所有客戶端共用一份模型）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+hw5 啟動時間量測
+
+以獨立子行程重複匯入 hw5，量測：
+  - import hw5 的總耗時（使用者開啟 UI 前必須等待的時間）
+  - 建立 Gradio 介面的耗時
+  - (可選 --whisper) Whisper 匯入與模型載入耗時，也就是第一次音訊請求最多需多等的時間
+
+用法：
+    python bench_hw5_startup.py --runs 5
+    python bench_hw5_startup.py --runs 3 --whisper
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import hw5
+result = {"import_total": time.perf_counter() - t0}
+t0 = time.perf_counter()
+hw5.build_demo()
+result["build_ui"] = time.perf_counter() - t0
+if WITH_WHISPER:
+    hw5.load_whisper_model()
+result.update(hw5.STARTUP_TIMINGS)
+print("__RESULT__" + json.dumps(result))
+"""
+
+
+def run_once(with_whisper: bool) -> dict:
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "benchmark-dummy-key")
+    code = PROBE.replace("WITH_WHISPER", "True" if with_whisper else "False")
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True,
+                          text=True, encoding="utf-8", env=env,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    for line in proc.stdout.splitlines():
+        if line.startswith("__RESULT__"):
+            return json.loads(line[len("__RESULT__"):])
+    raise RuntimeError(f"子行程執行失敗：\n{proc.stderr}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測 hw5 啟動時間")
+    parser.add_argument("--runs", type=int, default=5, help="重複次數")
+    parser.add_argument("--whisper", action="store_true",
+                        help="一併量測 Whisper 模型載入時間")
+    args = parser.parse_args()
+
+    runs = [run_once(args.whisper) for _ in range(args.runs)]
+    phases = sorted({k for r in runs for k in r})
+    print(f"{'階段':<20}{'平均(秒)':>10}{'最小(秒)':>10}{'最大(秒)':>10}")
+    for phase in phases:
+        values = [r[phase] for r in runs if phase in r]
+        print(f"{phase:<20}{statistics.mean(values):>10.3f}"
+              f"{min(values):>10.3f}{max(values):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
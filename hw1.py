@@ -11,6 +11,7 @@ from autogen_agentchat.teams import RoundRobinGroupChat
 from autogen_agentchat.messages import TextMessage
 from autogen_ext.models.openai import OpenAIChatCompletionClient
 from autogen_ext.agents.web_surfer import MultimodalWebSurfer
+import llm_gateway
 
 load_dotenv()
 #hw1 
@@ -74,9 +75,14 @@ async def main():
         return
 
     # 初始化模型用戶端 (此處示範使用 gemini-2.0-flash)
+    # 透過 llm_gateway 的連線池送出，共用併發上限、退避重試與斷路器
+    gateway = llm_gateway.get_gateway()
     model_client = OpenAIChatCompletionClient(
         model="gemini-2.0-flash",
         api_key=gemini_api_key,
+        base_url=gateway.openai_base_url,
+        http_client=gateway.http_client(),
+        max_retries=0,  # 重試交給閘道處理
     )
     
     termination_condition = TextMentionTermination("exit")
@@ -108,6 +114,8 @@ async def main():
     output_file = "all_conversation_log.csv"
     df_log.to_csv(output_file, index=False, encoding="utf-8-sig")
     print(f"已將所有對話紀錄輸出為 {output_file}")
+    await llm_gateway.close_gateway()
+    print(llm_gateway.report())
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -1,11 +1,17 @@
+import argparse
 import os
 import json
 import time
+import httpx
 import pandas as pd
 import sys
+from functools import lru_cache
 from dotenv import load_dotenv
-from google import genai
-from google.genai.errors import ServerError
+import hw2_store
+import llm_gateway
+import model_router
+import tracing
+from prompt_cache import GatewayContextCache, PromptCache, PromptTemplate
 
 # 載入 .env 中的 GEMINI_API_KEY
 load_dotenv()
@@ -57,7 +63,9 @@ def select_dialogue_column(chunk: pd.DataFrame) -> str:
     print("CSV 欄位：", list(chunk.columns))
     return chunk.columns[0]
 #HW2 評分標準的prompt的prompt
-def process_batch_dialogue(client, dialogues, delimiter="-----"):
+@lru_cache(maxsize=None)
+def rubric_template(delimiter="-----"):
+    """ 評分標準為固定前綴，只組一次；每批逐字稿接在後面 """
     prompt = (
         "你是一位客服對話質量分析專家，請根據以下標準評估客服專員的服務質量：\n"
         + "".join([f"{i+1}. {item}\n" for i, item in enumerate(ITEMS)]) +
@@ -69,56 +77,85 @@ def process_batch_dialogue(client, dialogues, delimiter="-----"):
         "- 5：優秀，遠超標準\n"
         "\n請對每筆逐字稿產生 JSON 格式回覆，並在各筆結果間用下列分隔線隔開：\n"
         f"{delimiter}\n"
+        "每筆 JSON 最後請加上「信心」欄位，以 0 到 1 之間的數字表示你對這筆評分的把握程度。\n"
         "例如：\n"
         "```json\n"
-        "{\n  \"溝通技巧（語速與音量適當性）\": \"4\",\n  \"溝通技巧（語言表達流暢性）\": \"3\",\n  ...\n}\n"
+        "{\n  \"溝通技巧（語速與音量適當性）\": \"4\",\n  \"溝通技巧（語言表達流暢性）\": \"3\",\n  ...\n  \"信心\": \"0.9\"\n}\n"
         f"{delimiter}\n"
         "{{...}}\n```"
     )
+    return PromptTemplate("hw2 評分標準", prompt, "\n\n")
 
-    batch_text = f"\n{delimiter}\n".join(dialogues)
-    content = prompt + "\n\n" + batch_text
+
+prompt_cache = PromptCache(GatewayContextCache())
+# 便宜模型先評分，分數缺漏或信心不足的逐字稿才重新組批交給大模型 (見 model_router.py)
+SCORING_ROUTER = model_router.ModelRouter("hw2 評分", prompt_cache.generate)
+
+
+def verdict_for(result) -> model_router.Verdict:
+    """ 一筆評分結果：每個項目都要有 1~5 分；「信心」欄位移出結果另外記錄 """
+    confidence = model_router.parse_confidence(result.pop("信心", None))
+    ok = all(hw2_store.parse_score(result.get(item)) is not None for item in ITEMS)
+    return model_router.Verdict(ok, "缺少或無效分數", confidence, result)
+
+
+def parse_batch(response_text, dialogues, delimiter="-----"):
+    print("批次 API 回傳內容：", response_text)
+    parts = [part for part in response_text.split(delimiter) if part.strip()]
+    # 多出的結果捨棄，不足的由路由器視為未通過
+    return [verdict_for(parse_response(part)) for part in parts[:len(dialogues)]]
+
+
+def process_batch_dialogue(dialogues, delimiter="-----"):
+    template = prompt_cache.register(rubric_template(delimiter))
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=content
-        )
-        print("批次 API 回傳內容：", response.text)
-        parts = response.text.split(delimiter)
-        results = [parse_response(part) for part in parts]
-
-        # 確保回傳結果數量正確
-        if len(results) > len(dialogues):
-            results = results[:len(dialogues)]
-        elif len(results) < len(dialogues):
-            results.extend([{item: "" for item in ITEMS}] * (len(dialogues) - len(results)))
+        with tracing.span("analyse", dialogues=len(dialogues)) as span:
+            routed = SCORING_ROUTER.route_items(
+                dialogues, lambda batch: template.render(f"\n{delimiter}\n".join(batch)),
+                lambda text, batch: parse_batch(text, batch, delimiter))
+            span.set(escalated=sum(r.escalated for r in routed))
+        # 最後一層仍未通過時 value 可能是整份回覆文字，改回空白評分
+        results = [r.value if isinstance(r.value, dict) else {item: "" for item in ITEMS} for r in routed]
 
         print("處理結果：")
         for result in results:
             print(json.dumps(result, ensure_ascii=False, indent=2))
         return results
-    except ServerError as e:
+    except (llm_gateway.GatewayError, httpx.HTTPError) as e:
+        # 閘道重試用盡後，連線或讀取逾時會以 httpx 例外拋出；與 API 錯誤一樣以空白評分帶過這一批
         print(f"API 呼叫失敗：{e}")
         return [{item: "" for item in ITEMS} for _ in dialogues]
 
+@tracing.traced("hw2")
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python customer_analysis.py <path_to_csv>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="客服對話評分，結果寫入 CSV 並累積到 SQLite 分析庫")
+    parser.add_argument("csv", help="逐字稿 CSV")
+    parser.add_argument("--agent", help="CSV 沒有專員欄位時，這批對話的專員名稱")
+    parser.add_argument("--session", help="CSV 沒有對話編號欄位時的對話代號（預設為檔名）")
+    parser.add_argument("--store", default=hw2_store.DEFAULT_DB_PATH, help="SQLite 分析庫路徑")
+    parser.add_argument("--no-store", action="store_true", help="只輸出 CSV，不寫入分析庫")
+    args = parser.parse_args()
 
-    input_csv = sys.argv[1]
+    input_csv = args.csv
     output_csv = "customer_analysis.csv"
     if os.path.exists(output_csv):
         os.remove(output_csv)
 
-    df = pd.read_csv(input_csv)
+    tracing.annotate(file=os.path.basename(input_csv))
+    with tracing.span("read_csv", bytes=os.path.getsize(input_csv)) as span:
+        df = pd.read_csv(input_csv)
+        span.set(rows=len(df))
     gemini_api_key = os.environ.get("GEMINI_API_KEY")
     if not gemini_api_key:
         raise ValueError("請設定環境變數 GEMINI_API_KEY")
-    client = genai.Client(api_key=gemini_api_key)
 
     dialogue_col = select_dialogue_column(df)
     print(f"使用欄位作為逐字稿：{dialogue_col}")
+    agent_col = hw2_store.pick_column(df.columns, hw2_store.AGENT_COLUMNS)
+    session_col = hw2_store.pick_column(df.columns, hw2_store.SESSION_COLUMNS)
+    session_key = args.session or os.path.basename(input_csv)
+    store = None if args.no_store else hw2_store.ScoreStore(args.store)
+    run_id = store.start_run(os.path.basename(input_csv), SCORING_ROUTER.label) if store else None
 
     batch_size = 10
     total = len(df)
@@ -127,7 +164,8 @@ def main():
         batch = df.iloc[start_idx:end_idx]
         dialogues = batch[dialogue_col].tolist()
         dialogues = [str(d).strip() for d in dialogues]
-        batch_results = process_batch_dialogue(client, dialogues)
+        with tracing.span("batch", start=start_idx, rows=len(dialogues)):
+            batch_results = process_batch_dialogue(dialogues)
         batch_df = batch.copy()
         for item in ITEMS:
             batch_df[item] = [res.get(item, "") for res in batch_results]
@@ -135,10 +173,25 @@ def main():
             batch_df.to_csv(output_csv, index=False, encoding="utf-8-sig")
         else:
             batch_df.to_csv(output_csv, mode='a', index=False, header=False, encoding="utf-8-sig")
+        if store:
+            # 每批一個交易寫入分析庫，中途中斷也保留已完成的批次
+            records = batch.to_dict("records")
+            with tracing.span("store", rows=len(records)):
+                store.add_scores(run_id, [
+                    (start_idx + i, {item: res.get(item, "") for item in ITEMS},
+                     str(record[session_col]) if session_col and pd.notna(record[session_col]) else session_key,
+                     str(record[agent_col]) if agent_col and pd.notna(record[agent_col]) else args.agent)
+                    for i, (record, res) in enumerate(zip(records, batch_results))])
         print(f"已處理 {end_idx} 筆 / {total}")
         time.sleep(1)
 
     print("全部處理完成。最終結果已寫入：", output_csv)
+    if store:
+        print(f"評分已寫入分析庫 {args.store}（執行 #{run_id}），可用 hw2_store.py rollup / trend 查詢")
+        store.close()
+    print(prompt_cache.report())
+    print(model_router.report())
+    print(llm_gateway.report())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
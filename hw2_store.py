@@ -0,0 +1,357 @@
+"""
+hw2 客服評分的 SQLite 分析庫
+
+hw2.py 每次執行都覆寫同一份 customer_analysis.csv，要回答「某位專員的『耐心與情緒管理』逐月變化」
+只能把所有歷史 CSV 重新用 pandas 讀一遍。這裡把評分逐批寫進本機 SQLite：
+  - runs：每次執行（來源檔、模型、時間）
+  - sessions：每段對話（所屬執行、對話代號、專員）
+  - criteria：評分項目，一個項目一列
+  - scores：一筆逐字稿的一個項目一列 (長表)，只存 1–5 的有效分數
+  - monthly：各項目 × 專員 × 月份的分數總和與筆數，與 scores 在同一個交易中更新
+索引皆為涵蓋索引（查詢需要的欄位都在索引裡，不必回表）：
+  - 依執行 (run_id, criterion_id, score)、依對話 (session_id, criterion_id, score)
+  - 依時間 (scored_at, criterion_id, score)
+  - 趨勢 (criterion_id, agent, scored_at, score)
+不限時間範圍的彙總與逐月 / 逐年趨勢直接讀 monthly，資料量再大也只需掃過幾百列；
+指定時間範圍、逐日 / 逐週或依執行、對話的查詢才走 scores 的索引。
+寫入以批次交易 (executemany) 進行，WAL 模式下讀取不會被寫入擋住。
+
+用法：
+    python hw2_store.py ingest 舊結果/*.csv --agent 王小明 --at 2025-03-01   # 匯入歷史 CSV
+    python hw2_store.py rollup --by agent --since 2025-01-01
+    python hw2_store.py trend 耐心與情緒管理 --agent 王小明 --period month
+"""
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_DB_PATH = os.getenv("HW2_STORE_PATH", "hw2_scores.db")
+DEFAULT_AGENT = "未指定"
+# CSV 中可能存放專員 / 對話代號的欄位名稱
+AGENT_COLUMNS = ["agent", "Agent", "專員", "客服專員", "客服人員"]
+SESSION_COLUMNS = ["session", "session_id", "Session", "對話編號", "會話編號"]
+INGEST_BATCH_ROWS = 5000
+PERIOD_FORMATS = {"day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m", "year": "%Y"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    source TEXT,
+    model TEXT,
+    rows INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    session_key TEXT NOT NULL,
+    agent TEXT NOT NULL,
+    UNIQUE (run_id, session_key)
+);
+CREATE TABLE IF NOT EXISTS criteria (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS scores (
+    run_id INTEGER NOT NULL,
+    session_id INTEGER NOT NULL,
+    agent TEXT NOT NULL,
+    criterion_id INTEGER NOT NULL,
+    row_index INTEGER NOT NULL,
+    scored_at REAL NOT NULL,
+    score INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS monthly (
+    criterion_id INTEGER NOT NULL,
+    agent TEXT NOT NULL,
+    month TEXT NOT NULL,
+    score_sum INTEGER NOT NULL,
+    score_count INTEGER NOT NULL,
+    PRIMARY KEY (criterion_id, agent, month)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_scores_run ON scores (run_id, criterion_id, score);
+CREATE INDEX IF NOT EXISTS idx_scores_session ON scores (session_id, criterion_id, score);
+CREATE INDEX IF NOT EXISTS idx_scores_time ON scores (scored_at, criterion_id, score);
+CREATE INDEX IF NOT EXISTS idx_scores_trend ON scores (criterion_id, agent, scored_at, score);
+CREATE INDEX IF NOT EXISTS idx_sessions_agent ON sessions (agent);
+"""
+
+
+def parse_score(value):
+    """ 把模型回傳的分數（"4"、4、"4 分"）轉成 1–5 的整數，無效則回傳 None """
+    if value is None:
+        return None
+    match = re.match(r"\s*(\d+)(?:\.0+)?(?!\d|\.\d)", str(value))
+    if not match:
+        return None
+    score = int(match.group(1))
+    return score if 1 <= score <= 5 else None
+
+
+def parse_time(value) -> float:
+    """ 接受 epoch 秒數、datetime 或 ISO 日期字串（2025-03-01 / 2025-03-01T10:00） """
+    if value is None:
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.fromisoformat(str(value)).timestamp()
+
+
+def pick_column(columns, candidates):
+    for name in candidates:
+        if name in columns:
+            return name
+    return None
+
+
+class ScoreStore:
+    """ 評分分析庫；同一個物件可在多個執行緒共用（寫入以鎖保護） """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._criteria = dict(self.conn.execute("SELECT name, id FROM criteria"))
+        self._sessions = {}
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ----- 寫入 -----
+
+    def _criterion_id(self, name: str) -> int:
+        if name not in self._criteria:
+            self.conn.execute("INSERT OR IGNORE INTO criteria (name) VALUES (?)", (name,))
+            self._criteria[name] = self.conn.execute(
+                "SELECT id FROM criteria WHERE name = ?", (name,)).fetchone()[0]
+        return self._criteria[name]
+
+    def _session_id(self, run_id: int, session_key: str, agent: str) -> int:
+        key = (run_id, session_key)
+        if key not in self._sessions:
+            self.conn.execute("INSERT OR IGNORE INTO sessions (run_id, session_key, agent) VALUES (?, ?, ?)",
+                              (run_id, session_key, agent))
+            self._sessions[key] = self.conn.execute(
+                "SELECT id FROM sessions WHERE run_id = ? AND session_key = ?", key).fetchone()[0]
+        return self._sessions[key]
+
+    def start_run(self, source: str = None, model: str = None, started_at=None) -> int:
+        with self._lock:
+            cursor = self.conn.execute("INSERT INTO runs (started_at, source, model) VALUES (?, ?, ?)",
+                                       (parse_time(started_at), source, model))
+            return cursor.lastrowid
+
+    def add_scores(self, run_id: int, rows, scored_at=None) -> int:
+        """
+        在一個交易中寫入一批評分。rows 為 (row_index, 評分 dict, 對話代號, 專員) 的序列；
+        評分 dict 的鍵為評分項目名稱。回傳寫入的分數筆數。
+        """
+        scored_at = parse_time(scored_at)
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                records = []
+                row_count = 0
+                for row_index, result, session_key, agent in rows:
+                    row_count += 1
+                    agent = agent or DEFAULT_AGENT
+                    session_id = self._session_id(run_id, session_key, agent)
+                    for name, value in result.items():
+                        score = parse_score(value)
+                        if score is not None:
+                            records.append((run_id, session_id, agent, self._criterion_id(name),
+                                            row_index, scored_at, score))
+                self.conn.executemany(
+                    "INSERT INTO scores (run_id, session_id, agent, criterion_id, row_index, scored_at, score)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)", records)
+                month = time.strftime("%Y-%m", time.localtime(scored_at))
+                totals = {}
+                for _, _, agent, criterion_id, _, _, score in records:
+                    total = totals.setdefault((criterion_id, agent), [0, 0])
+                    total[0] += score
+                    total[1] += 1
+                self.conn.executemany(
+                    "INSERT INTO monthly (criterion_id, agent, month, score_sum, score_count)"
+                    " VALUES (?, ?, ?, ?, ?) ON CONFLICT (criterion_id, agent, month) DO UPDATE SET"
+                    " score_sum = score_sum + excluded.score_sum, score_count = score_count + excluded.score_count",
+                    [(cid, agent, month, total, count) for (cid, agent), (total, count) in totals.items()])
+                self.conn.execute("UPDATE runs SET rows = rows + ? WHERE id = ?", (row_count, run_id))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                # 交易撤銷後，快取的 id 可能已不存在
+                self._criteria = dict(self.conn.execute("SELECT name, id FROM criteria"))
+                self._sessions.clear()
+                raise
+        return len(records)
+
+    def ingest_csv(self, path: str, criteria, agent: str = None, session: str = None, scored_at=None,
+                   model: str = None, batch_rows: int = INGEST_BATCH_ROWS):
+        """
+        匯入一份 hw2 產出的 CSV（例如歷史的 customer_analysis.csv），回傳 (run_id, 分數筆數)。
+        專員 / 對話代號優先取 CSV 欄位，其次取參數，最後為「未指定」與檔名。
+        """
+        import pandas as pd
+        run_id = self.start_run(os.path.basename(path), model, scored_at)
+        total = 0
+        offset = 0
+        for chunk in pd.read_csv(path, chunksize=batch_rows, dtype=str, encoding="utf-8-sig"):
+            agent_col = pick_column(chunk.columns, AGENT_COLUMNS)
+            session_col = pick_column(chunk.columns, SESSION_COLUMNS)
+            items = [c for c in criteria if c in chunk.columns]
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            rows = []
+            for i, record in enumerate(chunk.to_dict("records")):
+                rows.append((offset + i, {item: record[item] for item in items},
+                             record.get(session_col) or session or os.path.basename(path),
+                             record.get(agent_col) or agent))
+            total += self.add_scores(run_id, rows, scored_at)
+            offset += len(chunk)
+        return run_id, total
+
+    # ----- 查詢 -----
+
+    def _criterion_filter(self, criterion: str):
+        """ 評分項目可只給部分名稱（例如「耐心與情緒管理」），回傳符合的 (id, 名稱) 列表 """
+        return self.conn.execute("SELECT id, name FROM criteria WHERE name LIKE ? ORDER BY id",
+                                 (f"%{criterion}%",)).fetchall()
+
+    def rollup(self, by: str = "criterion", run_id: int = None, agent: str = None,
+               since=None, until=None):
+        """
+        各評分項目的平均分數與筆數，回傳 [(分組, 項目, 平均, 筆數)]。
+        by 為 criterion / agent / run / session；可用 run_id、agent、since、until 篩選。
+        """
+        names = dict(self.conn.execute("SELECT id, name FROM criteria"))
+        if by in ("criterion", "agent") and run_id is None and since is None and until is None:
+            group = "'全部'" if by == "criterion" else "agent"
+            sql = (f"SELECT {group} AS grp, criterion_id, SUM(score_sum) * 1.0 / SUM(score_count),"
+                   " SUM(score_count) FROM monthly" + (" WHERE agent = ?" if agent is not None else "")
+                   + " GROUP BY grp, criterion_id ORDER BY grp, criterion_id")
+            params = [agent] if agent is not None else []
+            return [(grp, names[cid], avg, count) for grp, cid, avg, count in self.conn.execute(sql, params)]
+
+        group = {"criterion": "'全部'", "agent": "s.agent", "run": "s.run_id",
+                 "session": "sess.session_key"}[by]
+        where, params = [], []
+        if run_id is not None:
+            where.append("s.run_id = ?")
+            params.append(run_id)
+        if agent is not None:
+            where.append("s.agent = ?")
+            params.append(agent)
+        if since is not None:
+            where.append("s.scored_at >= ?")
+            params.append(parse_time(since))
+        if until is not None:
+            where.append("s.scored_at < ?")
+            params.append(parse_time(until))
+        join = "JOIN sessions sess ON sess.id = s.session_id" if by == "session" else ""
+        sql = (f"SELECT {group} AS grp, s.criterion_id, AVG(s.score), COUNT(*) FROM scores s {join}"
+               + (" WHERE " + " AND ".join(where) if where else "")
+               + " GROUP BY grp, s.criterion_id ORDER BY grp, s.criterion_id")
+        return [(grp, names[cid], avg, count) for grp, cid, avg, count in self.conn.execute(sql, params)]
+
+    def trend(self, criterion: str, agent: str = None, period: str = "month", since=None, until=None):
+        """ 某評分項目（可只給部分名稱）依時間區段的平均分數，回傳 [(項目, 區段, 平均, 筆數)] """
+        fmt = PERIOD_FORMATS[period]
+        results = []
+        for cid, name in self._criterion_filter(criterion):
+            if period in ("month", "year") and since is None and until is None:
+                bucket = "month" if period == "month" else "substr(month, 1, 4)"
+                sql = (f"SELECT {bucket} AS bucket, SUM(score_sum) * 1.0 / SUM(score_count), SUM(score_count)"
+                       " FROM monthly WHERE criterion_id = ?" + (" AND agent = ?" if agent is not None else "")
+                       + " GROUP BY bucket ORDER BY bucket")
+                params = [cid] + ([agent] if agent is not None else [])
+                results.extend((name, bucket, avg, count)
+                               for bucket, avg, count in self.conn.execute(sql, params))
+                continue
+            # 條件依 idx_scores_trend 的欄位順序排列：criterion_id、agent、scored_at
+            where, params = ["criterion_id = ?"], [cid]
+            if agent is not None:
+                where.append("agent = ?")
+                params.append(agent)
+            if since is not None:
+                where.append("scored_at >= ?")
+                params.append(parse_time(since))
+            if until is not None:
+                where.append("scored_at < ?")
+                params.append(parse_time(until))
+            sql = (f"SELECT strftime('{fmt}', scored_at, 'unixepoch', 'localtime') AS bucket,"
+                   f" AVG(score), COUNT(*) FROM scores WHERE {' AND '.join(where)}"
+                   " GROUP BY bucket ORDER BY bucket")
+            results.extend((name, bucket, avg, count)
+                           for bucket, avg, count in self.conn.execute(sql, params))
+        return results
+
+    def explain(self, sql: str, params=()):
+        """ 回傳查詢計畫，用來確認查詢有走索引 """
+        return [row[-1] for row in self.conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def print_rows(header, rows):
+    print("\t".join(header))
+    for row in rows:
+        print("\t".join(f"{v:.2f}" if isinstance(v, float) else str(v) for v in row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hw2 評分分析庫：匯入歷史結果、彙總與趨勢查詢")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite 檔案路徑")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="匯入 hw2 產出的 CSV")
+    ingest.add_argument("csv", nargs="+")
+    ingest.add_argument("--agent", help="CSV 沒有專員欄位時使用的專員名稱")
+    ingest.add_argument("--session", help="CSV 沒有對話編號欄位時使用的對話代號（預設為檔名）")
+    ingest.add_argument("--at", help="評分時間，例如 2025-03-01（預設為檔案修改時間）")
+
+    rollup = commands.add_parser("rollup", help="各評分項目的平均分數")
+    rollup.add_argument("--by", choices=["criterion", "agent", "run", "session"], default="criterion")
+    rollup.add_argument("--run", type=int)
+    rollup.add_argument("--agent")
+    rollup.add_argument("--since")
+    rollup.add_argument("--until")
+
+    trend = commands.add_parser("trend", help="某評分項目依時間區段的平均分數")
+    trend.add_argument("criterion", help="評分項目，可只給部分名稱")
+    trend.add_argument("--agent")
+    trend.add_argument("--period", choices=sorted(PERIOD_FORMATS), default="month")
+    trend.add_argument("--since")
+    trend.add_argument("--until")
+    args = parser.parse_args()
+
+    with ScoreStore(args.db) as store:
+        start = time.perf_counter()
+        if args.command == "ingest":
+            from hw2 import ITEMS
+            for path in args.csv:
+                scored_at = args.at or os.path.getmtime(path)
+                run_id, count = store.ingest_csv(path, ITEMS, args.agent, args.session, scored_at)
+                print(f"已匯入 {path}：執行 #{run_id}，{count} 筆分數")
+        elif args.command == "rollup":
+            rows = store.rollup(args.by, args.run, args.agent, args.since, args.until)
+            print_rows([args.by, "評分項目", "平均", "筆數"], rows)
+        else:
+            rows = store.trend(args.criterion, args.agent, args.period, args.since, args.until)
+            print_rows(["評分項目", args.period, "平均", "筆數"], rows)
+        print(f"耗時 {(time.perf_counter() - start) * 1000:.1f} 毫秒")
+
+
+if __name__ == "__main__":
+    main()
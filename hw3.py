@@ -1,61 +1,291 @@
-from playwright.sync_api import sync_playwright
+"""
+hw3：以 Playwright 操作 ChatGPT 網頁
+
+不帶參數執行時與原本相同：開啟可見的瀏覽器、詢問一個問題、印出回答後等待按 Enter 關閉。
+批次模式：從檔案讀入多個問題，以數個常駐的 persistent context（各自保留登入狀態）在無頭瀏覽器中
+並行詢問，回答逐筆寫成 JSONL。所有等待都改為等 DOM 條件，不再固定 sleep：
+  - 頁面：等 domcontentloaded 與輸入框可見；圖片、字型、影音與追蹤程式的請求直接攔截不載入
+  - 回答：頁面內的 MutationObserver 逐段擷取最新回答的文字（串流片段即時回傳給 Python），
+    「停止生成」按鈕消失且文字短暫不再變動、或文字持續 HW3_STABLE_MS 毫秒沒有變化，即視為回答完成
+
+用法：
+    python hw3.py
+    python hw3.py --prompts questions.txt --out answers.jsonl --contexts 3
+    python hw3.py --prompts questions.txt --url http://127.0.0.1:8000/   # 本機模擬頁 (見 bench_hw3.py)
+"""
+import argparse
+import asyncio
+import json
 import os
+import sys
+import time
+
 from dotenv import load_dotenv
+from playwright.async_api import async_playwright
 
 # 讀取 .env 檔案
 load_dotenv()
 FB_EMAIL = os.getenv("FACEBOOK_EMAIL")
 FB_PASSWORD = os.getenv("FACEBOOK_PASSWORD")
 
-# 讀取 .env 檔案
-load_dotenv()
+CHAT_URL = os.getenv("HW3_CHAT_URL", "https://chatgpt.com/?model=gpt-4o")
+INPUT_SELECTOR = "div.ProseMirror"
+ANSWER_SELECTOR = "[data-message-author-role='assistant']"
+STOP_SELECTOR = "button[data-testid='stop-button']"
+PAGE_TIMEOUT_MS = 30000
+ANSWER_TIMEOUT_MS = int(os.getenv("HW3_ANSWER_TIMEOUT", "180")) * 1000
+# 停止生成按鈕仍在時，文字需靜止多久才算完成；按鈕消失後只需短暫確認
+STABLE_MS = int(os.getenv("HW3_STABLE_MS", "2000"))
+SETTLE_MS = 300
+PROFILE_DIR = ".hw3_profiles"
 
-with sync_playwright() as p:
-    browser = p.chromium.launch(headless=False)  # 顯示瀏覽器
-    page = browser.new_page()
+# 不影響操作的資源直接攔截；樣式表保留，避免元素可見性判斷失準
+BLOCK_RESOURCES = os.getenv("HW3_BLOCK_RESOURCES", "1") != "0"
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+BLOCKED_URL_KEYWORDS = ("analytics", "tracker", "telemetry", "googletagmanager", "doubleclick",
+                        "sentry", "intercom", "datadog", "segment.io", "/ces/")
+block_stats = {"blocked": 0, "allowed": 0}
 
-    print("啟動瀏覽器，進入 ChatGPT...")
+# 每份文件載入時注入：觀察 DOM 變化，記錄最新一則回答的文字與最後變動時間
+CAPTURE_SCRIPT = """
+(() => {
+  const selector = %s;
+  const state = window.__hw3Capture = {text: "", changedAt: performance.now(), baseline: 0, chunks: 0};
+  const update = () => {
+    const nodes = document.querySelectorAll(selector);
+    if (nodes.length <= state.baseline) return;
+    const text = nodes[nodes.length - 1].innerText || "";
+    if (text === state.text) return;
+    const delta = text.startsWith(state.text) ? text.slice(state.text.length) : text;
+    state.text = text;
+    state.changedAt = performance.now();
+    state.chunks += 1;
+    if (window.__hw3OnChunk) window.__hw3OnChunk(delta);
+  };
+  new MutationObserver(update).observe(document, {childList: true, subtree: true, characterData: true});
+  window.__hw3Arm = () => {
+    state.baseline = document.querySelectorAll(selector).length;
+    state.text = "";
+    state.chunks = 0;
+    state.changedAt = performance.now();
+  };
+})();
+""" % json.dumps(ANSWER_SELECTOR)
 
-    # 進入 ChatGPT
-    page.goto("https://chatgpt.com/?model=gpt-4o")
-    page.wait_for_timeout(5000)
+ANSWER_DONE_JS = """
+([stopSelector, stableMs, settleMs]) => {
+  const state = window.__hw3Capture;
+  if (!state || !state.text.trim()) return false;
+  const stop = document.querySelector(stopSelector);
+  const generating = stop !== null && stop.offsetParent !== null;
+  return performance.now() - state.changedAt >= (generating ? stableMs : settleMs);
+}
+"""
 
-    # 確認輸入框是否存在且可見
-    try:
-        # 使用更具體的 XPath 定位輸入框
-        input_box = page.locator("//div[contains(@class, 'ProseMirror')]")
-        input_box.wait_for(state="attached", timeout=10000)
-        print("輸入框已載入")
-    except Exception as e:
-        print("無法找到輸入框或輸入框不可見：", e)
-        browser.close()
-        exit(1)
-
-    # 模擬輸入問題
-    input_box.fill("這一周天氣如何？")
-    print("已輸入問題：這一周天氣如何？")
-
-    # 正確觸發輸入事件
-    page.evaluate("document.querySelector('div.ProseMirror').dispatchEvent(new Event('input', { bubbles: true }));")
-
-    # 模擬按下 Enter 鍵
-    page.keyboard.press("Enter")
-    print("已提交查詢")
-
-    # 等待回應
-    page.wait_for_timeout(10000)
-    print("已獲取回應")
-
-    # 擷取回應內容
+# 頁面 -> 串流片段回呼
+_chunk_handlers = {}
+
+
+async def route_request(route):
+    request = route.request
+    url = request.url.lower()
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(k in url for k in BLOCKED_URL_KEYWORDS):
+        block_stats["blocked"] += 1
+        await route.abort()
+    else:
+        block_stats["allowed"] += 1
+        await route.continue_()
+
+
+async def prepare_context(context, block: bool = BLOCK_RESOURCES):
+    """ 在開啟任何頁面前設定：注入回答擷取腳本、串流回呼、攔截非必要資源 """
+    async def on_chunk(source, delta):
+        handler = _chunk_handlers.get(source["page"])
+        if handler:
+            handler(delta)
+
+    await context.add_init_script(CAPTURE_SCRIPT)
+    await context.expose_binding("__hw3OnChunk", on_chunk)
+    if block:
+        await context.route("**/*", route_request)
+
+
+async def open_chat(page, url: str):
+    """ 開啟新對話並等待輸入框可見，回傳輸入框 """
+    await page.goto(url, wait_until="domcontentloaded", timeout=PAGE_TIMEOUT_MS)
+    input_box = page.locator(INPUT_SELECTOR).first
+    await input_box.wait_for(state="visible", timeout=PAGE_TIMEOUT_MS)
+    return input_box
+
+
+async def ask(page, question: str, url: str = None, on_chunk=None) -> str:
+    """
+    送出一個問題並回傳回答文字；有給 url 時先開啟新對話。
+    on_chunk(片段) 會在回答串流中每次文字增加時被呼叫（頁面所屬 context 需先經 prepare_context）。
+    """
+    if url:
+        input_box = await open_chat(page, url)
+    else:
+        input_box = page.locator(INPUT_SELECTOR).first
+    await page.evaluate("window.__hw3Arm()")
+    if on_chunk:
+        _chunk_handlers[page] = on_chunk
     try:
-        response = page.locator("div[role='dialog']").text_content()
-        print("ChatGPT 回應：", response)
-    except Exception as e:
-        print("無法取得回應：", e)
+        await input_box.fill(question)
+        await input_box.press("Enter")
+        await page.wait_for_function(ANSWER_DONE_JS, arg=[STOP_SELECTOR, STABLE_MS, SETTLE_MS],
+                                     polling=100, timeout=ANSWER_TIMEOUT_MS)
+    finally:
+        _chunk_handlers.pop(page, None)
+    return (await page.evaluate("window.__hw3Capture.text")).strip()
+
+
+# ----- 批次模式 -----
+
+
+def read_prompts(path: str):
+    """ 每行一個問題，空行略過 """
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class ContextPool:
+    """ 數個常駐的 persistent context，每個 context 一個分頁，整個批次重複使用 """
+
+    def __init__(self, playwright, size: int, headless: bool = True, profile_dir: str = PROFILE_DIR,
+                 block: bool = BLOCK_RESOURCES):
+        self.playwright = playwright
+        self.size = size
+        self.headless = headless
+        self.profile_dir = profile_dir
+        self.block = block
+        self.contexts = []
+        self.pages = []
+
+    async def start(self):
+        async def launch(index):
+            context = await self.playwright.chromium.launch_persistent_context(
+                os.path.join(self.profile_dir, f"context{index}"), headless=self.headless)
+            await prepare_context(context, self.block)
+            page = context.pages[0] if context.pages else await context.new_page()
+            return context, page
+
+        launched = await asyncio.gather(*(launch(i) for i in range(self.size)))
+        self.contexts = [context for context, _ in launched]
+        self.pages = [page for _, page in launched]
+        return self
+
+    async def close(self):
+        await asyncio.gather(*(context.close() for context in self.contexts), return_exceptions=True)
+
+
+async def run_batch(prompts, out_path: str, contexts: int = 2, url: str = CHAT_URL,
+                    headless: bool = True, profile_dir: str = PROFILE_DIR, block: bool = BLOCK_RESOURCES):
+    """ 以 contexts 個分頁並行詢問，回答依完成順序逐筆寫入 JSONL，回傳 (成功數, 總耗時秒數) """
+    queue = asyncio.Queue()
+    for index, prompt in enumerate(prompts):
+        queue.put_nowait((index, prompt))
+    succeeded = 0
+    block_stats.update(blocked=0, allowed=0)
+    start = time.perf_counter()
+
+    async with async_playwright() as p:
+        pool = await ContextPool(p, min(contexts, len(prompts)) or 1, headless, profile_dir,
+                                 block).start()
+        print(f"已啟動 {pool.size} 個瀏覽器 context，共 {len(prompts)} 個問題")
+        with open(out_path, "w", encoding="utf-8") as out:
+
+            async def worker(slot, page):
+                nonlocal succeeded
+                while not queue.empty():
+                    index, prompt = queue.get_nowait()
+                    asked = time.perf_counter()
+                    record = {"index": index, "prompt": prompt, "context": slot}
+                    first_chunk = []
+
+                    def on_chunk(delta):
+                        if not first_chunk:
+                            first_chunk.append(time.perf_counter() - asked)
+
+                    try:
+                        record["answer"] = await ask(page, prompt, url, on_chunk)
+                        record["first_chunk_seconds"] = round(first_chunk[0], 2) if first_chunk else None
+                        succeeded += 1
+                    except Exception as e:
+                        record["error"] = str(e).splitlines()[0]
+                    record["seconds"] = round(time.perf_counter() - asked, 2)
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+                    status = "完成" if "answer" in record else f"失敗：{record['error']}"
+                    print(f"[{index + 1}/{len(prompts)}] context {slot} {status} ({record['seconds']} 秒)")
+
+            try:
+                await asyncio.gather(*(worker(i, page) for i, page in enumerate(pool.pages)))
+            finally:
+                await pool.close()
+    if block:
+        print(f"已攔截 {block_stats['blocked']} 個非必要請求，放行 {block_stats['allowed']} 個")
+    return succeeded, time.perf_counter() - start
+
+
+# ----- 互動模式（原本的流程） -----
+
+
+async def run_interactive(question: str = "這一周天氣如何？"):
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=False)  # 顯示瀏覽器
+        context = await browser.new_context()
+        await prepare_context(context)
+        page = await context.new_page()
+
+        print("啟動瀏覽器，進入 ChatGPT...")
+        try:
+            await open_chat(page, CHAT_URL)
+            print("輸入框已載入")
+        except Exception as e:
+            print("無法找到輸入框或輸入框不可見：", e)
+            await browser.close()
+            sys.exit(1)
+
+        print(f"已輸入問題：{question}")
+        try:
+            print("ChatGPT 回應：", end="", flush=True)
+            await ask(page, question, on_chunk=lambda delta: print(delta, end="", flush=True))
+            print()
+            print("已獲取回應")
+        except Exception as e:
+            print("無法取得回應：", e)
+
+        # 保持瀏覽器開啟，方便查看
+        await asyncio.to_thread(input, "瀏覽器保持開啟，按 Enter 關閉...")
+
+        # 關閉瀏覽器
+        await browser.close()
+        print("瀏覽器已關閉")
+
+
+def main():
+    if len(sys.argv) == 1:
+        asyncio.run(run_interactive())
+        return
+    parser = argparse.ArgumentParser(description="以 Playwright 批次詢問 ChatGPT")
+    parser.add_argument("--prompts", required=True, help="問題檔，每行一個問題")
+    parser.add_argument("--out", default="hw3_answers.jsonl", help="輸出 JSONL")
+    parser.add_argument("--contexts", type=int, default=2, help="並行的瀏覽器 context 數")
+    parser.add_argument("--url", default=CHAT_URL, help="對話頁網址")
+    parser.add_argument("--headed", action="store_true", help="顯示瀏覽器視窗")
+    parser.add_argument("--profile-dir", default=PROFILE_DIR,
+                        help="persistent context 的資料夾（保留登入狀態）")
+    parser.add_argument("--no-block", action="store_true", help="不攔截圖片、字型與追蹤程式")
+    args = parser.parse_args()
+
+    prompts = read_prompts(args.prompts)
+    succeeded, seconds = asyncio.run(run_batch(prompts, args.out, args.contexts, args.url,
+                                               not args.headed, args.profile_dir,
+                                               BLOCK_RESOURCES and not args.no_block))
+    rate = len(prompts) / seconds * 60 if seconds else 0.0
+    print(f"完成 {succeeded}/{len(prompts)} 題，耗時 {seconds:.1f} 秒（{rate:.1f} 題/分鐘），輸出：{args.out}")
 
-    # 保持瀏覽器開啟，方便查看
-    input("瀏覽器保持開啟，按 Enter 關閉...")
 
-    # 關閉瀏覽器
-    browser.close()
-    print("瀏覽器已關閉")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -5,20 +5,28 @@ import gradio as gr
 import pandas as pd
 from dotenv import load_dotenv
 from fpdf import FPDF
-from google import genai
 import re
+import httpx
+import llm_gateway
+import model_router
+import tracing
+from prompt_cache import GatewayContextCache, PromptCache, PromptTemplate
 
 # 載入環境變數並設定 API 金鑰
 load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=api_key)
+api_key = os.getenv("GEMINI_API_KEY")  # 由 llm_gateway 使用
+# 分析規則在同一次請求的每個區塊都相同，作為固定前綴快取
+prompt_cache = PromptCache(GatewayContextCache())
 
 
 def get_chinese_font_file() -> str:
     """
     只檢查 Windows 系統字型資料夾中是否存在候選中文字型（TTF 格式）。
-    若找到則回傳完整路徑；否則回傳 None。
+    若找到則回傳完整路徑；否則回傳 None。環境變數 CHINESE_FONT_PATH 可直接指定字型檔。
     """
+    env_font = os.getenv("CHINESE_FONT_PATH")
+    if env_font and os.path.exists(env_font):
+        return os.path.abspath(env_font)
     fonts_path = r"C:\Windows\Fonts"
     candidates = ["kaiu.ttf"]  # 這裡以楷體為例，可依需要修改
     for font in candidates:
@@ -86,6 +94,36 @@ def parse_markdown_table(markdown_text: str) -> pd.DataFrame:
             data.append(row)
     df = pd.DataFrame(data, columns=headers)
     return df
+
+
+TABLE_SEPARATOR = re.compile(r"^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$", re.MULTILINE)
+
+
+def validate_block(text: str, prompt: str) -> model_router.Verdict:
+    """ 區塊分析結果：不可空白；規則要求表格時，回覆須含有表頭、分隔線與至少一列資料的 Markdown 表格 """
+    if not text.strip():
+        return model_router.Verdict(False, "空白回覆")
+    if "表格" in prompt:
+        df = parse_markdown_table(text) if TABLE_SEPARATOR.search(text) else None
+        if df is None or df.empty:
+            return model_router.Verdict(False, "缺少表格")
+    return model_router.Verdict(True)
+
+
+def rules_template(user_prompt: str) -> PromptTemplate:
+    """
+    預設規則在載入時登記一次；使用者改過的規則以未固定範本登記，
+    prompt_cache 只保留最近使用的幾個，長時間執行的 Gradio 行程不會無限累積
+    """
+    if user_prompt == default_prompt:
+        return DEFAULT_TEMPLATE
+    return prompt_cache.register(PromptTemplate(
+        "hw4 自訂規則", f"請根據以下規則進行分析並產出報表：\n{user_prompt}", "\n\n"), pin=False)
+
+
+# 原本每個區塊都送 gemini-2.5-pro；改為便宜模型先做，表格不完整或信心不足才升級 (見 model_router.py)
+BLOCK_ROUTER = model_router.ModelRouter("hw4 區塊分析", prompt_cache.generate, validate_block,
+                                        ask_confidence=True)
 # hw4
 
 
@@ -158,45 +196,68 @@ def generate_pdf(text: str) -> str:
             for buf in buffer:
                 render_line_with_bold(pdf, buf)
 
-    pdf_file = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    # 檔名含微秒，避免同一秒內多位使用者的報告互相覆寫
+    pdf_file = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.pdf"
     pdf.output(pdf_file)
     return pdf_file
 
 # HW4
 
 
+@tracing.traced("hw4")
 def gradio_handler(csv_file, user_prompt):
     print("進入 gradio_handler")
     if csv_file is not None:
         print("讀取 CSV 檔案")
-        df = pd.read_csv(csv_file.name)
+        # 新版 Gradio 的 File 元件傳入路徑字串，舊版傳入暫存檔物件
+        csv_path = getattr(csv_file, "name", csv_file)
+        with tracing.span("read_csv", bytes=os.path.getsize(csv_path)) as span:
+            df = pd.read_csv(csv_path)
+            span.set(rows=df.shape[0], columns=df.shape[1])
         total_rows = df.shape[0]
         block_size = 30
         block_responses = []
+        # 規則放在前面當固定前綴，每個區塊只需送出各自的 CSV 資料
+        template = rules_template(user_prompt)
 
         # 分段送進 LLM 分析（避免 token 過長）
         for i in range(0, total_rows, block_size):
             block = df.iloc[i:i+block_size]
             block_csv = block.to_csv(index=False)
-            prompt = (
+            prompt = template.render(
                 f"以下是CSV資料第 {i+1} 到 {min(i+block_size, total_rows)} 筆：\n"
-                f"{block_csv}\n\n請根據以下規則進行分析並產出報表：\n{user_prompt}"
+                f"{block_csv}"
             )
             print("送出 prompt：")
             print(prompt)
 
-            response = client.models.generate_content(
-                model="gemini-2.5-pro-exp-03-25",
-                contents=[prompt]
-            )
-            block_response = response.text.strip()
+            block_label = f"第 {i+1} 到 {min(i+block_size, total_rows)} 筆"
+            with tracing.span("analyse", block=i // block_size, rows=len(block),
+                              prompt_chars=len(prompt)) as span:
+                try:
+                    result = BLOCK_ROUTER.route(prompt)
+                except (llm_gateway.GatewayError, httpx.HTTPError) as e:
+                    # 單一區塊失敗（重試用盡或斷路器開啟）不影響其他區塊，報告中保留錯誤說明
+                    print(f"API 呼叫失敗：{e}")
+                    span.set(error=type(e).__name__)
+                    block_responses.append(f"錯誤：{block_label}分析失敗：{e}")
+                    continue
+                span.set(output_chars=len(result.value), model=result.model, validated=result.validated)
+            block_response = result.value.strip()
+            if not result.validated:
+                block_response = f"注意：{block_label}的分析結果未通過檢查（{result.reason}）\n\n{block_response}"
             block_responses.append(block_response)
+        print(prompt_cache.report())
+        print(model_router.report())
+        print(llm_gateway.report())
 
         # 合併所有分析結果為一份文字報告
         cumulative_response = "\n\n".join(block_responses)
 
         # 直接根據 AI 分析結果產出 PDF
-        pdf_path = generate_pdf(text=cumulative_response)
+        with tracing.span("render_pdf", chars=len(cumulative_response)) as span:
+            pdf_path = generate_pdf(text=cumulative_response)
+            span.set(bytes=os.path.getsize(pdf_path))
 
         return cumulative_response, pdf_path
 
@@ -220,6 +281,8 @@ default_prompt = """以下是客服與顧客的對話資料，請針對每一列
 
 最後，請以表格與條列方式整理報告重點，並加入簡要結論。
 """
+DEFAULT_TEMPLATE = prompt_cache.register(PromptTemplate(
+    "hw4 分析規則", f"請根據以下規則進行分析並產出報表：\n{default_prompt}", "\n\n"))
 
 with gr.Blocks() as demo:
     gr.Markdown("# CSV 報表生成器")
@@ -233,4 +296,5 @@ with gr.Blocks() as demo:
     submit_button.click(fn=gradio_handler, inputs=[csv_input, user_input],
                         outputs=[output_text, output_pdf])
 
-demo.launch()
+if __name__ == "__main__":
+    demo.launch()
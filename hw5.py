@@ -1,56 +1,123 @@
 # ----- 必要導入 -----
+import time  # For delays
+# 啟動計時從模組最開頭算起，module_import 才包含 pandas、fpdf 等套件的匯入時間
+_module_start = time.perf_counter()
 import os
 import re
-import gradio as gr
+import threading
 import pandas as pd
 from dotenv import load_dotenv
 from fpdf import FPDF
-import google.generativeai as genai
 from datetime import datetime
 import tempfile
-import shutil
-import tempfile
-import time  # For delays
-import whisper  # <--- 新增 Whisper 導入
-
-# ----- 環境設定與 Gemini/Whisper 初始化 -----
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from hw5_cache import TranscriptCache, cache_key, file_sha256, staged_input
+import hw5_asr
+import llm_gateway
+import model_router
+import tracing
+from prompt_cache import GatewayContextCache, PromptCache, PromptTemplate
+# gradio、whisper、google.generativeai 皆為重量級套件，改在實際需要時才匯入，
+# 讓啟動（以及只處理 .txt 的請求）不必支付 Whisper 的載入成本
+
+# ----- 啟動計時 -----
+# 紀錄各啟動階段耗時（秒），供 bench_hw5_startup.py 與啟動日誌使用
+STARTUP_TIMINGS = {}
+
+
+def record_timing(phase: str, start: float) -> float:
+    """ 記錄從 start 到現在的耗時並印出，回傳耗時秒數 """
+    elapsed = time.perf_counter() - start
+    STARTUP_TIMINGS[phase] = elapsed
+    print(f"[啟動計時] {phase}: {elapsed:.2f} 秒")
+    return elapsed
+
+
+# ----- 環境設定 -----
 load_dotenv()
 api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("請在 .env 檔案中設定 GEMINI_API_KEY")
-
-# 初始化 Gemini Client (同前)
-try:
-    genai.configure(api_key=api_key)
-    gemini_model = genai.GenerativeModel(
-        model_name='gemini-2.0-flash',  # 或其他模型
-    )
-    print("Gemini Client 初始化成功")
-except Exception as e:
-    print(f"Gemini Client 初始化失敗: {e}")
-    gemini_model = None
-
-# 初始化 Whisper 模型 (程式啟動時載入一次)
+
+# ----- Gemini (經由 llm_gateway 呼叫，第一次呼叫時才建立連線) -----
+# 先用 ROUTER_CHEAP_MODEL（預設 gemini-2.0-flash），輸出檢查不通過才升級 (見 model_router.py)
+# HEXACO 定義等固定前綴的 context cache
+prompt_cache = PromptCache(GatewayContextCache())
+
+
+# ----- Whisper 模型 (背景執行緒預熱，或第一次音訊請求時載入) -----
+# 轉錄引擎、模型大小與執行緒數由 HW5_ASR_BACKEND / HW5_ASR_MODEL / HW5_ASR_THREADS 設定 (見 hw5_asr.py)
 # 可選模型: "tiny", "base", "small", "medium", "large" (越大越準但越慢/耗資源)
 # "base" 或 "small" 是速度和準確度的不錯平衡點
-whisper_model_name = "medium"
+asr_backend = hw5_asr.create_backend()
+# HW5_ASR_SERVICE=host:port：改送工作到共用轉錄服務，本行程不載入模型 (見 hw5_whisper_service.py)
+ASR_SERVICE = os.getenv("HW5_ASR_SERVICE")
+# 等待轉錄服務回覆的上限（秒），服務卡住時不會讓 UI worker 永遠等下去
+ASR_SERVICE_TIMEOUT = float(os.getenv("HW5_ASR_SERVICE_TIMEOUT", "1800"))
+# HW5_SEGMENTED=1：長錄音切段後以多個行程平行轉錄，並即時回傳部分逐字稿 (見 hw5_transcribe.py)
+SEGMENTED_TRANSCRIPTION = os.getenv("HW5_SEGMENTED", "0") == "1"
 whisper_model = None
-try:
-    print(f"正在載入 Whisper 模型: {whisper_model_name}...")
-    # device="cuda" 如果有 GPU 且環境設定正確
-    # device="cpu" 如果只用 CPU
-    whisper_model = whisper.load_model(
-        whisper_model_name, device="cpu")  # <--- 改成 "cuda" 如果你有 GPU
-    print("Whisper 模型載入成功。")
-except Exception as e:
-    print(f"載入 Whisper 模型失敗: {e}")
-    print("Whisper 功能將不可用。")
-    # 可以選擇讓程式停止或繼續，但轉錄會失敗
+whisper_load_error = None
+_whisper_lock = threading.Lock()
+_whisper_warmup_thread = None
+
+
+def load_whisper_model():
+    """
+    載入轉錄後端的模型（只載入一次），回傳已載入的後端。
+    若背景預熱正在進行，會等待其完成而不會重複載入。
+    """
+    global whisper_model, whisper_load_error
+    if whisper_model is not None:
+        return whisper_model
+    with _whisper_lock:
+        if whisper_model is not None:
+            return whisper_model
+        try:
+            print(f"正在載入 Whisper 模型: {asr_backend.describe()}...")
+            start = time.perf_counter()
+            whisper_model = asr_backend.load()
+            record_timing("whisper_load", start)
+            whisper_load_error = None
+            print("Whisper 模型載入成功。")
+        except Exception as e:
+            whisper_load_error = str(e)
+            print(f"載入 Whisper 模型失敗: {e}")
+            print("Whisper 功能將不可用。")
+    return whisper_model
+
+
+def _warm_segment_pool():
+    import hw5_transcribe
+    start = time.perf_counter()
+    hw5_transcribe.warm_pool(asr_backend, hw5_transcribe.default_workers())
+    record_timing("whisper_pool_warmup", start)
+
+
+def start_whisper_warmup():
+    """ 在背景執行緒預先載入 Whisper，UI 不需等待模型載入即可啟動 """
+    global _whisper_warmup_thread
+    if ASR_SERVICE:
+        print(f"使用共用轉錄服務 {ASR_SERVICE}，不在本行程載入 Whisper。")
+        return None
+    if whisper_model is not None or _whisper_warmup_thread is not None:
+        return _whisper_warmup_thread
+    # 分段模式由子行程各自持有模型，預熱的是行程池
+    target = _warm_segment_pool if SEGMENTED_TRANSCRIPTION else load_whisper_model
+    _whisper_warmup_thread = threading.Thread(
+        target=target, name="whisper-warmup", daemon=True)
+    _whisper_warmup_thread.start()
+    print("已於背景開始載入 Whisper 模型。")
+    return _whisper_warmup_thread
+
 
 # ----- PDF 生成相關函數 (大致同前，略作調整以接收新參數) -----
 
 
 def get_chinese_font_file() -> str:
+    # 非 Windows 環境可用 CHINESE_FONT_PATH 指定字型檔
+    env_font = os.getenv("CHINESE_FONT_PATH")
+    if env_font and os.path.exists(env_font):
+        return env_font
     fonts_path = r"C:\Windows\Fonts"
     font_file = "kaiu.ttf"
     font_path = os.path.join(fonts_path, font_file)
@@ -62,6 +129,20 @@ def get_chinese_font_file() -> str:
         raise FileNotFoundError("❌ 找不到 kaiu.ttf，請確認已安裝標楷體")
 
 
+CHINESE_FONT_PATH = None
+
+
+def get_chinese_font_path():
+    """ 第一次產生 PDF 時才尋找標楷體，找不到時回傳 None 而不中斷程式 """
+    global CHINESE_FONT_PATH
+    if CHINESE_FONT_PATH is None:
+        try:
+            CHINESE_FONT_PATH = get_chinese_font_file()
+        except FileNotFoundError as e:
+            print(e)
+    return CHINESE_FONT_PATH
+
+
 def render_line_with_bold(pdf: FPDF, line: str):
     parts = re.split(r'(\*\*.*?\*\*)', line)
     for part in parts:
@@ -114,16 +195,24 @@ def create_table(pdf: FPDF, df: pd.DataFrame):
         pdf.ln(row_height)
 
 
-CHINESE_FONT_PATH = get_chinese_font_file()  # 取得標楷體字型
+def generate_pdf_report(title: str, raw_text: str, formatted_text: str, analysis_text: str) -> str:
+    with tracing.span("render_pdf", chars=len(raw_text) + len(formatted_text) + len(analysis_text)) as span:
+        pdf_path = _generate_pdf_report(title, raw_text, formatted_text, analysis_text)
+        if pdf_path:
+            span.set(bytes=os.path.getsize(pdf_path))
+        return pdf_path
 
 
-def generate_pdf_report(title: str, raw_text: str, formatted_text: str, analysis_text: str) -> str:
+def _generate_pdf_report(title: str, raw_text: str, formatted_text: str, analysis_text: str) -> str:
     pdf = FPDF()
     pdf.add_page()
 
     font_loaded = False
     try:
-        pdf.add_font("ChineseFont", "", CHINESE_FONT_PATH, uni=True)
+        font_path = get_chinese_font_path()  # 取得標楷體字型
+        if not font_path:
+            raise FileNotFoundError("找不到 kaiu.ttf")
+        pdf.add_font("ChineseFont", "", font_path, uni=True)
         pdf.set_font("ChineseFont", "", 12)
         font_loaded = True
         print("✅ 中文字型 kaiu.ttf 已成功加入 PDF。")
@@ -227,91 +316,15 @@ def generate_pdf_report(title: str, raw_text: str, formatted_text: str, analysis
             os.remove(pdf_path)
         return None
 
-# ----- 主要處理函數 -----
-
-
-def call_gemini_api(prompt: str, retry_count=3, delay=5):
-    if not gemini_model:
-        return "錯誤：Gemini Client 未成功初始化。"
-
-    for attempt in range(retry_count):
-        try:
-            response = gemini_model.generate_content(prompt)
-            if hasattr(response, 'text'):
-                return response.text.strip()
-            else:
-                return "錯誤：API 回傳格式異常。"
-        except Exception as e:
-            print(f"Gemini 呼叫失敗 (第 {attempt+1} 次)：{e}")
-            if attempt < retry_count - 1:
-                time.sleep(delay)
-            else:
-                return f"錯誤：Gemini API 多次呼叫失敗：{e}"
-
-
-def run_whisper_transcription(audio_filepath):
-    """ 執行 Whisper 轉錄（含複製檔案避免 temp 被清除） """
-    if not whisper_model:
-        return None, "錯誤：Whisper 模型未成功載入。"
-    try:
-        print(f"開始使用 Whisper ({whisper_model_name}) 轉錄檔案: {audio_filepath}")
-
-        #  複製檔案到暫存再處理（避免 temp 被清除）
-        tmp_file = tempfile.NamedTemporaryFile(
-            delete=False, suffix=os.path.splitext(audio_filepath)[1])
-        shutil.copy(audio_filepath, tmp_file.name)
-        tmp_file.close()
-
-        result = whisper_model.transcribe(
-            tmp_file.name, language="zh", fp16=False)
-        print("Whisper 轉錄完成。")
-        return result["text"], None
-    except Exception as e:
-        print(f"Whisper 轉錄過程中發生錯誤: {e}")
-        return None, f"錯誤：Whisper 轉錄失敗: {e}"
-
-
-def process_input_and_analyze(uploaded_file):
-    """
-    核心處理流程：接收上傳 -> (可選)轉錄 -> 格式化 -> 分析 -> 產 PDF
-    """
-    if uploaded_file is None:
-        return "請先上傳檔案。", "", "", "", None
-
-    filepath = uploaded_file  # Gradio File/Audio/Video 的 .name 就是路徑
-    filename = os.path.basename(filepath)
-    file_ext = os.path.splitext(filename)[1].lower()
-    print(f"收到檔案: {filename}, 路徑: {filepath}, 類型: {file_ext}")
-
-    raw_transcript = ""
-    error_message = None
+# ----- Gemini 提示詞 -----
+# 逐字稿超過 HW5_CHUNK_CHARS 字時切塊處理，HW5_LLM_WORKERS 為同時進行的 Gemini 呼叫數
+TRANSCRIPT_CHUNK_CHARS = int(os.getenv("HW5_CHUNK_CHARS", "6000"))
+LLM_WORKERS = int(os.getenv("HW5_LLM_WORKERS", "4"))
 
-    # --- 步驟 0: 判斷檔案類型並執行 Whisper (如果需要) ---
-    audio_formats = ['.wav', '.mp3', '.m4a',
-                     '.ogg', '.flac']  # Whisper 支援的常見格式
-    video_formats = ['.mp4', '.mov', '.avi', '.mkv']  # Whisper 也常能處理影片中的音訊
-    text_formats = ['.txt']
 
-    if file_ext in audio_formats or file_ext in video_formats:
-        raw_transcript, error_message = run_whisper_transcription(filepath)
-        if error_message:
-            # 如果轉錄失敗，提前返回錯誤
-            return f"Whisper 轉錄失敗: {error_message}", "", "", "", None
-    elif file_ext in text_formats:
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                raw_transcript = f.read()
-            print("直接讀取提供的 .txt 逐字稿。")
-            if not raw_transcript.strip():
-                return "錯誤：上傳的文字檔內容為空。", "", "", "", None
-        except Exception as e:
-            print(f"讀取 .txt 檔案時出錯: {e}")
-            return f"錯誤：無法讀取文字檔: {e}", "", "", "", None
-    else:
-        return f"錯誤：不支援的檔案格式 '{file_ext}'。請上傳音檔、視訊檔或 .txt 檔。", "", "", "", None
-
-    # --- 步驟 1: Gemini 格式化 (Q&A) ---
-    formatting_prompt = f"""
+def build_formatting_prompt(raw_transcript: str) -> str:
+    """ 步驟 1：將原始逐字稿整理成「問題/回答」格式的提示詞 """
+    return f"""
     你是一位專業的訪談記錄整理員。請將以下這份**原始逐字稿**轉換成清晰的「問題/回答」格式。
 
     任務指示：
@@ -334,15 +347,10 @@ def process_input_and_analyze(uploaded_file):
 
     請輸出格式化後的結果：
     """
-    formatted_text_response = call_gemini_api(formatting_prompt)
-    if formatted_text_response.startswith("錯誤："):
-        return raw_transcript[:1000]+"...", formatted_text_response, "無法進行分析", "", None
-    formatted_text = formatted_text_response
-    print("Gemini 格式化步驟完成。")
 
-    # --- 步驟 2: Gemini HEXACO 分析 ---
-    # Prompt 微調，告知輸入是 Q&A 格式，主要分析回答
-    hexaco_prompt = f"""
+
+# HEXACO 官方定義（內部參考用）
+HEXACO_DEFINITIONS = """
 [系統指令：供 GPT 內部參考，不要直接輸出此段]
 
 【HEXACO Domain-Level 官方英文定義（供內部判斷，請勿直接引用英文原文）】
@@ -363,7 +371,10 @@ def process_input_and_analyze(uploaded_file):
 - 禁止直接貼出或引用英文原文。
 - 僅可用中文進行**摘要式詮釋**每個特質的核心意義。
 
-===========================================================
+"""
+
+# HEXACO 報告的結構與評分規範
+HEXACO_REPORT_RULES = """===========================================================
 【目標：產出個人特質分析報告（HEXACO 模組格式）】
 
 請根據以下逐字稿資料，針對六個 HEXACO 特質撰寫結構化報告，重點條件如下：
@@ -391,18 +402,544 @@ def process_input_and_analyze(uploaded_file):
 
 ===========================================================
 
-以下是面試逐字稿原文（格式已為問答形式）：
+"""
+
+
+# 固定前綴只組一次，呼叫時由 prompt_cache 判斷前綴並改用 context cache
+HEXACO_REPORT_TEMPLATE = prompt_cache.register(
+    PromptTemplate("hw5 HEXACO 報告", HEXACO_DEFINITIONS + HEXACO_REPORT_RULES))
+HEXACO_EVIDENCE_TEMPLATE = prompt_cache.register(
+    PromptTemplate("hw5 HEXACO 證據", HEXACO_DEFINITIONS))
+
+
+def build_hexaco_prompt(formatted_text: str) -> str:
+    """ 步驟 2：根據問答格式逐字稿撰寫 HEXACO 報告的提示詞 """
+    # Prompt 微調，告知輸入是 Q&A 格式，主要分析回答
+    return HEXACO_REPORT_TEMPLATE.render(f"""以下是面試逐字稿原文（格式已為問答形式）：
     ```
     {formatted_text}
     ```
 
     請嚴格依照上述結構與語言規範，撰寫完整 HEXACO 模組分析報告。
+    """)
+
+
+def build_chunk_formatting_prompt(chunk: str, index: int, total: int) -> str:
+    """ 切塊格式化：每塊各自從 1 開始編號，之後由 renumber_qa 統一編號 """
+    note = (f"（以下為完整訪談逐字稿的第 {index + 1}/{total} 段，可能從對話中間開始或結束；"
+            "問答編號請從 1 開始。）\n")
+    return note + build_formatting_prompt(chunk)
+
+
+def build_evidence_prompt(formatted_chunk: str, index: int, total: int) -> str:
+    """ 切塊 HEXACO 證據蒐集：只摘錄證據，不撰寫報告 """
+    return HEXACO_EVIDENCE_TEMPLATE.render(f"""===========================================================
+【目標：蒐集行為證據（中間產物，不是最終報告）】
+
+以下是面試逐字稿的第 {index + 1}/{total} 段（格式已為問答形式）。
+請針對六個 HEXACO 特質，逐一摘錄此段中可作為判斷依據的受訪者原文，
+並以一句中文說明該證據顯示此特質偏高或偏低。若此段沒有相關內容，請寫「無」。
+
+輸出格式：
+【特質中文名稱】
+- 「面試原文」：說明
+
+    ```
+    {formatted_chunk}
+    ```
+    """)
+
+
+def build_merge_prompt(evidence_chunks) -> str:
+    """ 合併各塊證據，依原本的報告規範撰寫完整 HEXACO 報告 """
+    evidence_text = "\n\n".join(
+        f"【第 {i + 1} 段】\n{evidence}" for i, evidence in enumerate(evidence_chunks))
+    return HEXACO_REPORT_TEMPLATE.render(f"""以下是從整份面試逐字稿各段落蒐集到的行為證據（「」內皆為面試原文）：
+    ```
+    {evidence_text}
+    ```
+
+    請綜合所有段落的證據，嚴格依照上述結構與語言規範，撰寫完整 HEXACO 模組分析報告。
+    """)
+
+
+def split_transcript(text: str, max_chars: int = None):
+    """
+    依句尾標點或換行將逐字稿切塊，每塊不超過 max_chars 字（只含空白的片段併入前一塊，可能略超過）。
+    各塊依序接起來即為原文，不會遺失任何字元。
     """
-    hexaco_analysis_response = call_gemini_api(hexaco_prompt)
+    max_chars = max_chars or TRANSCRIPT_CHUNK_CHARS
+    chunks = []
+    current = ""
+    # 每個片段為「句子 + 句尾標點/換行」，開頭或換行後緊接的標點也會被涵蓋
+    for sentence in re.findall(r'[^。！？!?\n]*[。！？!?\n]+|[^。！？!?\n]+', text):
+        if current and len(current) + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ""
+        # 沒有標點的超長句直接硬切
+        while len(sentence) > max_chars:
+            chunks.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        current += sentence
+    if current:
+        chunks.append(current)
+    merged = []
+    for chunk in chunks:
+        if merged and not chunk.strip():
+            merged[-1] += chunk
+        elif merged and not merged[-1].strip():
+            merged[-1] += chunk
+        else:
+            merged.append(chunk)
+    return merged or [text]
+
+
+QA_NUMBER_PATTERN = re.compile(r'^(\s*(?:\*\*)?(?:問題|回答)\s*\[?\s*)(\d+)', re.M)
+
+
+def renumber_qa(formatted_chunks) -> str:
+    """ 各塊的問答編號都從 1 開始，依序加上前面各塊的最大編號，讓整份編號連續 """
+    results = []
+    offset = 0
+    for chunk in formatted_chunks:
+        highest = 0
+
+        def shift(match):
+            nonlocal highest
+            number = int(match.group(2))
+            highest = max(highest, number)
+            return f"{match.group(1)}{number + offset}"
+
+        results.append(QA_NUMBER_PATTERN.sub(shift, chunk))
+        offset += highest
+    return "\n\n".join(results)
+
+
+# ----- 主要處理函數 -----
+
+
+# ----- 模型路由：便宜模型先做，輸出檢查不通過或信心不足才升級 -----
+HEXACO_TRAITS = {
+    "誠實-謙遜": ("誠實", "謙遜"),
+    "情緒性": ("情緒",),
+    "外向性": ("外向",),
+    "親和性": ("親和", "宜人"),
+    "盡責性": ("盡責", "嚴謹", "勤勉"),
+    "開放性": ("開放",),
+}
+# 與 QA_NUMBER_PATTERN 一致，接受 **問題 [1]**: 這類加粗或加方括號的編號
+QA_QUESTION = re.compile(r"(?:\*\*)?問題\s*\[?\s*\d+\s*\]?\s*(?:\*\*)?\s*[:：]")
+QA_ANSWER = re.compile(r"(?:\*\*)?回答\s*\[?\s*\d+\s*\]?\s*(?:\*\*)?\s*[:：]")
+
+
+def missing_traits(text: str):
+    return [trait for trait, keywords in HEXACO_TRAITS.items() if not any(k in text for k in keywords)]
+
+
+def validate_formatting(text: str, prompt: str) -> model_router.Verdict:
+    """ 問答格式化：至少一組「問題N: / 回答N:」，且問題與回答數量相符 """
+    questions, answers = len(QA_QUESTION.findall(text)), len(QA_ANSWER.findall(text))
+    if not questions or not answers:
+        return model_router.Verdict(False, "缺少問答格式")
+    if abs(questions - answers) > 1:
+        return model_router.Verdict(False, f"問答數不一致 {questions}/{answers}")
+    return model_router.Verdict(True)
+
+
+def validate_evidence(text: str, prompt: str) -> model_router.Verdict:
+    """ 證據蒐集：六個特質都要有段落（沒有證據時寫「無」） """
+    missing = missing_traits(text)
+    return model_router.Verdict(not missing, f"缺少特質 {'、'.join(missing)}")
+
+
+def validate_report(text: str, prompt: str) -> model_router.Verdict:
+    """ HEXACO 報告：六個特質都要出現，且每個特質都有評分 """
+    missing = missing_traits(text)
+    if missing:
+        return model_router.Verdict(False, f"缺少特質 {'、'.join(missing)}")
+    if text.count("評分") < len(HEXACO_TRAITS):
+        return model_router.Verdict(False, "評分不足六項")
+    return model_router.Verdict(True)
+
+
+FORMAT_ROUTER = model_router.ModelRouter("hw5 問答格式化", prompt_cache.generate, validate_formatting)
+EVIDENCE_ROUTER = model_router.ModelRouter("hw5 HEXACO 證據", prompt_cache.generate, validate_evidence)
+REPORT_ROUTER = model_router.ModelRouter("hw5 HEXACO 報告", prompt_cache.generate, validate_report,
+                                         ask_confidence=True)
+
+
+def call_gemini_api(prompt: str, router: model_router.ModelRouter, stage: str = "analyse"):
+    """
+    經由 router 呼叫 Gemini（便宜模型先做，檢查不通過才升級）；重試、退避與斷路器由閘道處理，
+    失敗時回傳「錯誤：」開頭的訊息。stage 為追蹤用的階段名稱（format / analyse）。
+    """
+    if not api_key:
+        return "錯誤：請在 .env 檔案中設定 GEMINI_API_KEY"
+    with tracing.span(stage, prompt_chars=len(prompt)) as span:
+        try:
+            # 以已登記前綴開頭的提示詞只送後綴，其餘照常整段送出
+            result = router.route(prompt)
+            span.set(output_chars=len(result.value), model=result.model, validated=result.validated)
+            if not result.validated:
+                return f"注意：{router.task}結果未通過檢查（{result.reason}）\n\n{result.value.strip()}"
+            return result.value.strip()
+        except Exception as e:
+            print(f"Gemini 呼叫失敗：{e}")
+            span.set(error=type(e).__name__)
+            return f"錯誤：Gemini API 呼叫失敗：{e}"
+
+
+WHISPER_LANGUAGE = "zh"
+# 預設先一次解碼成 16 kHz 並裁掉長靜音再交給模型 (見 hw5_audio.py)；設為 0 則直接給檔案路徑
+TRIM_SILENCE = os.getenv("HW5_TRIM_SILENCE", "1") != "0"
+transcript_cache = None
+
+
+def get_transcript_cache() -> TranscriptCache:
+    global transcript_cache
+    if transcript_cache is None:
+        transcript_cache = TranscriptCache()
+    return transcript_cache
+
+
+_service_tag = None
+_service_trim = None
+
+
+def transcription_tag() -> str:
+    """
+    快取鍵中的引擎識別：使用轉錄服務時以服務端實際載入的後端為準。
+    服務的後端可能隨重啟改變，每次轉錄回覆都會帶回後端識別並更新，連線失敗時則重新查詢。
+    """
+    global _service_tag, _service_trim
+    if not ASR_SERVICE:
+        return asr_backend.tag
+    if _service_tag is None:
+        import hw5_whisper_service
+        info = hw5_whisper_service.service_info(ASR_SERVICE)
+        _service_tag, _service_trim = info["backend"], info.get("trim", True)
+    return _service_tag
+
+
+def transcription_trim(mode: str = "full") -> bool:
+    """ 快取鍵中的「是否裁切靜音」：分段轉錄不裁切；使用轉錄服務時以服務端設定為準 """
+    if mode == "segmented":
+        return False
+    if ASR_SERVICE:
+        transcription_tag()
+        return _service_trim
+    return TRIM_SILENCE
+
+
+def lookup_cached_transcript(audio_filepath, mode: str = "full"):
+    """
+    依音檔內容、轉錄後端、語言、轉錄方式 (full / segmented) 與是否裁切靜音查詢逐字稿快取，
+    回傳 (快取鍵, 逐字稿或 None)
+    """
+    with tracing.span("transcript_cache", mode=mode) as span:
+        key = cache_key(file_sha256(audio_filepath), transcription_tag(), WHISPER_LANGUAGE, mode,
+                        transcription_trim(mode))
+        text = get_transcript_cache().get(key)
+        span.set(hit=text is not None)
+    if text is not None:
+        print(f"逐字稿快取命中，略過 Whisper 轉錄: {os.path.basename(audio_filepath)}")
+    return key, text
+
+
+def store_cached_transcript(key: str, audio_filepath, text: str, segments=None, mode: str = "full"):
+    try:
+        get_transcript_cache().put(key, text, model=transcription_tag(), language=WHISPER_LANGUAGE,
+                                   mode=mode, trim=transcription_trim(mode),
+                                   source=os.path.basename(audio_filepath), segments=segments)
+    except OSError as e:
+        print(f"寫入逐字稿快取失敗: {e}")
+
+
+@contextmanager
+def prepared_audio(audio_filepath):
+    """
+    產生交給模型的音訊輸入，回傳 (音訊, 時間對照表)：
+    TRIM_SILENCE 時為裁切靜音後的 16 kHz 陣列與對照表；否則為檔案路徑與 None。
+    """
+    if not TRIM_SILENCE:
+        with staged_input(audio_filepath) as staged_path:
+            yield staged_path, None
+        return
+    import hw5_audio
+    with hw5_audio.PreprocessedAudio(audio_filepath) as pre:
+        print(pre.summary())
+        yield pre.trimmed, pre.timestamps
+
+
+def run_remote_transcription(audio_filepath):
+    """ 交給共用轉錄服務轉錄（服務端負責解碼、裁切靜音與排程），回傳 (逐字稿, 錯誤訊息) """
+    global _service_tag, _service_trim
+    import hw5_whisper_service
+    try:
+        key, cached = lookup_cached_transcript(audio_filepath)
+        if cached is not None:
+            return cached, None
+        print(f"送交轉錄服務 {ASR_SERVICE}: {audio_filepath}")
+        settings = (transcription_tag(), transcription_trim())
+        result = hw5_whisper_service.transcribe_remote(audio_filepath, WHISPER_LANGUAGE, ASR_SERVICE,
+                                                       timeout=ASR_SERVICE_TIMEOUT)
+        if (result["backend"], result["trim"]) != settings:
+            # 服務已換成其他後端或裁切設定重啟：改用實際轉錄的設定作為快取鍵
+            print(f"轉錄服務設定已變更：{settings} -> {(result['backend'], result['trim'])}")
+            _service_tag, _service_trim = result["backend"], result["trim"]
+            key = cache_key(file_sha256(audio_filepath), _service_tag, WHISPER_LANGUAGE, trim=_service_trim)
+    except OSError as e:
+        return None, f"錯誤：無法讀取音檔: {e}"
+    except hw5_whisper_service.ServiceError as e:
+        print(f"轉錄服務錯誤: {e}")
+        _service_tag = None  # 服務可能正在重啟，下次重新查詢後端
+        return None, f"錯誤：Whisper 轉錄失敗: {e}"
+    print(f"轉錄服務完成（排隊 {result['queue_seconds']:.1f} 秒，轉錄 {result['transcribe_seconds']:.1f} 秒）。")
+    store_cached_transcript(key, audio_filepath, result["text"], result["segments"])
+    return result["text"], None
+
+
+def run_whisper_transcription(audio_filepath):
+    """ 執行 Whisper 轉錄（先查快取；以硬連結或就地讀取避免 temp 被清除） """
+    if ASR_SERVICE:
+        return run_remote_transcription(audio_filepath)
+    try:
+        key, cached = lookup_cached_transcript(audio_filepath)
+    except OSError as e:
+        return None, f"錯誤：無法讀取音檔: {e}"
+    if cached is not None:
+        return cached, None
+
+    # 若背景預熱尚未完成，這裡會等待；若未預熱則於第一次音訊請求時載入
+    whisper_model = load_whisper_model()
+    if not whisper_model:
+        return None, f"錯誤：Whisper 模型未成功載入。{whisper_load_error or ''}"
+    try:
+        print(f"開始使用 Whisper ({asr_backend.describe()}) 轉錄檔案: {audio_filepath}")
+
+        with prepared_audio(audio_filepath) as (audio, timestamps):
+            if timestamps is not None and len(audio) == 0:
+                print("音檔中沒有偵測到語音。")
+                result = {"text": "", "segments": []}
+            else:
+                result = whisper_model.transcribe(audio, language=WHISPER_LANGUAGE)
+            segments = result.get("segments", [])
+            if timestamps is not None:
+                segments = timestamps.map_segments(segments)  # 換算回原始錄音時間
+        print("Whisper 轉錄完成。")
+        store_cached_transcript(key, audio_filepath, result["text"], segments)
+        return result["text"], None
+    except Exception as e:
+        print(f"Whisper 轉錄過程中發生錯誤: {e}")
+        return None, f"錯誤：Whisper 轉錄失敗: {e}"
+
+
+def run_segmented_transcription(audio_filepath):
+    """
+    分段平行轉錄：每當有新的分段拼接完成就 yield (部分逐字稿, 錯誤訊息, 已完成段數, 總段數)，
+    最後一次 yield 的文字即為完整逐字稿。
+    """
+    try:
+        key, cached = lookup_cached_transcript(audio_filepath, "segmented")
+        if cached is not None:
+            yield cached, None, 1, 1
+            return
+        import hw5_transcribe
+        print(f"開始使用 Whisper ({asr_backend.describe()}) 分段轉錄檔案: {audio_filepath}")
+        partial = ""
+        with prepared_audio(audio_filepath) as (audio, timestamps):
+            if timestamps is None or len(audio):
+                for partial, done, total in hw5_transcribe.transcribe_segmented(
+                        audio, backend=asr_backend, language=WHISPER_LANGUAGE):
+                    yield partial, None, done, total
+            else:
+                yield partial, None, 0, 0
+        print("Whisper 分段轉錄完成。")
+        store_cached_transcript(key, audio_filepath, partial, mode="segmented")
+    except Exception as e:
+        print(f"Whisper 分段轉錄過程中發生錯誤: {e}")
+        yield None, f"錯誤：Whisper 轉錄失敗: {e}", 0, 0
+
+
+AUDIO_FORMATS = ['.wav', '.mp3', '.m4a',
+                 '.ogg', '.flac']  # Whisper 支援的常見格式
+VIDEO_FORMATS = ['.mp4', '.mov', '.avi', '.mkv']  # Whisper 也常能處理影片中的音訊
+TEXT_FORMATS = ['.txt']
+
+
+def preview_text(text: str, limit: int = 1000) -> str:
+    return text[:limit] + ("..." if len(text) > limit else "")
+
+
+def run_single_analysis(raw_transcript: str):
+    """
+    逐字稿不長時的原始流程：整份格式化，再整份做 HEXACO 分析。
+    與 run_chunked_analysis 相同，yield (階段, 格式化文字, 分析文字)，階段為 progress/done/error。
+    """
+    # --- 步驟 1: Gemini 格式化 (Q&A) ---
+    formatting_prompt = build_formatting_prompt(raw_transcript)
+    formatted_text_response = call_gemini_api(formatting_prompt, FORMAT_ROUTER, "format")
+    if formatted_text_response.startswith("錯誤："):
+        yield "error", formatted_text_response, "無法進行分析"
+        return
+    formatted_text = formatted_text_response
+    print("Gemini 格式化步驟完成。")
+    yield "progress", formatted_text, "Gemini HEXACO 分析中..."
+
+    # --- 步驟 2: Gemini HEXACO 分析 ---
+    hexaco_prompt = build_hexaco_prompt(formatted_text)
+    hexaco_analysis_response = call_gemini_api(hexaco_prompt, REPORT_ROUTER)
     if hexaco_analysis_response.startswith("錯誤："):
-        return raw_transcript[:1000]+"...", formatted_text, hexaco_analysis_response, "", None
-    hexaco_analysis = hexaco_analysis_response
+        yield "error", formatted_text, hexaco_analysis_response
+        return
     print("HEXACO 分析步驟完成。")
+    yield "done", formatted_text, hexaco_analysis_response
+
+
+def run_chunked_analysis(chunks):
+    """
+    長逐字稿流程：各塊平行格式化；任一塊格式化完成，立刻送出該塊的 HEXACO 證據蒐集，
+    全部完成後統一問答編號並合併證據產出報告。總耗時趨近於最慢一塊（格式化 + 證據）再加上合併。
+    """
+    total = len(chunks)
+    formatted = [None] * total
+    evidence = [None] * total
+    print(f"逐字稿切成 {total} 塊平行處理。")
+
+    with ThreadPoolExecutor(max_workers=LLM_WORKERS) as executor:
+        format_futures = {
+            executor.submit(tracing.wrap(call_gemini_api),
+                            build_chunk_formatting_prompt(chunk, i, total), FORMAT_ROUTER, "format"): i
+            for i, chunk in enumerate(chunks)}
+        evidence_futures = {}
+        pending = set(format_futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if future in format_futures:
+                    index = format_futures[future]
+                    if result.startswith("錯誤："):
+                        for other in pending:
+                            other.cancel()
+                        yield "error", result, "無法進行分析"
+                        return
+                    formatted[index] = result
+                    evidence_future = executor.submit(
+                        tracing.wrap(call_gemini_api), build_evidence_prompt(result, index, total),
+                        EVIDENCE_ROUTER)
+                    evidence_futures[evidence_future] = index
+                    pending.add(evidence_future)
+                else:
+                    if result.startswith("錯誤："):
+                        for other in pending:
+                            other.cancel()
+                        yield "error", renumber_qa([f for f in formatted if f]), result
+                        return
+                    evidence[evidence_futures[future]] = result
+            formatted_done = sum(f is not None for f in formatted)
+            evidence_done = sum(e is not None for e in evidence)
+            yield ("progress", f"Gemini 格式化中 ({formatted_done}/{total} 塊)...",
+                   f"HEXACO 證據蒐集中 ({evidence_done}/{total} 塊)...")
+
+    formatted_text = renumber_qa(formatted)
+    print("Gemini 格式化步驟完成。")
+    yield "progress", formatted_text, "Gemini HEXACO 合併分析中..."
+
+    hexaco_analysis_response = call_gemini_api(build_merge_prompt(evidence), REPORT_ROUTER)
+    if hexaco_analysis_response.startswith("錯誤："):
+        yield "error", formatted_text, hexaco_analysis_response
+        return
+    print("HEXACO 分析步驟完成。")
+    yield "done", formatted_text, hexaco_analysis_response
+
+
+def run_analysis(raw_transcript: str):
+    """ 長逐字稿切塊平行格式化，每塊格式化完成就接著蒐集 HEXACO 證據，最後再合併成報告 """
+    chunks = split_transcript(raw_transcript)
+    if len(chunks) > 1:
+        return run_chunked_analysis(chunks)
+    return run_single_analysis(raw_transcript)
+
+
+def analyze_transcript(raw_transcript: str):
+    """ 非互動版的格式化 + HEXACO 分析，回傳 (格式化文字, 分析文字, 錯誤訊息或 None) """
+    stage, formatted_text, hexaco_analysis = "error", "", "錯誤：沒有分析結果"
+    for stage, formatted_text, hexaco_analysis in run_analysis(raw_transcript):
+        pass
+    if stage == "error":
+        error = formatted_text if formatted_text.startswith("錯誤：") else hexaco_analysis
+        return formatted_text, hexaco_analysis, error
+    return formatted_text, hexaco_analysis, None
+
+
+@tracing.traced("hw5")
+def process_input_and_analyze(uploaded_file):
+    """
+    核心處理流程：接收上傳 -> (可選)轉錄 -> 格式化 -> 分析 -> 產 PDF
+    以產生器實作，讓 Gradio 在轉錄途中即時顯示部分逐字稿；最後一次 yield 為最終結果。
+    """
+    if uploaded_file is None:
+        yield "請先上傳檔案。", "", "", None
+        return
+
+    filepath = uploaded_file  # Gradio File/Audio/Video 的 .name 就是路徑
+    filename = os.path.basename(filepath)
+    file_ext = os.path.splitext(filename)[1].lower()
+    print(f"收到檔案: {filename}, 路徑: {filepath}, 類型: {file_ext}")
+    tracing.annotate(file=filename)
+
+    raw_transcript = ""
+    error_message = None
+
+    # --- 步驟 0: 判斷檔案類型並執行 Whisper (如果需要) ---
+    if file_ext in AUDIO_FORMATS or file_ext in VIDEO_FORMATS:
+        segmented = SEGMENTED_TRANSCRIPTION and not ASR_SERVICE
+        mode = "segmented" if segmented else "service" if ASR_SERVICE else "local"
+        size = os.path.getsize(filepath) if os.path.exists(filepath) else None
+        with tracing.span("transcribe", mode=mode, bytes=size) as span:
+            if segmented:
+                for partial, error_message, done, total in run_segmented_transcription(filepath):
+                    if error_message:
+                        break
+                    raw_transcript = partial
+                    span.set(segments=total)
+                    yield f"[轉錄中 {done}/{total} 段]\n" + preview_text(partial), "", "", None
+            else:
+                yield "Whisper 轉錄中...", "", "", None
+                raw_transcript, error_message = run_whisper_transcription(filepath)
+            span.set(chars=len(raw_transcript or ""), error=bool(error_message))
+        if error_message:
+            # 如果轉錄失敗，提前返回錯誤
+            yield f"Whisper 轉錄失敗: {error_message}", "", "", None
+            return
+    elif file_ext in TEXT_FORMATS:
+        try:
+            with tracing.span("read_text", bytes=os.path.getsize(filepath)) as span:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    raw_transcript = f.read()
+                span.set(chars=len(raw_transcript))
+            print("直接讀取提供的 .txt 逐字稿。")
+            if not raw_transcript.strip():
+                yield "錯誤：上傳的文字檔內容為空。", "", "", None
+                return
+        except Exception as e:
+            print(f"讀取 .txt 檔案時出錯: {e}")
+            yield f"錯誤：無法讀取文字檔: {e}", "", "", None
+            return
+    else:
+        yield f"錯誤：不支援的檔案格式 '{file_ext}'。請上傳音檔、視訊檔或 .txt 檔。", "", "", None
+        return
+    yield preview_text(raw_transcript), "Gemini 格式化中...", "", None
+
+    # --- 步驟 1 + 2: Gemini 格式化 (Q&A) 與 HEXACO 分析 ---
+    for stage, formatted_text, hexaco_analysis in run_analysis(raw_transcript):
+        yield preview_text(raw_transcript), formatted_text, hexaco_analysis, None
+        if stage == "error":
+            return
+    print(prompt_cache.report())
+    print(model_router.report())
+    print(llm_gateway.report())
 
     # --- 步驟 3: 產生 PDF 報告 ---
     pdf_title = f"訪談分析報告 - {filename} ({datetime.now().strftime('%Y-%m-%d')})"
@@ -414,79 +951,87 @@ def process_input_and_analyze(uploaded_file):
     else:
         print("PDF 報告生成失敗。")
         # 即使 PDF 失敗，也返回文字結果
-        return raw_transcript[:1000]+"...", formatted_text, hexaco_analysis, "", None
+        yield preview_text(raw_transcript), formatted_text, hexaco_analysis, None
+        return
 
     # --- 步驟 4: 返回結果給 Gradio ---
-    preview_original = raw_transcript[:1000] + \
-        ("..." if len(raw_transcript) > 1000 else "")
     # 返回原始稿預覽、格式化文字、分析文字、PDF路徑
-    return preview_original, formatted_text, hexaco_analysis, pdf_path
+    yield preview_text(raw_transcript), formatted_text, hexaco_analysis, pdf_path
 
 
 # ----- Gradio 介面定義 -----
-with gr.Blocks(css="footer {visibility: hidden}") as demo:
-    gr.Markdown("# 訪談錄音/逐字稿 智慧分析工具 (Whisper -> Gemini Q&A -> Gemini HEXACO)")
-    gr.Markdown(
-        "上傳訪談的**錄音檔** (如 .mp3, .wav) 或 **逐字稿文字檔** (.txt)。系統將自動進行語音轉錄 (若為音檔)、問答格式整理、HEXACO 人格特質初步分析，並產生 PDF 報告。")
-
-    with gr.Row():
-        # 輸入元件：支援音檔和文字檔
-        file_input = gr.File(label="上傳錄音檔或逐字稿 (.mp3, .wav, .m4a, .mp4, .txt)",
-                             file_types=['audio', 'video',
-                                         '.txt'],  # 接受音訊、視訊、txt
-                             type="filepath")  # 確保得到路徑
-
-    # 觸發按鈕
-    submit_button = gr.Button("🚀 開始處理與分析")
-
-    with gr.Accordion("處理結果預覽", open=True):  # 使用 Accordion 折疊區塊
-        with gr.Row():
-            # 原始文字預覽
-            original_output = gr.Textbox(
-                label="原始逐字稿 (預覽)", lines=8, interactive=False)
-        with gr.Row():
-            # 格式化 Q&A
-            formatted_output = gr.Textbox(
-                label="Gemini 格式化結果 (Q&A)", lines=15, interactive=False)
-        with gr.Row():
-            # HEXACO 分析
-            hexaco_output = gr.Textbox(
-                label="Gemini HEXACO 初步分析", lines=15, interactive=False)
+def build_demo():
+    """ 建立 Gradio 介面（gradio 於此才匯入） """
+    import gradio as gr
+
+    with gr.Blocks(css="footer {visibility: hidden}") as demo:
+        gr.Markdown("# 訪談錄音/逐字稿 智慧分析工具 (Whisper -> Gemini Q&A -> Gemini HEXACO)")
+        gr.Markdown(
+            "上傳訪談的**錄音檔** (如 .mp3, .wav) 或 **逐字稿文字檔** (.txt)。系統將自動進行語音轉錄 (若為音檔)、問答格式整理、HEXACO 人格特質初步分析，並產生 PDF 報告。")
+
         with gr.Row():
-            # PDF 下載
-            pdf_output = gr.File(label="下載 PDF 分析報告", interactive=False)
+            # 輸入元件：支援音檔和文字檔
+            file_input = gr.File(label="上傳錄音檔或逐字稿 (.mp3, .wav, .m4a, .mp4, .txt)",
+                                 file_types=['audio', 'video',
+                                             '.txt'],  # 接受音訊、視訊、txt
+                                 type="filepath")  # 確保得到路徑
+
+        # 觸發按鈕
+        submit_button = gr.Button("🚀 開始處理與分析")
+
+        with gr.Accordion("處理結果預覽", open=True):  # 使用 Accordion 折疊區塊
+            with gr.Row():
+                # 原始文字預覽
+                original_output = gr.Textbox(
+                    label="原始逐字稿 (預覽)", lines=8, interactive=False)
+            with gr.Row():
+                # 格式化 Q&A
+                formatted_output = gr.Textbox(
+                    label="Gemini 格式化結果 (Q&A)", lines=15, interactive=False)
+            with gr.Row():
+                # HEXACO 分析
+                hexaco_output = gr.Textbox(
+                    label="Gemini HEXACO 初步分析", lines=15, interactive=False)
+            with gr.Row():
+                # PDF 下載
+                pdf_output = gr.File(label="下載 PDF 分析報告", interactive=False)
+
+        # 綁定按鈕點擊事件
+        submit_button.click(
+            fn=process_input_and_analyze,
+            inputs=[file_input],
+            # 注意輸出元件的順序要和函數 return 的順序一致
+            outputs=[original_output, formatted_output, hexaco_output, pdf_output]
+        )
 
-    # 綁定按鈕點擊事件
-    submit_button.click(
-        fn=process_input_and_analyze,
-        inputs=[file_input],
-        # 注意輸出元件的順序要和函數 return 的順序一致
-        outputs=[original_output, formatted_output, hexaco_output, pdf_output]
-    )
+        gr.Markdown("---")
+        gr.Markdown("💡 **提示:** 語音轉錄和 AI 分析需要時間，請耐心等候。大型檔案處理時間可能較長。")
+        gr.Markdown("📄 **PDF 報告:** 包含原始稿預覽、格式化問答、HEXACO 分析結果。請確保已放置中文字型以正確顯示報告。")
 
-    gr.Markdown("---")
-    gr.Markdown("💡 **提示:** 語音轉錄和 AI 分析需要時間，請耐心等候。大型檔案處理時間可能較長。")
-    gr.Markdown("📄 **PDF 報告:** 包含原始稿預覽、格式化問答、HEXACO 分析結果。請確保已放置中文字型以正確顯示報告。")
+    return demo
 
 
 # ----- 啟動 Gradio App -----
+record_timing("module_import", _module_start)
+
 if __name__ == "__main__":
     # 執行前的檢查
     ready_to_launch = True
     if not api_key:
         print("錯誤：未設定 GEMINI_API_KEY 環境變數。")
         ready_to_launch = False
-    if not gemini_model:
-        print("錯誤：Gemini Client 未成功初始化。")
-        ready_to_launch = False
-    if not whisper_model:
-        print("警告：Whisper 模型載入失敗，語音轉錄功能將不可用。")
-        # 即使 Whisper 失敗，可能仍希望啟動來處理 txt
-    if not CHINESE_FONT_PATH:
-        print("警告：未找到中文字型，PDF 中的中文可能無法正確顯示。")
 
     if ready_to_launch:
+        start = time.perf_counter()
+        demo = build_demo()
+        record_timing("build_ui", start)
         print("應用程式準備就緒...")
-        demo.launch()
+        start = time.perf_counter()
+        demo.launch(prevent_thread_lock=True)
+        record_timing("launch_ui", start)
+        # UI 啟動後才於背景載入 Whisper；設定 HW5_WHISPER_WARMUP=0 則延到第一次音訊請求
+        if os.getenv("HW5_WHISPER_WARMUP", "1") != "0":
+            start_whisper_warmup()
+        demo.block_thread()
     else:
         print("應用程式因缺少必要元件或設定而無法啟動。")
@@ -0,0 +1,176 @@
+"""
+hw5 語音轉錄後端
+
+run_whisper_transcription 只透過這裡的介面呼叫模型，部署時以環境變數選擇引擎：
+  HW5_ASR_BACKEND       whisper (預設，openai-whisper / PyTorch fp32)
+                        faster-whisper (CTranslate2，CPU 上以 int8 量化推論，速度快數倍、記憶體約減半)
+                        stub (不載入模型，依音訊長度休眠後回傳固定文字，供負載測試使用)
+  HW5_ASR_MODEL         模型大小：tiny / base / small / medium / large-v3 ...（預設 medium）
+  HW5_ASR_THREADS       推論執行緒數，0 為交給引擎自行決定（預設 0）
+  HW5_ASR_COMPUTE_TYPE  faster-whisper 的運算精度：int8 (預設) / int8_float32 / float32
+  HW5_ASR_BATCH_SIZE    faster-whisper 以 BatchedInferencePipeline 一次解碼的 30 秒視窗數，0 為不批次（預設 0）
+  HW5_ASR_STUB_RTF      stub 的模擬 real-time factor（預設 0.05，即 60 秒音訊休眠 3 秒）
+
+每個後端的 transcribe() 都接受檔案路徑或 16 kHz float32 陣列，
+回傳與 openai-whisper 相同格式的 {"text": ..., "segments": [{"start", "end", "text"}, ...]}。
+"""
+import os
+import time
+from abc import ABC, abstractmethod
+
+
+class ASRBackend(ABC):
+    """ 轉錄後端的共同介面；load() 只在第一次使用時匯入並載入模型，子類別須實作 _load() 與 transcribe() """
+
+    name = ""
+
+    def __init__(self, model_name: str = "medium", threads: int = 0):
+        self.model_name = model_name
+        self.threads = threads
+        self.model = None
+
+    @property
+    def tag(self) -> str:
+        """ 逐字稿快取鍵使用的識別字串，不同引擎/精度的結果不會混用 """
+        return f"{self.name}:{self.model_name}"
+
+    def describe(self) -> str:
+        threads = self.threads or "auto"
+        return f"{self.name} {self.model_name} (threads={threads})"
+
+    def load(self):
+        if self.model is None:
+            self.model = self._load()
+        return self
+
+    @abstractmethod
+    def _load(self):
+        """ 匯入引擎並載入模型，回傳模型物件 """
+
+    @abstractmethod
+    def transcribe(self, audio, language: str = "zh") -> dict:
+        """ 轉錄檔案路徑或 16 kHz float32 陣列 """
+
+
+class WhisperBackend(ASRBackend):
+    """ openai-whisper：原本的實作，CPU 上以 fp32 推論 """
+
+    name = "whisper"
+
+    def _load(self):
+        import torch
+        import whisper
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        return whisper.load_model(self.model_name, device="cpu")
+
+    def transcribe(self, audio, language: str = "zh") -> dict:
+        self.load()
+        result = self.model.transcribe(audio, language=language, fp16=False)
+        return {"text": result["text"],
+                "segments": [{"start": seg["start"], "end": seg["end"], "text": seg["text"]}
+                             for seg in result.get("segments", [])]}
+
+
+class FasterWhisperBackend(ASRBackend):
+    """ faster-whisper：CTranslate2 引擎，權重量化為 int8 在 CPU 上推論 """
+
+    name = "faster-whisper"
+
+    def __init__(self, model_name: str = "medium", threads: int = 0, compute_type: str = "int8",
+                 batch_size: int = 0):
+        super().__init__(model_name, threads)
+        self.compute_type = compute_type
+        self.batch_size = batch_size
+        self._batched = None
+
+    @property
+    def tag(self) -> str:
+        # 批次管線先以 VAD 切段，結果與逐段解碼略有不同，快取鍵分開
+        batched = f":b{self.batch_size}" if self.batch_size else ""
+        return f"{self.name}:{self.model_name}:{self.compute_type}{batched}"
+
+    def describe(self) -> str:
+        threads = self.threads or "auto"
+        batched = f", batch={self.batch_size}" if self.batch_size else ""
+        return f"{self.name} {self.model_name} (threads={threads}, {self.compute_type}{batched})"
+
+    def _load(self):
+        from faster_whisper import WhisperModel
+        model = WhisperModel(self.model_name, device="cpu", compute_type=self.compute_type,
+                             cpu_threads=self.threads)
+        if self.batch_size:
+            from faster_whisper import BatchedInferencePipeline
+            self._batched = BatchedInferencePipeline(model=model)
+        return model
+
+    def transcribe(self, audio, language: str = "zh") -> dict:
+        self.load()
+        # segments 是惰性產生器，實際解碼在迭代時進行
+        if self._batched is not None:
+            segments, _info = self._batched.transcribe(audio, language=language, beam_size=5,
+                                                       batch_size=self.batch_size)
+        else:
+            segments, _info = self.model.transcribe(audio, language=language, beam_size=5)
+        segments = [{"start": seg.start, "end": seg.end, "text": seg.text} for seg in segments]
+        return {"text": "".join(seg["text"] for seg in segments), "segments": segments}
+
+
+class StubBackend(ASRBackend):
+    """ 假的轉錄引擎：耗時 = 音訊長度 × rtf，不需要 whisper / torch """
+
+    name = "stub"
+
+    def __init__(self, model_name: str = "stub", threads: int = 0, rtf: float = None):
+        super().__init__(model_name, threads)
+        self.rtf = rtf if rtf is not None else float(os.getenv("HW5_ASR_STUB_RTF", "0.05"))
+
+    @property
+    def tag(self) -> str:
+        return f"{self.name}:{self.rtf}"
+
+    def _load(self):
+        return self
+
+    def transcribe(self, audio, language: str = "zh") -> dict:
+        if isinstance(audio, str):
+            import hw5_audio
+            seconds = hw5_audio.audio_duration(audio) or 0.0
+        else:
+            seconds = len(audio) / 16000
+        time.sleep(seconds * self.rtf)
+        text = f"（模擬逐字稿：{seconds:.1f} 秒音訊）"
+        return {"text": text, "segments": [{"start": 0.0, "end": seconds, "text": text}]}
+
+
+BACKENDS = {
+    WhisperBackend.name: WhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def create_backend(name: str = None, model_name: str = None, threads: int = None,
+                   compute_type: str = None, batch_size: int = None) -> ASRBackend:
+    """ 依參數或環境變數建立轉錄後端（不載入模型） """
+    name = name or os.getenv("HW5_ASR_BACKEND", WhisperBackend.name)
+    model_name = model_name or os.getenv("HW5_ASR_MODEL", "medium")
+    if threads is None:
+        threads = int(os.getenv("HW5_ASR_THREADS", "0"))
+    if name not in BACKENDS:
+        raise ValueError(f"未知的轉錄後端: {name}（可用: {', '.join(BACKENDS)}）")
+    if name == FasterWhisperBackend.name:
+        compute_type = compute_type or os.getenv("HW5_ASR_COMPUTE_TYPE", "int8")
+        if batch_size is None:
+            batch_size = int(os.getenv("HW5_ASR_BATCH_SIZE", "0"))
+        return FasterWhisperBackend(model_name, threads, compute_type, batch_size)
+    return BACKENDS[name](model_name, threads)
+
+
+def parse_spec(spec: str, batch_size: int = None) -> ASRBackend:
+    """ 解析 "引擎:模型[:精度]" 字串，例如 "faster-whisper:small:int8" """
+    parts = spec.split(":")
+    name = parts[0]
+    model_name = parts[1] if len(parts) > 1 else None
+    compute_type = parts[2] if len(parts) > 2 else None
+    return create_backend(name, model_name, compute_type=compute_type, batch_size=batch_size)
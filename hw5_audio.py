@@ -0,0 +1,191 @@
+"""
+hw5 音訊前處理
+
+whisper_model.transcribe(路徑) 會在呼叫內部以 ffmpeg 解碼，模型也會把運算花在電話錄音裡
+大段的靜音上。這裡改為：
+  1. 以 ffmpeg 一次解碼成 16 kHz 單聲道 float32，寫入檔案並以 numpy memmap 讀取（不佔常駐記憶體）
+  2. 以音框能量偵測語音區段，去掉長靜音，接成較短的緩衝區直接交給模型
+  3. 保留時間對照表，把裁切後的時間換算回原始錄音的時間
+"""
+import bisect
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+
+
+def decode_audio(path: str, out_path: str) -> np.memmap:
+    """ 以 ffmpeg 解碼成 16 kHz 單聲道 float32 原始資料並寫入 out_path，回傳 memmap """
+    cmd = ["ffmpeg", "-nostdin", "-threads", "0", "-i", path,
+           "-f", "f32le", "-ac", "1", "-acodec", "pcm_f32le", "-ar", str(SAMPLE_RATE),
+           "-y", "-loglevel", "error", out_path]
+    try:
+        subprocess.run(cmd, capture_output=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg 解碼失敗: {e.stderr.decode(errors='ignore')}") from e
+    if os.path.getsize(out_path) == 0:
+        return np.zeros(0, dtype=np.float32)
+    # copy-on-write：模型端若需要寫入也不會動到檔案
+    return np.memmap(out_path, dtype=np.float32, mode="c")
+
+
+def audio_duration(path: str) -> float:
+    """ 不解碼取得音檔長度（秒）：wav 讀檔頭，其他格式用 ffprobe；無法取得時回傳 None """
+    try:
+        with wave.open(path, "rb") as f:
+            return f.getnframes() / f.getframerate()
+    except (wave.Error, EOFError, OSError):
+        pass
+    cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+           "-of", "default=noprint_wrappers=1:nokey=1", path]
+    try:
+        return float(subprocess.run(cmd, capture_output=True, check=True, text=True).stdout)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def speech_regions(audio: np.ndarray, threshold_db: float = None, min_silence_s: float = 0.6,
+                   pad_s: float = 0.2, frame_ms: int = FRAME_MS):
+    """
+    以音框能量找出語音區段，回傳 [(start_sample, end_sample), ...]。
+    門檻預設為「底噪 (第 10 百分位) + 12 dB」且不低於 -55 dBFS；
+    短於 min_silence_s 的停頓保留不切，每段前後各留 pad_s 秒避免切掉字頭字尾。
+    """
+    frame_len = SAMPLE_RATE * frame_ms // 1000
+    n_frames = len(audio) // frame_len
+    if n_frames == 0:
+        return [(0, len(audio))] if len(audio) else []
+    frames = np.asarray(audio[:n_frames * frame_len]).reshape(n_frames, frame_len)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+    db = 20 * np.log10(np.maximum(rms, 1e-10))
+    if threshold_db is None:
+        threshold_db = max(float(np.percentile(db, 10)) + 12.0, -55.0)
+    voiced = db > threshold_db
+
+    regions = []
+    start = None
+    for i, is_voiced in enumerate(voiced):
+        if is_voiced and start is None:
+            start = i
+        elif not is_voiced and start is not None:
+            regions.append([start, i])
+            start = None
+    if start is not None:
+        regions.append([start, n_frames])
+
+    # 合併短停頓
+    gap = int(min_silence_s * 1000 / frame_ms)
+    merged = []
+    for region in regions:
+        if merged and region[0] - merged[-1][1] < gap:
+            merged[-1][1] = region[1]
+        else:
+            merged.append(region)
+
+    pad = int(pad_s * SAMPLE_RATE)
+    result = []
+    for s, e in merged:
+        s = max(0, s * frame_len - pad)
+        e = min(len(audio), e * frame_len + pad)
+        if result and s <= result[-1][1]:
+            result[-1] = (result[-1][0], e)
+        else:
+            result.append((s, e))
+    return result
+
+
+class TimestampMap:
+    """ 裁切後時間 <-> 原始時間的對照，pieces 為 [(裁切後起點, 原始起點, 長度)]（單位：樣本） """
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self._starts = [p[0] for p in pieces]
+
+    def to_original(self, seconds: float) -> float:
+        sample = int(seconds * SAMPLE_RATE)
+        i = max(0, bisect.bisect_right(self._starts, sample) - 1)
+        if not self.pieces:
+            return seconds
+        trimmed_start, original_start, length = self.pieces[i]
+        return (original_start + min(sample - trimmed_start, length)) / SAMPLE_RATE
+
+    def map_segments(self, segments):
+        """ 將 Whisper 回傳的 segments 時間換算回原始錄音時間 """
+        return [dict(seg, start=self.to_original(seg["start"]), end=self.to_original(seg["end"]))
+                for seg in segments]
+
+
+def trim_silence(audio: np.ndarray, out_path: str = None, **kwargs):
+    """
+    去除長靜音，回傳 (裁切後音訊, TimestampMap)。
+    有給 out_path 時裁切結果逐段寫入檔案並以 memmap 回傳，避免再複製一份在記憶體中。
+    """
+    regions = speech_regions(audio, **kwargs)
+    pieces = []
+    offset = 0
+    for s, e in regions:
+        pieces.append((offset, s, e - s))
+        offset += e - s
+    if out_path is None:
+        trimmed = (np.concatenate([np.asarray(audio[s:e]) for s, e in regions])
+                   if regions else np.zeros(0, dtype=np.float32))
+    else:
+        with open(out_path, "wb") as f:
+            for s, e in regions:
+                np.asarray(audio[s:e], dtype=np.float32).tofile(f)
+        trimmed = (np.memmap(out_path, dtype=np.float32, mode="c") if offset
+                   else np.zeros(0, dtype=np.float32))
+    return trimmed, TimestampMap(pieces)
+
+
+class PreprocessedAudio:
+    """
+    一次解碼 + 裁切靜音的結果，離開 with 區塊時刪除暫存檔：
+        with PreprocessedAudio(path) as pre:
+            model.transcribe(pre.trimmed, ...)
+    """
+
+    def __init__(self, path: str, trim: bool = True, **trim_kwargs):
+        self.path = path
+        self.work_dir = tempfile.mkdtemp(prefix="hw5_pre_")
+        try:
+            self.audio = decode_audio(path, os.path.join(self.work_dir, "decoded.f32"))
+            if trim:
+                self.trimmed, self.timestamps = trim_silence(
+                    self.audio, os.path.join(self.work_dir, "trimmed.f32"), **trim_kwargs)
+            else:
+                self.trimmed = self.audio
+                self.timestamps = TimestampMap([(0, 0, len(self.audio))])
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def original_seconds(self) -> float:
+        return len(self.audio) / SAMPLE_RATE
+
+    @property
+    def trimmed_seconds(self) -> float:
+        return len(self.trimmed) / SAMPLE_RATE
+
+    def summary(self) -> str:
+        saved = self.original_seconds - self.trimmed_seconds
+        ratio = saved / self.original_seconds * 100 if self.original_seconds else 0.0
+        return (f"音訊 {self.original_seconds:.1f} 秒，裁切靜音後 {self.trimmed_seconds:.1f} 秒"
+                f"（省下 {saved:.1f} 秒，{ratio:.0f}%）")
+
+    def close(self):
+        self.audio = self.trimmed = None
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,206 @@
+"""
+hw5 批次處理（不需 Gradio）
+
+對整個資料夾或清單檔中的面試錄音／逐字稿執行 Whisper -> 格式化 -> HEXACO -> PDF：
+  - 轉錄 (CPU 密集) 交給有上限的行程池，每個子行程各自常駐一份 Whisper 模型
+  - Gemini 呼叫與 PDF 產生 (I/O 密集) 交給另一個執行緒池
+  - 某個檔案轉錄完成就立刻送去分析，因此不同檔案的轉錄與分析會重疊進行
+每個檔案輸出一份 PDF 報告與一份文字報告，並將結果逐筆寫入 summary.csv；
+重新執行時，summary.csv 中已成功且報告仍存在的檔案會略過。
+
+用法：
+    python hw5_batch.py interviews/ -o reports/
+    python hw5_batch.py manifest.txt -o reports/ --asr-workers 2 --llm-workers 6
+清單檔為每行一個路徑（相對路徑以清單檔所在資料夾為準），或含 path 欄位的 CSV。
+"""
+import argparse
+import csv
+import functools
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import hw5
+import tracing
+
+SUPPORTED_FORMATS = set(hw5.AUDIO_FORMATS + hw5.VIDEO_FORMATS + hw5.TEXT_FORMATS)
+SUMMARY_FIELDS = ["file", "status", "transcript_chars", "transcribe_seconds",
+                  "analysis_seconds", "pdf", "text_report", "error", "finished_at"]
+
+
+def collect_inputs(source: str):
+    """ 展開資料夾或清單檔成檔案路徑清單 """
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source)
+                      if os.path.splitext(name)[1].lower() in SUPPORTED_FORMATS)
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, "r", encoding="utf-8-sig") as f:
+        if source.lower().endswith(".csv"):
+            paths = [row["path"] for row in csv.DictReader(f) if row.get("path")]
+        else:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return [p if os.path.isabs(p) else os.path.join(base, p) for p in paths]
+
+
+def report_stem(path: str) -> str:
+    """ 報告檔名保留副檔名（a.mp3 -> a_mp3_report），避免同名不同格式互相覆蓋，也不會蓋到輸入的 .txt """
+    stem, ext = os.path.splitext(os.path.basename(path))
+    return f"{stem}_{ext.lstrip('.')}_report"
+
+
+class Summary:
+    """ summary.csv：每完成一個檔案就附加一列，中斷後可接續 """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8-sig") as f:
+                for row in csv.DictReader(f):
+                    if row.get("status") == "ok" and row.get("pdf") and os.path.exists(row["pdf"]):
+                        self.done.add(os.path.abspath(row["file"]))
+
+    def record(self, **row):
+        with self._lock:
+            new_file = not os.path.exists(self.path)
+            with open(self.path, "a", newline="", encoding="utf-8-sig") as f:
+                writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(dict(row, finished_at=datetime.now().isoformat(timespec="seconds")))
+
+
+def transcribe_file(path: str):
+    """ 在轉錄子行程中執行：回傳 (逐字稿, 錯誤訊息, 耗時秒數) """
+    start = time.perf_counter()
+    with tracing.request("hw5_batch_transcribe", file=os.path.basename(path)):
+        with tracing.span("transcribe", bytes=os.path.getsize(path)) as span:
+            text, error = hw5.run_whisper_transcription(path)
+            span.set(chars=len(text or ""), error=bool(error))
+    return text, error, time.perf_counter() - start
+
+
+@tracing.traced("hw5_batch_analyse")
+def analyze_and_report(path: str, raw_transcript: str, out_dir: str):
+    """ 在分析執行緒中執行：格式化 + HEXACO + 報告輸出，回傳 summary 欄位 """
+    tracing.annotate(file=os.path.basename(path))
+    start = time.perf_counter()
+    formatted_text, hexaco_analysis, error = hw5.analyze_transcript(raw_transcript)
+    row = {"transcript_chars": len(raw_transcript)}
+    stem = report_stem(path)
+
+    text_report = os.path.join(out_dir, f"{stem}.txt")
+    with open(text_report, "w", encoding="utf-8") as f:
+        f.write(f"# 原始逐字稿\n{raw_transcript}\n\n# 格式化逐字稿\n{formatted_text}\n\n"
+                f"# HEXACO 分析\n{hexaco_analysis}\n")
+    row["text_report"] = text_report
+
+    if error:
+        row.update(status="failed", error=error)
+    else:
+        title = f"訪談分析報告 - {os.path.basename(path)} ({datetime.now().strftime('%Y-%m-%d')})"
+        pdf_tmp = hw5.generate_pdf_report(title, raw_transcript, formatted_text, hexaco_analysis)
+        if pdf_tmp:
+            pdf_path = os.path.join(out_dir, f"{stem}.pdf")
+            shutil.move(pdf_tmp, pdf_path)
+            row.update(status="ok", pdf=pdf_path)
+        else:
+            row.update(status="failed", error="PDF 報告生成失敗")
+    row["analysis_seconds"] = round(time.perf_counter() - start, 2)
+    return row
+
+
+def run_batch(inputs, out_dir: str, asr_workers: int = 1, llm_workers: int = 4):
+    os.makedirs(out_dir, exist_ok=True)
+    summary = Summary(os.path.join(out_dir, "summary.csv"))
+    todo = []
+    for path in inputs:
+        if os.path.abspath(path) in summary.done:
+            print(f"略過（已完成）：{path}")
+        elif not os.path.exists(path):
+            summary.record(file=os.path.abspath(path), status="failed", error="檔案不存在")
+        elif os.path.splitext(path)[1].lower() not in SUPPORTED_FORMATS:
+            summary.record(file=os.path.abspath(path), status="failed", error="不支援的檔案格式")
+        else:
+            todo.append(os.path.abspath(path))
+    print(f"共 {len(inputs)} 個檔案，待處理 {len(todo)} 個。")
+    if not todo:
+        return
+
+    counts = {"ok": 0, "failed": 0}
+    counts_lock = threading.Lock()
+
+    def finish(path, row):
+        summary.record(file=path, **row)
+        with counts_lock:
+            counts[row["status"]] += 1
+            print(f"[{sum(counts.values())}/{len(todo)}] {row['status']}: {path} {row.get('error') or ''}")
+
+    def analysis_done(path, seconds, future):
+        # 在分析執行緒中執行：分析一完成就寫入 summary.csv，不必等其他檔案轉錄完
+        try:
+            row = future.result()
+        except Exception as e:
+            row = {"status": "failed", "error": f"分析失敗: {e}"}
+        row["transcribe_seconds"] = round(seconds, 2) if seconds is not None else ""
+        finish(path, row)
+
+    audio_files = [p for p in todo if os.path.splitext(p)[1].lower() not in hw5.TEXT_FORMATS]
+    text_files = [p for p in todo if os.path.splitext(p)[1].lower() in hw5.TEXT_FORMATS]
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=llm_workers) as llm_pool:
+        def submit_analysis(path, text, seconds):
+            future = llm_pool.submit(analyze_and_report, path, text, out_dir)
+            future.add_done_callback(functools.partial(analysis_done, path, seconds))
+
+        for path in text_files:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+            except (UnicodeDecodeError, OSError) as e:
+                finish(path, {"status": "failed", "error": f"無法讀取文字檔: {e}"})
+                continue
+            if not text.strip():
+                finish(path, {"status": "failed", "error": "文字檔內容為空"})
+                continue
+            submit_analysis(path, text, None)
+
+        if audio_files:
+            # spawn：子行程各自載入模型，不繼承父行程的執行緒與事件迴圈
+            with ProcessPoolExecutor(max_workers=asr_workers,
+                                     mp_context=multiprocessing.get_context("spawn")) as asr_pool:
+                transcriptions = {asr_pool.submit(transcribe_file, p): p for p in audio_files}
+                for future in as_completed(transcriptions):
+                    path = transcriptions[future]
+                    try:
+                        text, error, seconds = future.result()
+                    except Exception as e:
+                        text, error, seconds = None, f"錯誤：Whisper 轉錄失敗: {e}", None
+                    if error:
+                        finish(path, {"status": "failed", "error": error, "transcribe_seconds": seconds})
+                        continue
+                    submit_analysis(path, text, seconds)
+
+    print(f"批次完成：成功 {counts['ok']}、失敗 {counts['failed']}，"
+          f"耗時 {time.perf_counter() - start:.1f} 秒。摘要：{summary.path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hw5 面試錄音批次分析")
+    parser.add_argument("source", help="錄音／逐字稿資料夾，或清單檔 (.txt / 含 path 欄位的 .csv)")
+    parser.add_argument("-o", "--out-dir", default="reports", help="報告輸出資料夾")
+    parser.add_argument("--asr-workers", type=int, default=1,
+                        help="轉錄行程數（每個行程各載入一份 Whisper 模型）")
+    parser.add_argument("--llm-workers", type=int, default=4, help="同時分析的檔案數")
+    args = parser.parse_args()
+    run_batch(collect_inputs(args.source), args.out_dir, args.asr_workers, args.llm_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+hw5 逐字稿快取
+
+以「音檔內容 SHA-256 + 轉錄後端 + 語言 + 轉錄方式 + 是否裁切靜音」為鍵保存 Whisper 轉錄結果，
+同一份錄音重新上傳（例如 Gemini 步驟失敗後重跑）即可直接跳到 Gemini 階段。
+快取目錄有容量上限，超過時依最後使用時間淘汰最舊的項目。
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_CACHE_DIR = os.getenv("HW5_TRANSCRIPT_CACHE_DIR", ".transcript_cache")
+DEFAULT_MAX_MB = float(os.getenv("HW5_TRANSCRIPT_CACHE_MB", "200"))
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """ 以固定大小區塊串流計算檔案的 SHA-256，不會把整個音檔讀進記憶體 """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(audio_sha256: str, backend: str, language: str, mode: str = "full", trim: bool = True) -> str:
+    """
+    backend 為轉錄後端的識別字串（引擎:模型[:精度]）；mode 區分整段轉錄 (full) 與分段拼接 (segmented)，
+    分段拼接在重疊處可能有誤差，不能拿來回應整段轉錄的請求；trim 為轉錄前是否裁切靜音 (HW5_TRIM_SILENCE)，
+    裁切與否的結果可能不同，也分開保存
+    """
+    trimmed = "trim" if trim else "notrim"
+    return hashlib.sha256(f"{audio_sha256}|{backend}|{language}|{mode}|{trimmed}".encode("utf-8")).hexdigest()
+
+
+class TranscriptCache:
+    """ 以 JSON 檔存放的逐字稿快取，容量超過 max_bytes 時以 LRU 方式淘汰 """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_mb: float = DEFAULT_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str):
+        """ 取得快取的逐字稿；沒有命中則回傳 None """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        try:
+            os.utime(path)  # 更新最後使用時間，供 LRU 淘汰使用
+        except OSError:
+            pass
+        return entry.get("text")
+
+    def put(self, key: str, text: str, **meta):
+        """ 寫入逐字稿（先寫暫存檔再取代，避免讀到寫一半的檔案），並視需要淘汰舊項目 """
+        entry = dict(meta, text=text, created_at=time.time())
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            # 寫入或取代失敗時不留下暫存檔（evict 只計算 .json，殘留的 .tmp 不會被清掉）
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self.evict()
+
+    def evict(self):
+        """ 總容量超過上限時，從最久未使用的項目開始刪除 """
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    print(f"逐字稿快取已滿，移除：{os.path.basename(path)}")
+                except FileNotFoundError:
+                    pass
+
+
+@contextmanager
+def staged_input(path: str):
+    """
+    讓轉錄期間使用的檔案不會被 Gradio 清除暫存：
+    優先在暫存目錄建立硬連結（不複製資料）；若跨檔案系統無法連結，則直接就地讀取原檔。
+    離開時一併刪除暫存目錄。
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="hw5_audio_")
+    staged = os.path.join(tmp_dir, os.path.basename(path))
+    try:
+        try:
+            os.link(path, staged)
+        except OSError:
+            staged = path
+        yield staged
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
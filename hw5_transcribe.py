@@ -0,0 +1,230 @@
+"""
+hw5 分段轉錄工具
+
+長錄音一次丟給 whisper_model.transcribe 只能吃一條計算路徑，且整段完成前沒有任何回饋。
+這裡把音訊依靜音點（或固定視窗）切段並保留重疊，分送到多個行程平行轉錄，
+再依原順序拼回文字、去除重疊區重複的字句，並在每段完成時即時產生部分逐字稿。
+"""
+import atexit
+import difflib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+SAMPLE_RATE = 16000  # Whisper 固定使用 16 kHz 單聲道
+
+
+# ----- 切段 -----
+
+
+def frame_energy(audio: np.ndarray, frame_ms: int = 30) -> np.ndarray:
+    """ 計算每個音框的 RMS 能量 """
+    frame_len = int(SAMPLE_RATE * frame_ms / 1000)
+    n_frames = len(audio) // frame_len
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = audio[:n_frames * frame_len].reshape(n_frames, frame_len)
+    return np.sqrt(np.mean(frames.astype(np.float32) ** 2, axis=1))
+
+
+def split_audio(audio: np.ndarray, window_s: float = 30.0, overlap_s: float = 2.0,
+                search_s: float = 5.0, mode: str = "silence", frame_ms: int = 30):
+    """
+    將音訊切成多段，回傳 [(start_sample, end_sample), ...]。
+      - mode="fixed"：每 window_s 秒切一刀
+      - mode="silence"：在每個視窗結尾前 search_s 秒內找能量最低的音框切開，
+        盡量避免把一句話切成兩半
+    相鄰兩段會重疊 overlap_s 秒，拼接時再去除重複。
+    """
+    total = len(audio)
+    window = int(window_s * SAMPLE_RATE)
+    overlap = int(overlap_s * SAMPLE_RATE)
+    if total <= window:
+        return [(0, total)]
+
+    frame_len = int(SAMPLE_RATE * frame_ms / 1000)
+    energy = frame_energy(audio, frame_ms) if mode == "silence" else None
+    search = int(search_s * SAMPLE_RATE)
+
+    segments = []
+    start = 0
+    while start < total:
+        end = start + window
+        if end >= total:
+            segments.append((start, total))
+            break
+        if energy is not None and len(energy):
+            lo = max(start + overlap + frame_len, end - search) // frame_len
+            hi = end // frame_len
+            if hi > lo:
+                end = (lo + int(np.argmin(energy[lo:hi]))) * frame_len
+        segments.append((start, end))
+        start = max(end - overlap, start + 1)
+    return segments
+
+
+# ----- 拼接 -----
+
+
+def merge_overlap(prev: str, nxt: str, max_chars: int = 80, min_match: int = 4,
+                  slack: int = 12) -> str:
+    """
+    將下一段文字接到前一段之後，並移除兩段在重疊區重複辨識出的字句。
+    在 prev 結尾與 nxt 開頭各取 max_chars 個字比對最長共同片段，
+    只有片段貼近 prev 結尾、也貼近 nxt 開頭（誤差 slack 字內）時才視為重疊。
+    """
+    if not prev:
+        return nxt
+    if not nxt:
+        return prev
+    tail = prev[-max_chars:]
+    head = nxt[:max_chars]
+    match = difflib.SequenceMatcher(None, tail, head, autojunk=False).find_longest_match(
+        0, len(tail), 0, len(head))
+    if (match.size >= min_match
+            and len(tail) - (match.a + match.size) <= slack
+            and match.b <= slack):
+        cut = len(prev) - len(tail) + match.a + match.size
+        return prev[:cut] + nxt[match.b + match.size:]
+    return prev + nxt
+
+
+def stitch(texts) -> str:
+    """ 依順序拼接所有分段文字 """
+    merged = ""
+    for text in texts:
+        merged = merge_overlap(merged, text.strip())
+    return merged
+
+
+# ----- 行程池 -----
+
+_worker_model = None
+
+
+def _init_worker(backend: str, model_name: str, compute_type: str, batch_size: int, threads: int):
+    """ 子行程初始化：每個子行程各自載入一次模型 """
+    global _worker_model
+    import hw5_asr
+    _worker_model = hw5_asr.create_backend(backend, model_name, threads, compute_type, batch_size).load()
+
+
+def _transcribe_segment(index: int, samples: np.ndarray, language: str):
+    result = _worker_model.transcribe(samples, language=language)
+    return index, result["text"]
+
+
+_pool = None
+_pool_key = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(backend, workers: int) -> ProcessPoolExecutor:
+    """
+    取得（必要時建立）共用的轉錄行程池，模型在子行程中常駐，跨請求重複使用。
+    backend 為 hw5_asr 的後端設定，子行程依同樣的引擎、模型、精度與批次大小各自載入，
+    結果與父行程的 backend.tag（逐字稿快取鍵）一致。
+    每個子行程的執行緒數沿用 backend.threads (HW5_ASR_THREADS)，未設定時平分 CPU 核心。
+    """
+    global _pool, _pool_key
+    spec = (backend.name, backend.model_name, getattr(backend, "compute_type", None),
+            getattr(backend, "batch_size", 0))
+    threads = backend.threads or max(1, (os.cpu_count() or 1) // workers)
+    with _pool_lock:
+        # 子行程初始化或載入模型失敗後行程池會永久損壞，此時重建而不是沿用
+        if _pool is not None and _pool_key == (spec, workers, threads) and not getattr(_pool, "_broken", False):
+            return _pool
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        # 使用 spawn，避免 fork 已載入 torch 的父行程
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(*spec, threads))
+        _pool_key = (spec, workers, threads)
+        return _pool
+
+
+@atexit.register
+def shutdown_pool():
+    global _pool, _pool_key
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _pool_key = None
+
+
+def default_workers() -> int:
+    """ 預設子行程數：HW5_SEGMENT_WORKERS，否則取 CPU 核心數的一半 """
+    env = os.getenv("HW5_SEGMENT_WORKERS")
+    if env:
+        return max(1, int(env))
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def transcribe_segmented(audio, backend, language: str = "zh",
+                         workers: int = None, window_s: float = 30.0,
+                         overlap_s: float = 2.0, mode: str = "silence"):
+    """
+    分段平行轉錄的產生器。
+    audio 可以是檔案路徑或 16 kHz float32 陣列。
+    每當最前面連續的分段完成時，yield (已拼接的部分逐字稿, 已完成段數, 總段數)；
+    最後一次 yield 即為完整逐字稿。
+    """
+    if isinstance(audio, str):
+        import hw5_audio
+        with hw5_audio.PreprocessedAudio(audio, trim=False) as pre:
+            audio = np.array(pre.audio)
+    workers = workers or default_workers()
+    segments = split_audio(audio, window_s=window_s, overlap_s=overlap_s, mode=mode)
+    print(f"分段轉錄：共 {len(segments)} 段，使用 {workers} 個行程")
+
+    pool = get_pool(backend, workers)
+    futures = [pool.submit(_transcribe_segment, i, np.ascontiguousarray(audio[s:e]), language)
+               for i, (s, e) in enumerate(segments)]
+
+    texts = {}
+    next_index = 0
+    merged = ""
+    try:
+        for future in as_completed(futures):
+            index, text = future.result()
+            texts[index] = text
+            # 只有前面的分段都完成時才往後拼，確保文字順序正確
+            advanced = False
+            while next_index in texts:
+                merged = merge_overlap(merged, texts.pop(next_index).strip())
+                next_index += 1
+                advanced = True
+            if advanced:
+                yield merged, next_index, len(segments)
+    finally:
+        # 某段失敗（或呼叫端提早結束）時，取消尚未開始的分段，不再占用子行程
+        for future in futures:
+            future.cancel()
+
+
+def _wait_all(barrier, timeout: float):
+    """ 佔住一個子行程直到所有子行程都載入模型並抵達柵欄 """
+    barrier.wait(timeout)
+    return os.getpid()
+
+
+def warm_pool(backend, workers: int, timeout: float = 600):
+    """
+    預先啟動行程池並讓每個子行程都載入模型。
+    ProcessPoolExecutor 只在 submit 時按需啟動子行程，送一個工作只會啟動一個；
+    因此送出 workers 個在同一柵欄等待的工作，任何一個都要等全部子行程初始化完才會結束，
+    迫使執行器啟動全部子行程。
+    """
+    pool = get_pool(backend, workers)
+    with multiprocessing.get_context("spawn").Manager() as manager:
+        barrier = manager.Barrier(workers)
+        futures = [pool.submit(_wait_all, barrier, timeout) for _ in range(workers)]
+        pids = {future.result() for future in futures}
+    print(f"分段轉錄行程池已就緒 ({len(pids)} 個行程)。")
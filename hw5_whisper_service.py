@@ -0,0 +1,317 @@
+"""
+hw5 共用轉錄服務
+
+每個匯入 hw5.py 的行程都會各自載入一份 Whisper 模型（medium 約數 GB 記憶體），
+Gradio 開多個 worker 時記憶體成倍增加，而且每個行程一次只能轉錄一個檔案。
+這裡改為獨立的轉錄服務行程：
+  - 模型只載入一次（引擎與模型大小依 HW5_ASR_* 環境變數或 --backend，見 hw5_asr.py）
+  - 以 multiprocessing.connection 在本機 socket 上收工作（authkey 驗證），UI 端只是薄客戶端
+  - 解碼與裁切靜音交給前處理執行緒池，與模型推論重疊進行
+  - 推論佇列採「短工作優先」排程並隨等待時間加權，短錄音不會被長錄音卡住，長錄音也不會一直被插隊
+  - 所有排隊中的工作共用同一份模型；推論執行緒數以 --workers 設定
+    （faster-whisper 可同時處理多個請求，openai-whisper 請維持 1）
+  - 批次：faster-whisper 以 --batch-size 啟用 BatchedInferencePipeline，每個工作內的 30 秒視窗
+    合併成批次送進模型。兩個引擎都不支援把不同檔案放進同一次呼叫，跨工作只做排程不做合併
+
+用法：
+    python hw5_whisper_service.py serve --address 127.0.0.1:6001 --backend faster-whisper:medium:int8
+    HW5_ASR_SERVICE=127.0.0.1:6001 python hw5.py          # UI 端改送工作到服務
+    python hw5_whisper_service.py stats --address 127.0.0.1:6001
+連線密鑰：設定 HW5_ASR_SERVICE_KEY 時服務與客戶端都使用它；未設定時服務啟動會產生隨機密鑰，
+寫入只有本人可讀的 HW5_ASR_SERVICE_KEY_FILE（預設 ~/.hw5_asr_service.key），同一使用者的客戶端自動讀取。
+連線以 pickle 傳遞資料，知道密鑰就能在服務中執行程式碼，因此不提供固定的預設密鑰。
+"""
+import argparse
+import itertools
+import json
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import hw5_asr
+import hw5_audio
+
+DEFAULT_ADDRESS = "127.0.0.1:6001"
+# 每等待 1 秒，排程時視為工作縮短 AGING 秒音訊
+AGING = 2.0
+
+
+class ServiceError(Exception):
+    """ 轉錄服務無法連線或回傳錯誤 """
+
+
+def parse_address(address: str = None):
+    host, _, port = (address or os.getenv("HW5_ASR_SERVICE") or DEFAULT_ADDRESS).rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def key_file() -> str:
+    return os.path.expanduser(os.getenv("HW5_ASR_SERVICE_KEY_FILE", "~/.hw5_asr_service.key"))
+
+
+def create_authkey() -> bytes:
+    """ 服務端：使用 HW5_ASR_SERVICE_KEY，否則產生隨機密鑰並寫入僅本人可讀的密鑰檔 """
+    key = os.getenv("HW5_ASR_SERVICE_KEY")
+    if key:
+        return key.encode("utf-8")
+    key = secrets.token_hex(32)
+    path = key_file()
+    if os.path.exists(path):
+        os.remove(path)  # 重新以 0600 建立，避免沿用權限較寬的舊檔
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(key)
+    print(f"已產生連線密鑰並寫入 {path}")
+    return key.encode("utf-8")
+
+
+def service_authkey() -> bytes:
+    """ 客戶端：HW5_ASR_SERVICE_KEY，否則讀取服務啟動時寫入的密鑰檔 """
+    key = os.getenv("HW5_ASR_SERVICE_KEY")
+    if key:
+        return key.encode("utf-8")
+    try:
+        with open(key_file(), encoding="utf-8") as f:
+            return f.read().strip().encode("utf-8")
+    except OSError as e:
+        raise ServiceError(f"找不到轉錄服務密鑰：請設定 HW5_ASR_SERVICE_KEY 或確認服務已啟動 ({e})") from e
+
+
+class Job:
+    def __init__(self, job_id: int, path: str, language: str):
+        self.id = job_id
+        self.path = path
+        self.language = language
+        self.submitted = time.perf_counter()
+        self.audio = None           # 交給模型的輸入（裁切後陣列或檔案路徑）
+        self.timestamps = None
+        self.seconds = 0.0          # 排程用的音訊長度
+        self.started = None
+        self.result = None
+        self.done = threading.Event()
+        self._pre = None
+
+    def priority(self, now: float, policy: str) -> float:
+        if policy == "fifo":
+            return self.submitted
+        return self.seconds - AGING * (now - self.submitted)
+
+    def finish(self, result: dict):
+        if self._pre is not None:
+            self._pre.close()
+            self._pre = None
+        self.audio = None
+        self.result = result
+        self.done.set()
+
+
+class TranscriptionService:
+    """ 持有一份模型，排程並執行轉錄工作 """
+
+    def __init__(self, backend: hw5_asr.ASRBackend, trim: bool = True, workers: int = 1,
+                 prep_workers: int = 2, policy: str = "sjf"):
+        self.backend = backend
+        self.trim = trim
+        self.workers = workers
+        self.policy = policy
+        self._prep_pool = ThreadPoolExecutor(max_workers=prep_workers, thread_name_prefix="asr-prep")
+        self._queue = []
+        self._cond = threading.Condition()
+        self._ids = itertools.count(1)
+        self._busy = 0
+        self.stats_data = {"completed": 0, "failed": 0, "audio_seconds": 0.0,
+                           "queue_seconds": 0.0, "transcribe_seconds": 0.0}
+
+    def start(self):
+        start = time.perf_counter()
+        print(f"正在載入 Whisper 模型: {self.backend.describe()}...")
+        self.backend.load()
+        print(f"模型載入完成（{time.perf_counter() - start:.1f} 秒）。")
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f"asr-worker-{i}", daemon=True).start()
+        return self
+
+    # ----- 工作流程：前處理 -> 排隊 -> 推論 -----
+
+    def submit(self, path: str, language: str = "zh") -> Job:
+        job = Job(next(self._ids), path, language)
+        self._prep_pool.submit(self._prepare, job)
+        return job
+
+    def _prepare(self, job: Job):
+        try:
+            if not os.path.exists(job.path):
+                raise FileNotFoundError(f"找不到音檔: {job.path}")
+            if self.trim:
+                job._pre = hw5_audio.PreprocessedAudio(job.path)
+                job.audio, job.timestamps = job._pre.trimmed, job._pre.timestamps
+                job.seconds = job._pre.trimmed_seconds
+            else:
+                job.audio = job.path
+                job.seconds = hw5_audio.audio_duration(job.path) or 0.0
+        except Exception as e:
+            self._fail(job, f"音訊前處理失敗: {e}")
+            return
+        with self._cond:
+            self._queue.append(job)
+            self._cond.notify()
+
+    def _next_job(self) -> Job:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            now = time.perf_counter()
+            job = min(self._queue, key=lambda j: j.priority(now, self.policy))
+            self._queue.remove(job)
+            self._busy += 1
+            return job
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            job.started = time.perf_counter()
+            try:
+                if job.timestamps is not None and len(job.audio) == 0:
+                    result = {"text": "", "segments": []}
+                else:
+                    result = self.backend.transcribe(job.audio, language=job.language)
+                segments = result["segments"]
+                if job.timestamps is not None:
+                    segments = job.timestamps.map_segments(segments)
+                elapsed = time.perf_counter() - job.started
+                queued = job.started - job.submitted
+                with self._cond:
+                    self._busy -= 1
+                    self.stats_data["completed"] += 1
+                    self.stats_data["audio_seconds"] += job.seconds
+                    self.stats_data["queue_seconds"] += queued
+                    self.stats_data["transcribe_seconds"] += elapsed
+                job.finish({"ok": True, "text": result["text"], "segments": segments,
+                            "queue_seconds": queued, "transcribe_seconds": elapsed})
+            except Exception as e:
+                with self._cond:
+                    self._busy -= 1
+                self._fail(job, f"轉錄失敗: {e}")
+
+    def _fail(self, job: Job, message: str):
+        print(f"工作 {job.id} 失敗：{message}")
+        with self._cond:
+            self.stats_data["failed"] += 1
+        job.finish({"ok": False, "error": message})
+
+    def stats(self) -> dict:
+        with self._cond:
+            data = dict(self.stats_data, queued=len(self._queue), busy=self._busy,
+                        backend=self.backend.tag, workers=self.workers, policy=self.policy)
+        completed = data["completed"] or 1
+        data["avg_queue_seconds"] = data["queue_seconds"] / completed
+        data["avg_transcribe_seconds"] = data["transcribe_seconds"] / completed
+        return data
+
+    # ----- socket 介面 -----
+
+    def _handle(self, conn):
+        try:
+            request = conn.recv()
+            op = request.get("op")
+            if op == "transcribe":
+                job = self.submit(request["path"], request.get("language", "zh"))
+                job.done.wait()
+                # 附上實際轉錄的後端，客戶端據此決定逐字稿快取鍵（服務可能換後端重啟）
+                conn.send(dict(job.result, backend=self.backend.tag, trim=self.trim))
+            elif op == "info":
+                conn.send({"ok": True, "backend": self.backend.tag, "trim": self.trim,
+                           "describe": self.backend.describe()})
+            elif op == "stats":
+                conn.send({"ok": True, **self.stats()})
+            else:
+                conn.send({"ok": False, "error": f"未知的操作: {op}"})
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def serve(self, address=None):
+        # Listener 預設 backlog=1，多個 UI worker 同時連線會被丟棄重送而卡住數秒
+        listener = Listener(parse_address(address), backlog=64, authkey=create_authkey())
+        host, port = listener.address
+        print(f"轉錄服務已啟動於 {host}:{port}（{self.backend.describe()}，{self.policy}）")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:  # 驗證失敗等，不影響其他連線
+                    print(f"拒絕連線: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+
+
+# ----- 客戶端 -----
+
+
+def request(op: str, address: str = None, timeout: float = None, **payload) -> dict:
+    """ 送出一個請求並等待回覆；timeout 為 None 時一直等到轉錄完成 """
+    try:
+        conn = Client(parse_address(address), authkey=service_authkey())
+    except (OSError, EOFError, AuthenticationError) as e:
+        raise ServiceError(f"無法連線到轉錄服務 {address or os.getenv('HW5_ASR_SERVICE')}: {e}") from e
+    try:
+        conn.send(dict(payload, op=op))
+        if timeout is not None and not conn.poll(timeout):
+            raise ServiceError(f"轉錄服務在 {timeout} 秒內沒有回應")
+        reply = conn.recv()
+    except (OSError, EOFError) as e:
+        raise ServiceError(f"轉錄服務連線中斷: {e}") from e
+    finally:
+        conn.close()
+    if not reply.get("ok"):
+        raise ServiceError(reply.get("error", "轉錄服務回傳錯誤"))
+    return reply
+
+
+def transcribe_remote(path: str, language: str = "zh", address: str = None,
+                      timeout: float = None) -> dict:
+    """ 交給轉錄服務轉錄，回傳 {"text", "segments", "queue_seconds", "transcribe_seconds", "backend", "trim"} """
+    return request("transcribe", address, timeout, path=os.path.abspath(path), language=language)
+
+
+def service_info(address: str = None) -> dict:
+    return request("info", address, timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hw5 共用轉錄服務")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="啟動服務")
+    serve.add_argument("--address", default=None, help=f"host:port（預設 HW5_ASR_SERVICE 或 {DEFAULT_ADDRESS}）")
+    serve.add_argument("--backend", default=None, help="引擎[:模型[:精度]]，預設依 HW5_ASR_* 環境變數")
+    serve.add_argument("--workers", type=int, default=int(os.getenv("HW5_ASR_SERVICE_WORKERS", "1")),
+                       help="推論執行緒數")
+    serve.add_argument("--policy", choices=["sjf", "fifo"], default="sjf", help="排程方式")
+    serve.add_argument("--batch-size", type=int, default=None,
+                       help="faster-whisper 每批解碼的視窗數（預設 HW5_ASR_BATCH_SIZE，0 為不批次）")
+    serve.add_argument("--no-trim", action="store_true", help="不裁切靜音，直接把檔案路徑交給模型")
+    stats = sub.add_parser("stats", help="查詢服務統計")
+    stats.add_argument("--address", default=None)
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        print(json.dumps(request("stats", args.address, timeout=10), ensure_ascii=False, indent=2))
+        return
+    backend = (hw5_asr.parse_spec(args.backend, args.batch_size) if args.backend
+               else hw5_asr.create_backend(batch_size=args.batch_size))
+    if args.batch_size and not isinstance(backend, hw5_asr.FasterWhisperBackend):
+        print(f"{backend.name} 不支援批次解碼，忽略 --batch-size")
+    trim = not args.no_trim and os.getenv("HW5_TRIM_SILENCE", "1") != "0"
+    service = TranscriptionService(backend, trim=trim, workers=args.workers, policy=args.policy)
+    service.start().serve(args.address)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,561 @@
+"""
+統一的 LLM 閘道
+
+原本 hw1 透過 OpenAIChatCompletionClient、hw2/hw4 透過 google.genai.Client、hw5 透過
+google.generativeai 各自呼叫 Gemini，連線、併發限制與重試策略都不共用。
+所有腳本改為經由本模組呼叫：
+  - 共用的 httpx 非同步連線池
+  - 全域與各模型的併發上限（asyncio.Semaphore）
+  - 指數退避加隨機抖動，並遵守 Retry-After / retryDelay
+  - 各模型獨立的斷路器：連續失敗達門檻即暫停送出，冷卻後放行一個試探請求
+  - 請求數、重試、狀態碼、延遲與 token 的統計
+
+同步程式（hw2、hw4、hw5）使用 generate_sync()，請求會交給一條常駐的背景事件迴圈；
+非同步程式（hw1）直接使用 get_gateway()，或把 http_client() 交給 OpenAI 相容的 client，
+結束前呼叫 close_gateway() 關閉連線池。
+
+環境變數：
+  LLM_GATEWAY_BASE_URL           API 位址，可指向 mock_gemini_server.py（預設 Google 官方端點）
+  LLM_MAX_CONCURRENCY            全域同時請求數上限（預設 8）
+  LLM_MODEL_CONCURRENCY          各模型上限，例如 "gemini-2.5-pro-exp-03-25=2,gemini-2.0-flash=6"
+  LLM_DEFAULT_MODEL_CONCURRENCY  未列出模型的上限（預設 4）
+  LLM_MAX_RETRIES                最多重試次數（預設 5）
+  LLM_TIMEOUT                    單一請求逾時秒數（預設 120）
+
+直接執行本檔會對本機模擬端點做自我檢查：
+    python llm_gateway.py
+"""
+import asyncio
+import collections
+import contextvars
+import json
+import os
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+from dotenv import load_dotenv
+
+import tracing
+
+load_dotenv()
+
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com"
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# 這些狀態代表服務端異常，計入斷路器；429 只是限流，不開啟斷路器
+BREAKER_STATUS = {500, 502, 503, 504}
+MODEL_IN_PATH = re.compile(r'/models/([^/:?]+)')
+
+
+class GatewayError(Exception):
+    """ 閘道呼叫失敗 """
+
+
+class GatewayHTTPError(GatewayError):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+class CircuitOpenError(GatewayError):
+    """ 斷路器開啟中，請求未送出 """
+
+
+def _parse_model_concurrency(value: str) -> dict:
+    limits = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        model, _, limit = item.partition("=")
+        limits[model.strip()] = int(limit)
+    return limits
+
+
+class GatewayPolicy:
+    """ 併發、重試與斷路器設定 """
+
+    def __init__(self, max_concurrency=None, model_concurrency=None, default_model_concurrency=None,
+                 max_retries=None, base_delay=1.0, max_delay=30.0, timeout=None,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.model_concurrency = (model_concurrency if model_concurrency is not None else
+                                  _parse_model_concurrency(os.getenv("LLM_MODEL_CONCURRENCY", "")))
+        self.default_model_concurrency = (default_model_concurrency or
+                                          int(os.getenv("LLM_DEFAULT_MODEL_CONCURRENCY", "4")))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", "5"))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT", "120"))
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def backoff(self, attempt: int, retry_after=None) -> float:
+        """ 指數退避加完全隨機抖動；伺服器有指定 Retry-After 時至少等那麼久 """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class CircuitBreaker:
+    """
+    closed -> (連續失敗達門檻) open -> (冷卻結束) half_open -> 試探成功 closed / 失敗 open。
+    試探請求不論結果為何（含 429、被取消或逾時）都必須以 release() 歸還，否則會一直停在 half_open。
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """ 回傳 "closed"（一般放行）、"probe"（半開狀態的試探請求）或 None（拒絕） """
+        with self._lock:
+            if self.state == "closed":
+                return "closed"
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return "probe"
+            return None
+
+    def allow(self) -> bool:
+        return self.admit() is not None
+
+    def release(self, ticket):
+        """ 歸還試探名額但不改變狀態（429、被取消等無法判斷服務好壞的結果），下一個請求可再試探 """
+        if ticket != "probe":
+            return
+        with self._lock:
+            if self.state == "half_open":
+                self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"斷路器開啟：連續失敗 {self.failures} 次")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+class GatewayMetrics:
+    """ 各模型的請求統計（跨執行緒、跨事件迴圈共用） """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, model: str) -> dict:
+        if model not in self._models:
+            self._models[model] = {
+                "requests": 0, "attempts": 0, "successes": 0, "failures": 0, "retries": 0,
+                "rejected": 0, "status": collections.Counter(),
+                "prompt_tokens": 0, "output_tokens": 0,
+                "latencies": collections.deque(maxlen=self.window)}
+        return self._models[model]
+
+    def incr(self, model: str, field: str, amount: int = 1):
+        with self._lock:
+            self._model(model)[field] += amount
+
+    def record_status(self, model: str, status):
+        with self._lock:
+            self._model(model)["status"][str(status)] += 1
+
+    def record_latency(self, model: str, seconds: float):
+        with self._lock:
+            self._model(model)["latencies"].append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            result = {}
+            for model, m in self._models.items():
+                latencies = sorted(m["latencies"])
+                pick = (lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+                        if latencies else None)
+                result[model] = {key: (dict(value) if isinstance(value, collections.Counter) else value)
+                                 for key, value in m.items() if key != "latencies"}
+                result[model].update({"latency_p50": pick(0.50), "latency_p95": pick(0.95),
+                                      "latency_max": latencies[-1] if latencies else None})
+            return result
+
+    def report(self) -> str:
+        lines = ["LLM 閘道統計："]
+        for model, m in self.snapshot().items():
+            p50 = f"{m['latency_p50']:.2f}s" if m["latency_p50"] is not None else "-"
+            p95 = f"{m['latency_p95']:.2f}s" if m["latency_p95"] is not None else "-"
+            lines.append(
+                f"  {model}: 請求 {m['requests']}、成功 {m['successes']}、失敗 {m['failures']}、"
+                f"重試 {m['retries']}、斷路拒絕 {m['rejected']}、p50 {p50}、p95 {p95}、"
+                f"tokens {m['prompt_tokens']}/{m['output_tokens']}、狀態 {m['status']}")
+        return "\n".join(lines)
+
+
+# 斷路器與統計在整個行程共用
+metrics = GatewayMetrics()
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(model: str, policy: GatewayPolicy) -> CircuitBreaker:
+    with _breakers_lock:
+        if model not in _breakers:
+            _breakers[model] = CircuitBreaker(policy.failure_threshold, policy.reset_timeout)
+        return _breakers[model]
+
+
+def _retry_after_seconds(response: httpx.Response):
+    """ 解析 Retry-After 標頭（秒數或 HTTP 日期），或 Gemini 錯誤內容中的 retryDelay """
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    try:
+        for detail in response.json().get("error", {}).get("details", []):
+            delay = detail.get("retryDelay")
+            if delay and delay.endswith("s"):
+                return float(delay[:-1])
+    except (ValueError, AttributeError):
+        pass
+    return None
+
+
+def _model_of(request: httpx.Request) -> str:
+    match = MODEL_IN_PATH.search(request.url.path)
+    if match:
+        return match.group(1)
+    try:
+        model = json.loads(request.content or b"{}").get("model") or "unknown"
+        return model[len("models/"):] if model.startswith("models/") else model
+    except ValueError:
+        return "unknown"
+
+
+class GatewayTransport(httpx.AsyncBaseTransport):
+    """
+    包在連線池外層的 transport：併發限制、重試、斷路器與統計都在這裡處理，
+    因此不論是 generateContent 還是 OpenAI 相容介面，只要走這個 transport 就套用同一套策略。
+    """
+
+    def __init__(self, policy: GatewayPolicy):
+        self.policy = policy
+        self._pool = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=policy.max_concurrency * 2,
+                                max_keepalive_connections=policy.max_concurrency),
+            retries=0)
+        self._global = asyncio.Semaphore(policy.max_concurrency)
+        self._per_model = {}
+
+    def _model_semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self._per_model:
+            limit = self.policy.model_concurrency.get(model, self.policy.default_model_concurrency)
+            self._per_model[model] = asyncio.Semaphore(limit)
+        return self._per_model[model]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()  # 讀入內容，重試時才能重送
+        model = _model_of(request)
+        breaker = get_breaker(model, self.policy)
+        metrics.incr(model, "requests")
+        start = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                # 只在送出期間占用併發名額，退避等待時先歸還，受限流的模型不會卡住其他模型
+                async with self._global, self._model_semaphore(model):
+                    ticket = breaker.admit()
+                    if ticket is None:
+                        # 重試途中斷路器才開啟的，算作失敗；一開始就被擋下的才算拒絕
+                        metrics.incr(model, "failures" if attempt else "rejected")
+                        raise CircuitOpenError(f"{model} 的斷路器開啟中，暫停送出請求")
+                    metrics.incr(model, "attempts")
+                    try:
+                        try:
+                            response = await self._pool.handle_async_request(request)
+                        except httpx.TransportError as e:
+                            breaker.record_failure()
+                            metrics.record_status(model, type(e).__name__)
+                            if attempt >= self.policy.max_retries:
+                                metrics.incr(model, "failures")
+                                raise
+                            retry_after = None
+                        else:
+                            metrics.record_status(model, response.status_code)
+                            # 5xx 計入斷路器；其餘狀態碼代表服務有回應：4xx 視為成功，429 只是限流、不影響狀態
+                            if response.status_code in BREAKER_STATUS:
+                                breaker.record_failure()
+                            elif response.status_code != 429:
+                                breaker.record_success()
+                            if response.status_code not in RETRYABLE_STATUS:
+                                metrics.incr(model, "successes" if response.status_code < 400 else "failures")
+                                return response
+                            await response.aread()
+                            if attempt >= self.policy.max_retries:
+                                metrics.incr(model, "failures")
+                                return response
+                            retry_after = _retry_after_seconds(response)
+                            await response.aclose()
+                    finally:
+                        # 429、取消與逾時都不會呼叫 record_*，在這裡歸還試探名額
+                        breaker.release(ticket)
+                delay = self.policy.backoff(attempt, retry_after)
+                attempt += 1
+                metrics.incr(model, "retries")
+                print(f"LLM 請求失敗，{delay:.1f} 秒後重試 (第 {attempt} 次)：{model}")
+                await asyncio.sleep(delay)
+        finally:
+            metrics.record_latency(model, time.perf_counter() - start)
+
+    async def aclose(self):
+        await self._pool.aclose()
+
+
+class GatewayResponse:
+    def __init__(self, text: str, model: str, usage: dict, raw: dict):
+        self.text = text
+        self.model = model
+        self.usage = usage
+        self.raw = raw
+
+
+class LLMGateway:
+    """ 綁定在單一事件迴圈上的閘道（semaphore 與連線池不能跨迴圈使用） """
+
+    def __init__(self, api_key: str = None, base_url: str = None, policy: GatewayPolicy = None):
+        self.api_key = api_key or os.getenv("GEMINI_API_KEY", "")
+        self.base_url = (base_url or os.getenv("LLM_GATEWAY_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+        self.policy = policy or GatewayPolicy()
+        self.transport = GatewayTransport(self.policy)
+        self.client = self.http_client(base_url=self.base_url,
+                                       headers={"x-goog-api-key": self.api_key})
+
+    @property
+    def openai_base_url(self) -> str:
+        """ Gemini 的 OpenAI 相容端點 """
+        return f"{self.base_url}/v1beta/openai/"
+
+    def http_client(self, **kwargs) -> httpx.AsyncClient:
+        """ 回傳走閘道 transport 的 httpx client，可交給 OpenAI 相容的 SDK 使用 """
+        kwargs.setdefault("timeout", self.policy.timeout)
+        return httpx.AsyncClient(transport=self.transport, **kwargs)
+
+    async def _post(self, path: str, payload: dict) -> dict:
+        response = await self.client.post(path, json=payload)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("error", {}).get("message", response.text)
+            except ValueError:
+                message = response.text
+            raise GatewayHTTPError(response.status_code, message)
+        return response.json()
+
+    async def generate(self, model: str, prompt: str = None, *, contents=None,
+                       system_instruction: str = None, cached_content: str = None,
+                       generation_config: dict = None) -> GatewayResponse:
+        """ 呼叫 generateContent；prompt 為單一文字，contents 則可直接給 Gemini 格式的對話內容 """
+        payload = {"contents": contents or [{"role": "user", "parts": [{"text": prompt or ""}]}]}
+        if system_instruction:
+            payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+        if cached_content:
+            payload["cachedContent"] = cached_content
+        if generation_config:
+            payload["generationConfig"] = generation_config
+        prompt_chars = sum(len(part.get("text", "")) for content in payload["contents"]
+                           for part in content.get("parts", []))
+        with tracing.span("llm_call", model=model, prompt_chars=prompt_chars,
+                          cached=bool(cached_content)) as span:
+            data = await self._post(f"/v1beta/models/{model}:generateContent", payload)
+
+            candidates = data.get("candidates") or []
+            if not candidates:
+                raise GatewayError(f"模型沒有回傳內容：{data.get('promptFeedback', data)}")
+            parts = candidates[0].get("content", {}).get("parts", [])
+            text = "".join(part.get("text", "") for part in parts)
+            usage = data.get("usageMetadata", {})
+            span.set(prompt_tokens=usage.get("promptTokenCount", 0),
+                     output_tokens=usage.get("candidatesTokenCount", 0),
+                     cached_tokens=usage.get("cachedContentTokenCount", 0), output_chars=len(text))
+        metrics.incr(model, "prompt_tokens", usage.get("promptTokenCount", 0))
+        metrics.incr(model, "output_tokens", usage.get("candidatesTokenCount", 0))
+        return GatewayResponse(text, model, usage, data)
+
+    async def create_cached_content(self, model: str, system_instruction: str, ttl: int) -> str:
+        """ 建立供應商端 context cache，回傳快取名稱 """
+        with tracing.span("llm_cache_create", model=model, chars=len(system_instruction)):
+            data = await self._post("/v1beta/cachedContents", {
+                "model": model if model.startswith("models/") else f"models/{model}",
+                "systemInstruction": {"parts": [{"text": system_instruction}]},
+                "ttl": f"{ttl}s"})
+        return data["name"]
+
+    async def aclose(self):
+        await self.client.aclose()
+        await self.transport.aclose()
+
+
+# ----- 取得閘道 -----
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    """ 取得目前事件迴圈的閘道（必須在事件迴圈中呼叫） """
+    loop = asyncio.get_running_loop()
+    with _gateways_lock:
+        # 已關閉的迴圈（例如 asyncio.run() 結束後）不會再用到它的閘道，移除以釋放連線池
+        for closed in [other for other in _gateways if other.is_closed()]:
+            del _gateways[closed]
+        if loop not in _gateways:
+            _gateways[loop] = LLMGateway()
+        return _gateways[loop]
+
+
+async def close_gateway():
+    """ 關閉並移除目前事件迴圈的閘道；以 asyncio.run() 執行的程式應在結束前呼叫 """
+    loop = asyncio.get_running_loop()
+    with _gateways_lock:
+        gateway = _gateways.pop(loop, None)
+    if gateway is not None:
+        await gateway.aclose()
+
+
+class _BackgroundLoop:
+    """ 給同步程式使用的常駐事件迴圈，所有同步呼叫共用同一個閘道與連線池 """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="llm-gateway", daemon=True)
+        self.thread.start()
+
+    def run(self, coro_factory):
+        # 背景迴圈的工作不會繼承呼叫端的 contextvars（例如 tracing 的目前請求），這裡手動帶過去
+        context = contextvars.copy_context()
+
+        async def runner():
+            for var, value in context.items():
+                var.set(value)
+            return await coro_factory(get_gateway())
+        return asyncio.run_coroutine_threadsafe(runner(), self.loop).result()
+
+
+_background = None
+_background_lock = threading.Lock()
+
+
+def _background_loop() -> _BackgroundLoop:
+    global _background
+    with _background_lock:
+        if _background is None:
+            _background = _BackgroundLoop()
+        return _background
+
+
+def generate_sync(model: str, prompt: str = None, **kwargs) -> GatewayResponse:
+    """ 同步版 generate，可在任意執行緒呼叫 """
+    return _background_loop().run(lambda gateway: gateway.generate(model, prompt, **kwargs))
+
+
+def create_cached_content_sync(model: str, system_instruction: str, ttl: int) -> str:
+    return _background_loop().run(
+        lambda gateway: gateway.create_cached_content(model, system_instruction, ttl))
+
+
+def report() -> str:
+    return metrics.report()
+
+
+# ----- 自我檢查 -----
+
+
+def _self_check():
+    from mock_gemini_server import MockGeminiServer
+
+    server = MockGeminiServer(latency=0.05).start()
+    policy = GatewayPolicy(max_concurrency=8, model_concurrency={"slow-model": 2},
+                           max_retries=3, base_delay=0.05, max_delay=0.2,
+                           failure_threshold=3, reset_timeout=0.5)
+
+    async def check():
+        gateway = LLMGateway(api_key="test", base_url=server.base_url, policy=policy)
+
+        # 503 兩次後成功（統計為整個行程共用，比較前後差值）
+        retries_before = metrics.snapshot().get("flash-model", {}).get("retries", 0)
+        server.fail_next(2, status=503)
+        response = await gateway.generate("flash-model", "你好")
+        assert response.text == "mock:flash-model:2", response.text
+        assert metrics.snapshot()["flash-model"]["retries"] - retries_before == 2
+
+        # 429 附 Retry-After，應至少等待該秒數
+        server.fail_next(1, status=429, retry_after=1)
+        start = time.perf_counter()
+        await gateway.generate("flash-model", "再一次")
+        assert time.perf_counter() - start >= 1.0
+
+        # 各模型併發上限
+        server.reset()
+        await asyncio.gather(*(gateway.generate("slow-model", str(i)) for i in range(6)))
+        assert server.max_in_flight <= 2, server.max_in_flight
+
+        # 連續 5xx 後斷路器開啟，冷卻後試探成功即恢復
+        server.fail_next(100, status=500)
+        try:
+            await gateway.generate("broken-model", "x")
+        except GatewayError:
+            pass
+        try:
+            await gateway.generate("broken-model", "x")
+            raise AssertionError("斷路器應該開啟")
+        except CircuitOpenError:
+            pass
+        server.reset()
+        await asyncio.sleep(0.6)
+        await gateway.generate("broken-model", "x")
+
+        # 半開狀態的試探請求收到 4xx：服務有回應，斷路器應關閉而非卡在 half_open
+        breaker = get_breaker("broken-model", policy)
+        breaker.state, breaker.opened_at = "open", 0.0
+        server.fail_next(1, status=400)
+        try:
+            await gateway.generate("broken-model", "x")
+        except GatewayError:
+            pass
+        assert breaker.state == "closed", breaker.state
+        await gateway.generate("broken-model", "x")
+
+        # 快取內容
+        name = await gateway.create_cached_content("flash-model", "固定前綴", 60)
+        response = await gateway.generate("flash-model", "後綴", cached_content=name)
+        assert response.text == f"mock:flash-model:{len('固定前綴後綴')}"
+        await gateway.aclose()
+
+    asyncio.run(check())
+    server.stop()
+    print(report())
+    print("自我檢查通過。")
+
+
+if __name__ == "__main__":
+    _self_check()
@@ -0,0 +1,421 @@
+"""
+hw4 / hw5 Gradio 應用的並行使用者負載測試
+
+不知道十位分析人員同時使用 hw4（CSV 報表）與 hw5（訪談分析）時會發生什麼事。這裡在本機：
+  - 啟動 mock_gemini_server.py 作為 Gemini 端點（可設定回應延遲）
+  - 以子行程啟動 hw4.py / hw5.py，hw5 使用 stub 轉錄後端（HW5_ASR_BACKEND=stub，
+    耗時 = 音訊長度 × HW5_ASR_STUB_RTF），不需要 Whisper
+  - N 個模擬使用者各自以 gradio_client 連線，輪流上傳具代表性的 CSV、逐字稿與錄音
+    （錄音每次內容不同，避免逐字稿快取命中）
+並回報每個應用的端到端延遲 p50 / p95 / p99、錯誤率、吞吐量與應用行程（含子行程）的記憶體高峰。
+
+結果可存成基準線，之後的執行與基準線比較，延遲或記憶體超出容許範圍、錯誤率上升即視為退步（結束碼 1）：
+    python loadtest.py --users 10 --requests 3 --save-baseline
+    python loadtest.py --users 10 --requests 3 --compare loadtest_baseline.json
+基準線記錄處理流程版本 (PIPELINE_VERSION 與模型路由層級) 與主機規格；兩者與本次執行不同時數字不可比，
+不做比較並以結束碼 2 結束（--force 仍強制比較）。改變 LLM 請求組成的修改須調高 PIPELINE_VERSION 並重錄基準線。
+
+非 Windows 環境沒有標楷體時，以 --font 或環境變數 CHINESE_FONT_PATH 指定任一 TTF 字型，
+否則 PDF 步驟會失敗並計為錯誤。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import wave
+from datetime import datetime
+
+import numpy as np
+
+import model_router
+from mock_gemini_server import MockGeminiServer
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = "loadtest_baseline.json"
+# 處理流程版本：2 = hw4 / hw5 改由 model_router 便宜模型先做、必要時升級
+PIPELINE_VERSION = 2
+APPS = {
+    "hw4": {"script": "hw4.py", "api_name": "/gradio_handler"},
+    "hw5": {"script": "hw5.py", "api_name": "/process_input_and_analyze"},
+}
+# 與基準線比較時的容許範圍
+LATENCY_TOLERANCE = 0.25   # 延遲（p50 / p95 / p99）最多慢 25%
+MEMORY_TOLERANCE = 0.20    # 記憶體高峰最多多 20%
+ERROR_RATE_TOLERANCE = 0.01
+
+
+def make_tone(path: str, seconds: float, freq: float, sample_rate: int = 16000):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    audio = 0.3 * np.sin(2 * np.pi * freq * t)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((audio * 32767).astype(np.int16).tobytes())
+
+
+def make_transcript(path: str, turns: int = 40):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(turns):
+            f.write(f"面試官：請談談你在第 {i + 1} 個專案中遇到的困難，以及你如何與團隊溝通解決？\n")
+            f.write("受訪者：當時時程很緊，我先和成員確認每個人的負擔，再和主管討論調整優先順序，"
+                    "最後大家都願意加班把關鍵功能完成，我也學到要更早提出風險。\n")
+
+
+MOCK_TRAITS = "\n".join(f"【{trait}】\n評分：4\n理由：受訪者描述與團隊溝通並主動提出風險。"
+                        for trait in ("誠實-謙遜", "情緒性", "外向性", "親和性", "盡責性", "開放性"))
+
+
+def mock_reply(model: str, prompt: str) -> str:
+    """ 依提示詞回傳格式正確的模擬結果，讓 model_router 的檢查通過、不因假回覆而升級模型 """
+    if "CSV資料" in prompt:
+        return "| 時間 | 分類 | 說明 |\n|------|------|------|\n| 00:00 | 備註 | 模擬分析 |\n\n信心：0.9"
+    if "問題[編號]" in prompt:
+        return "問題1: 請談談你遇到的困難？\n回答1: 當時時程很緊，我先確認每個人的負擔。"
+    if "【特質中文名稱】" in prompt:
+        return MOCK_TRAITS
+    return MOCK_TRAITS + "\n\n信心：0.9"
+
+
+class Workload:
+    """ 每個應用的輸入檔輪替：hw4 為 CSV，hw5 為逐字稿與長短錄音 """
+
+    def __init__(self, work_dir: str, audio_seconds, hw4_prompt: str = ""):
+        self.work_dir = work_dir
+        self.audio_seconds = audio_seconds
+        self.hw4_prompt = hw4_prompt
+        self.csv_files = [os.path.join(ROOT, name) for name in ("data.csv", "task.csv")
+                          if os.path.exists(os.path.join(ROOT, name))]
+        self.transcript = os.path.join(work_dir, "interview.txt")
+        make_transcript(self.transcript)
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def next_index(self) -> int:
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def inputs(self, app: str, user: int, index: int):
+        """ 回傳 (輸入描述, 上傳檔案路徑, 其餘參數) """
+        if app == "hw4":
+            path = self.csv_files[(user + index) % len(self.csv_files)]
+            return os.path.basename(path), path, [self.hw4_prompt]
+        kinds = ["text"] + [f"audio{s:g}s" for s in self.audio_seconds]
+        kind = kinds[(user + index) % len(kinds)]
+        if kind == "text":
+            return kind, self.transcript, []
+        seconds = self.audio_seconds[kinds.index(kind) - 1]
+        request_id = self.next_index()
+        path = os.path.join(self.work_dir, f"u{user}_r{index}_{request_id}.wav")
+        # 每個請求的音高不同 → 檔案雜湊不同，不會命中逐字稿快取
+        make_tone(path, seconds, 200 + request_id)
+        return kind, path, []
+
+
+def result_error(app: str, result) -> str:
+    """ 從應用的輸出判斷是否失敗，回傳錯誤說明或 None """
+    texts = [r for r in result if isinstance(r, str)]
+    for text in texts:
+        if text.startswith("錯誤") or "失敗" in text[:40]:
+            return text.splitlines()[0][:120]
+    if result[-1] is None:
+        return "沒有產生 PDF"
+    return None
+
+
+class MemoryMonitor:
+    """ 定期加總應用行程與所有子行程的 RSS，記錄高峰 """
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        import psutil
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.peak = 0
+        self.baseline = self.sample()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def sample(self) -> int:
+        import psutil
+        total = 0
+        try:
+            for process in [self.process] + self.process.children(recursive=True):
+                try:
+                    total += process.memory_info().rss
+                except psutil.Error:
+                    pass
+        except psutil.Error:
+            pass
+        self.peak = max(self.peak, total)
+        return total
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.peak
+
+
+def start_app(app: str, port: int, env: dict, work_dir: str, log_path: str):
+    """ 以子行程啟動應用並等到 HTTP 可連線，回傳 (Popen, 網址) """
+    url = f"http://127.0.0.1:{port}/"
+    log = open(log_path, "w", encoding="utf-8")
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, APPS[app]["script"])],
+                            cwd=work_dir, env=dict(env, GRADIO_SERVER_PORT=str(port)),
+                            stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{app} 啟動失敗，請查看 {log_path}")
+        try:
+            urllib.request.urlopen(url, timeout=2).close()
+            return proc, url
+        except OSError:
+            time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError(f"等待 {app} 啟動逾時，請查看 {log_path}")
+
+
+def stop_app(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def run_users(app: str, url: str, workload: Workload, users: int, requests: int, timeout: float):
+    """ users 個使用者同時開始，各自依序送出 requests 個請求，回傳 (每筆紀錄, 總耗時) """
+    from gradio_client import Client, handle_file
+
+    records = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(users)
+
+    def user(index):
+        client = Client(url, verbose=False)
+        start_barrier.wait()
+        for r in range(requests):
+            kind, path, extra = workload.inputs(app, index, r)
+            args = [handle_file(path)] + extra
+            started = time.perf_counter()
+            try:
+                result = client.submit(*args, api_name=APPS[app]["api_name"]).result(timeout=timeout)
+                error = result_error(app, result)
+            except Exception as e:
+                error = f"{type(e).__name__}: {str(e).splitlines()[0][:120] if str(e) else ''}"
+            record = {"user": index, "input": kind, "seconds": time.perf_counter() - started, "error": error}
+            with lock:
+                records.append(record)
+            status = f"失敗：{error}" if error else "完成"
+            print(f"  [{app}] 使用者 {index} 第 {r + 1} 個請求（{kind}）{status}，{record['seconds']:.2f} 秒")
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records, time.perf_counter() - started
+
+
+def summarize(records, wall: float, peak_rss: int, idle_rss: int) -> dict:
+    latencies = [r["seconds"] for r in records]
+    errors = [r for r in records if r["error"]]
+    by_input = {}
+    for r in records:
+        by_input.setdefault(r["input"], []).append(r["seconds"])
+    return {
+        "requests": len(records),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(records), 4) if records else 0.0,
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "p99": round(percentile(latencies, 99), 3),
+        "max": round(max(latencies, default=0.0), 3),
+        "throughput_rpm": round(len(records) / wall * 60, 2) if wall else 0.0,
+        "wall_seconds": round(wall, 2),
+        "idle_rss_mb": round(idle_rss / 2 ** 20, 1),
+        "peak_rss_mb": round(peak_rss / 2 ** 20, 1),
+        "p50_by_input": {kind: round(percentile(values, 50), 3) for kind, values in sorted(by_input.items())},
+        "sample_errors": sorted({r["error"] for r in errors})[:5],
+    }
+
+
+def print_summary(app: str, stats: dict):
+    print(f"\n== {app}：{stats['requests']} 個請求，錯誤 {stats['errors']}（{stats['error_rate'] * 100:.1f}%）")
+    print(f"   延遲 p50 {stats['p50']:.2f} 秒 / p95 {stats['p95']:.2f} 秒 / p99 {stats['p99']:.2f} 秒"
+          f"（最長 {stats['max']:.2f} 秒），吞吐量 {stats['throughput_rpm']:.1f} 請求/分鐘")
+    print(f"   Gemini 請求 {stats['llm_requests']} 次，最多同時 {stats['llm_max_in_flight']} 個")
+    print(f"   記憶體：閒置 {stats['idle_rss_mb']:.0f} MB，高峰 {stats['peak_rss_mb']:.0f} MB")
+    print("   各輸入 p50：" + "、".join(f"{k} {v:.2f} 秒" for k, v in stats["p50_by_input"].items()))
+    for error in stats["sample_errors"]:
+        print(f"   錯誤範例：{error}")
+
+
+def pipeline_info() -> dict:
+    """ 影響 LLM 請求組成的設定 """
+    tiers = model_router.DEFAULT_TIERS if model_router.CASCADE else model_router.DEFAULT_TIERS[-1:]
+    return {"version": PIPELINE_VERSION, "router_tiers": list(tiers)}
+
+
+def host_info() -> dict:
+    return {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def comparable(results: dict, baseline: dict):
+    """ 回傳基準線與本次執行不可比的原因列表（處理流程或主機不同） """
+    reasons = []
+    if baseline.get("pipeline") != results["pipeline"]:
+        reasons.append(f"處理流程 {baseline.get('pipeline')} → {results['pipeline']}")
+    base_host = baseline.get("host", {})
+    for key in ("machine", "cpus"):
+        if base_host.get(key) != results["host"][key]:
+            reasons.append(f"主機 {key} {base_host.get(key)} → {results['host'][key]}")
+    return reasons
+
+
+def compare(results: dict, baseline: dict, latency_tolerance: float = LATENCY_TOLERANCE):
+    """ 與基準線比較，回傳退步項目的說明列表 """
+    regressions = []
+    if baseline.get("config") != results.get("config"):
+        print("注意：本次設定與基準線不同，比較結果僅供參考")
+    for app, stats in results["apps"].items():
+        base = baseline.get("apps", {}).get(app)
+        if not base:
+            print(f"基準線中沒有 {app}，略過比較")
+            continue
+        for key in ("p50", "p95", "p99"):
+            if stats[key] > base[key] * (1 + latency_tolerance):
+                regressions.append(f"{app} {key} {base[key]:.2f} → {stats[key]:.2f} 秒")
+        if stats["error_rate"] > base["error_rate"] + ERROR_RATE_TOLERANCE:
+            regressions.append(f"{app} 錯誤率 {base['error_rate'] * 100:.1f}% → {stats['error_rate'] * 100:.1f}%")
+        if stats["peak_rss_mb"] > base["peak_rss_mb"] * (1 + MEMORY_TOLERANCE):
+            regressions.append(f"{app} 記憶體高峰 {base['peak_rss_mb']:.0f} → {stats['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hw4 / hw5 Gradio 應用的並行使用者負載測試")
+    parser.add_argument("--apps", nargs="+", choices=sorted(APPS), default=sorted(APPS))
+    parser.add_argument("--users", type=int, default=10, help="同時使用的模擬使用者數")
+    parser.add_argument("--requests", type=int, default=3, help="每位使用者依序送出的請求數")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="模擬 Gemini 每次回應的延遲（秒）")
+    parser.add_argument("--stub-rtf", type=float, default=0.05, help="stub 轉錄後端的 RTF")
+    parser.add_argument("--audio-seconds", type=float, nargs="+", default=[30.0, 120.0],
+                        help="hw5 測試錄音的長度（秒）")
+    parser.add_argument("--concurrency-limit", type=int,
+                        help="Gradio 每個事件同時處理的請求數（GRADIO_DEFAULT_CONCURRENCY_LIMIT，預設 1）")
+    parser.add_argument("--font", default=os.getenv("CHINESE_FONT_PATH"), help="PDF 使用的 TTF 字型")
+    parser.add_argument("--timeout", type=float, default=600, help="單一請求逾時秒數")
+    parser.add_argument("--port", type=int, default=7870, help="應用使用的埠號（依序遞增）")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="把結果存成基準線")
+    parser.add_argument("--compare", help="與基準線 JSON 比較，退步時結束碼為 1")
+    parser.add_argument("--tolerance", type=float, default=LATENCY_TOLERANCE, help="延遲容許的相對增加")
+    parser.add_argument("--force", action="store_true", help="處理流程或主機與基準線不同時仍強制比較")
+    parser.add_argument("--keep", action="store_true", help="保留工作資料夾（應用日誌、產生的報告）")
+    args = parser.parse_args()
+
+    if args.compare:
+        # 處理流程與主機在執行前就已知道，不可比時不必跑完整個負載測試
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        mismatches = comparable({"pipeline": pipeline_info(), "host": host_info()}, baseline)
+        if mismatches:
+            print(f"基準線 {args.compare} 與本次執行不可比：" + "；".join(mismatches))
+            if not args.force:
+                print("請在目前的處理流程與主機上重錄基準線（--save-baseline），或以 --force 強制比較")
+                sys.exit(2)
+
+    if not args.font:
+        print("警告：未指定 --font / CHINESE_FONT_PATH，非 Windows 環境的 PDF 步驟會失敗並計為錯誤")
+    work_dir = tempfile.mkdtemp(prefix="loadtest_")
+    mock = MockGeminiServer(responder=mock_reply, latency=args.llm_latency).start()
+    env = dict(os.environ,
+               LLM_GATEWAY_BASE_URL=mock.base_url,
+               GEMINI_API_KEY="loadtest",
+               HW5_ASR_BACKEND="stub",
+               HW5_ASR_STUB_RTF=str(args.stub_rtf),
+               HW5_WHISPER_WARMUP="0",
+               HW5_TRIM_SILENCE="0",  # 測試錄音為純音，不需 ffmpeg 解碼與裁切
+               HW5_TRANSCRIPT_CACHE_DIR=os.path.join(work_dir, "transcript_cache"),
+               GRADIO_ANALYTICS_ENABLED="False",
+               PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    env.pop("HW5_ASR_SERVICE", None)
+    env.pop("TRACE", None)
+    env.pop("TRACE_PROFILE", None)
+    if args.font:
+        env["CHINESE_FONT_PATH"] = os.path.abspath(args.font)
+    if args.concurrency_limit:
+        env["GRADIO_DEFAULT_CONCURRENCY_LIMIT"] = str(args.concurrency_limit)
+
+    config = {"users": args.users, "requests": args.requests, "llm_latency": args.llm_latency,
+              "stub_rtf": args.stub_rtf, "audio_seconds": args.audio_seconds,
+              "concurrency_limit": args.concurrency_limit or 1}
+    results = {"created": datetime.now().isoformat(timespec="seconds"), "config": config,
+               "pipeline": pipeline_info(), "host": host_info(), "apps": {}}
+    hw4_prompt = ""
+    if "hw4" in args.apps:
+        from hw4 import default_prompt as hw4_prompt  # hw4 的預設分析指令
+    workload = Workload(work_dir, args.audio_seconds, hw4_prompt)
+    print(f"模擬 Gemini {mock.base_url}（延遲 {args.llm_latency} 秒），{args.users} 位使用者 × "
+          f"{args.requests} 個請求，工作資料夾 {work_dir}")
+    try:
+        for offset, app in enumerate(args.apps):
+            proc, url = start_app(app, args.port + offset, env, work_dir,
+                                  os.path.join(work_dir, f"{app}.log"))
+            try:
+                monitor = MemoryMonitor(proc.pid)
+                idle_rss = monitor.baseline
+                print(f"\n{app} 已啟動於 {url}（閒置記憶體 {idle_rss / 2 ** 20:.0f} MB）")
+                mock.reset()
+                records, wall = run_users(app, url, workload, args.users, args.requests, args.timeout)
+                peak = monitor.stop()
+            finally:
+                stop_app(proc)
+            stats = summarize(records, wall, peak, idle_rss)
+            stats["llm_requests"] = sum(mock.requests.values())
+            stats["llm_max_in_flight"] = mock.max_in_flight
+            results["apps"][app] = stats
+            print_summary(app, stats)
+    finally:
+        mock.stop()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n已存成基準線：{args.save_baseline}")
+    if args.compare:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n與基準線相比退步：")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"\n與基準線 {args.compare} 相比沒有退步")
+
+
+if __name__ == "__main__":
+    main()
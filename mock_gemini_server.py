@@ -0,0 +1,190 @@
+"""
+本機 Gemini 模擬端點
+
+模擬 Gemini REST API 中本專案用到的部分，讓 llm_gateway 與各作業可以在不連網、不花費額度的情況下測試：
+  - POST /v1beta/models/{model}:generateContent
+  - POST /v1beta/cachedContents
+  - POST /v1beta/openai/chat/completions   (hw1 使用的 OpenAI 相容介面)
+
+可注入錯誤 (fail_next) 與延遲 (latency)，並記錄每個模型的請求數與最大同時連線數。
+
+用法：
+    python mock_gemini_server.py --port 8765
+    LLM_GATEWAY_BASE_URL=http://127.0.0.1:8765 python hw2.py data.csv
+"""
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GENERATE_PATH = re.compile(r'^/v1beta/models/([^/:]+):generateContent')
+
+
+def default_responder(model: str, prompt: str) -> str:
+    return f"mock:{model}:{len(prompt)}"
+
+
+class MockGeminiServer:
+    """ 在背景執行緒啟動的模擬伺服器 """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, responder=None, latency: float = 0.0):
+        self.responder = responder or default_responder
+        self.latency = latency
+        self.requests = {}          # 模型 -> 請求數
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.caches = {}            # cachedContents 名稱 -> system instruction
+        self._failures = []         # [(status, retry_after)]，依序套用在接下來的請求
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def fail_next(self, count: int, status: int = 503, retry_after=None):
+        """ 讓接下來 count 個請求回傳指定狀態碼（可附 Retry-After 秒數） """
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self._failures.clear()
+            self.max_in_flight = 0
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                    failure = server._failures.pop(0) if server._failures else None
+                try:
+                    if server.latency:
+                        time.sleep(server.latency)
+                    if failure:
+                        status, retry_after = failure
+                        headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+                        self._send_json(status, {"error": {"code": status, "message": "mock failure"}},
+                                        headers)
+                        return
+                    self._route(payload)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def _route(self, payload):
+                path = self.path.split("?", 1)[0]
+                match = GENERATE_PATH.match(path)
+                if match:
+                    self._generate(match.group(1), payload)
+                elif path == "/v1beta/cachedContents":
+                    self._create_cache(payload)
+                elif path.rstrip("/") == "/v1beta/openai/chat/completions":
+                    self._chat_completions(payload)
+                else:
+                    self._send_json(404, {"error": {"code": 404, "message": f"unknown path {path}"}})
+
+            def _count(self, model):
+                with server._lock:
+                    server.requests[model] = server.requests.get(model, 0) + 1
+
+            def _generate(self, model, payload):
+                self._count(model)
+                texts = [part.get("text", "") for content in payload.get("contents", [])
+                         for part in content.get("parts", [])]
+                prefix = ""
+                if payload.get("cachedContent"):
+                    if payload["cachedContent"] not in server.caches:
+                        self._send_json(403, {"error": {"code": 403, "message":
+                                                        "CachedContent not found (or permission denied)"}})
+                        return
+                    prefix = server.caches[payload["cachedContent"]]
+                system = payload.get("systemInstruction", {}).get("parts", [])
+                prefix += "".join(part.get("text", "") for part in system)
+                prompt = prefix + "".join(texts)
+                text = server.responder(model, prompt)
+                self._send_json(200, {
+                    "candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                                    "finishReason": "STOP"}],
+                    "usageMetadata": {"promptTokenCount": len(prompt) // 2,
+                                      "candidatesTokenCount": len(text) // 2,
+                                      "cachedContentTokenCount": len(server.caches.get(
+                                          payload.get("cachedContent"), "")) // 2,
+                                      "totalTokenCount": (len(prompt) + len(text)) // 2},
+                })
+
+            def _create_cache(self, payload):
+                name = f"cachedContents/mock-{next(server._ids)}"
+                parts = payload.get("systemInstruction", {}).get("parts", [])
+                server.caches[name] = "".join(part.get("text", "") for part in parts)
+                self._send_json(200, {"name": name, "model": payload.get("model"),
+                                      "ttl": payload.get("ttl")})
+
+            def _chat_completions(self, payload):
+                model = payload.get("model", "")
+                self._count(model)
+                prompt = "".join(str(m.get("content", "")) for m in payload.get("messages", []))
+                text = server.responder(model, prompt)
+                self._send_json(200, {
+                    "id": f"chatcmpl-mock-{next(server._ids)}", "object": "chat.completion",
+                    "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": text}}],
+                    "usage": {"prompt_tokens": len(prompt) // 2, "completion_tokens": len(text) // 2,
+                              "total_tokens": (len(prompt) + len(text)) // 2},
+                })
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機 Gemini 模擬端點")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="每個請求的模擬延遲（秒）")
+    args = parser.parse_args()
+    server = MockGeminiServer(args.host, args.port, latency=args.latency)
+    print(f"模擬 Gemini 端點啟動於 {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
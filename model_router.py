@@ -0,0 +1,288 @@
+"""
+成本導向的模型串接路由
+
+hw4 每個區塊都送 gemini-2.5-pro，hw2、hw5 則不論難易一律用 gemini-2.0-flash。
+這裡改成由快速便宜的模型先做，結構化輸出通過檢查才採用，只有失敗或不確定的項目才升級給大模型：
+  - ModelRouter(task, generate, validate)：generate(模型, 提示詞) 回傳文字（通常是 prompt_cache.generate），
+    validate(文字, 項目) 回傳 Verdict（是否有效、原因、信心）
+  - route(prompt)：單一提示詞；route_items(items, render, parse)：一次送出多個項目（例如 hw2 一批 10 筆），
+    只把沒通過的項目重新組成一批交給下一層
+  - ask_confidence=True 時在提示詞最後要求模型另起一行輸出「信心：0~1」，回覆中的這一行會先移除再檢查；
+    信心低於 ROUTER_MIN_CONFIDENCE 視為不確定
+  - 最後一層的結果一律採用，但沒通過檢查時標記為未驗證（RouteResult.validated 為 False、reason 為原因，
+    ROUTER_LOG 記為 unvalidated），由呼叫端決定如何呈現；最後一層呼叫失敗時把例外往上拋，由呼叫端原本的錯誤處理接手
+  - 每次升級都會印出原因；各任務的升級率與各層延遲由 report() 彙總，ROUTER_LOG 指定檔案時逐筆寫成 JSONL
+
+環境變數：
+  ROUTER_CHEAP_MODEL     第一層模型（預設 gemini-2.0-flash）
+  ROUTER_STRONG_MODEL    升級用的模型（預設 gemini-2.5-pro-exp-03-25）
+  ROUTER_MIN_CONFIDENCE  採用第一層結果所需的最低信心（預設 0.7）
+  ROUTER_CASCADE=0       不串接，一律直接使用最後一層（大模型）
+  ROUTER_LOG             路由決策的 JSONL 紀錄檔
+
+直接執行本檔會以假模型做自我檢查：
+    python model_router.py
+"""
+import collections
+import json
+import os
+import re
+import statistics
+import threading
+import time
+from datetime import datetime
+
+import tracing
+
+CHEAP_MODEL = os.getenv("ROUTER_CHEAP_MODEL", "gemini-2.0-flash")
+STRONG_MODEL = os.getenv("ROUTER_STRONG_MODEL", "gemini-2.5-pro-exp-03-25")
+DEFAULT_TIERS = (CHEAP_MODEL, STRONG_MODEL)
+MIN_CONFIDENCE = float(os.getenv("ROUTER_MIN_CONFIDENCE", "0.7"))
+CASCADE = os.getenv("ROUTER_CASCADE", "1") != "0"
+ROUTER_LOG = os.getenv("ROUTER_LOG")
+
+CONFIDENCE_INSTRUCTION = "\n\n最後請另起一行，以「信心：」加上 0 到 1 之間的數字，表示你對以上結果正確完整的把握程度。"
+_CONFIDENCE_LINE = re.compile(r"\n?[ \t*_#>]*信心[^\S\n]*[:：][^\S\n]*\**[^\S\n]*(\d+(?:\.\d+)?%?|\.\d+)[^\n]*\s*$")
+
+
+class Verdict:
+    """ 檢查結果：ok 為結構是否有效；confidence 為模型自評的信心（沒有則為 None） """
+
+    def __init__(self, ok: bool, reason: str = "", confidence: float = None, value=None):
+        self.ok = ok
+        self.reason = reason
+        self.confidence = confidence
+        self.value = value
+
+
+class RouteResult:
+    def __init__(self, value, text: str, model: str, tier: int, verdict: Verdict, reason: str = None):
+        self.value = value          # 檢查函式整理後的值（沒有則為去掉信心行的文字）
+        self.text = text
+        self.model = model
+        self.tier = tier
+        self.verdict = verdict
+        self.reason = reason        # 最後一層仍未通過檢查（或信心不足）的原因；通過則為 None
+
+    @property
+    def escalated(self) -> bool:
+        return self.tier > 0
+
+    @property
+    def validated(self) -> bool:
+        """ False 表示沒有更大的模型可升級，只好採用未通過檢查的結果 """
+        return self.reason is None
+
+
+def parse_confidence(value):
+    """ 把 0~1 的數字或百分比轉成 0~1 的浮點數，無法解析則回傳 None """
+    if value is None:
+        return None
+    match = re.search(r"\d+(?:\.\d+)?|\.\d+", str(value))
+    if not match:
+        return None
+    number = float(match.group())
+    if number > 1:
+        number /= 100
+    return number if 0 <= number <= 1 else None
+
+
+def split_confidence(text: str):
+    """ 移除回覆最後的「信心：x」行，回傳 (文字, 信心或 None) """
+    match = _CONFIDENCE_LINE.search(text)
+    if not match:
+        return text, None
+    return text[:match.start()].rstrip(), parse_confidence(match.group(1))
+
+
+class ModelRouter:
+    """ 依序嘗試各層模型，通過檢查且信心足夠就停止 """
+
+    def __init__(self, task: str, generate, validate=None, tiers=DEFAULT_TIERS,
+                 min_confidence: float = MIN_CONFIDENCE, ask_confidence: bool = False):
+        self.task = task
+        self.generate = generate
+        self.validate = validate or (lambda text, item: Verdict(bool(text.strip()), "空白回覆"))
+        self.tiers = tuple(tiers) if CASCADE else tuple(tiers)[-1:]
+        self.min_confidence = min_confidence
+        self.ask_confidence = ask_confidence
+        self._lock = threading.Lock()
+        self.items = 0
+        self.escalated = 0
+        self.invalid_final = 0
+        self.reasons = collections.Counter()
+        self.accepted = collections.Counter()      # 模型 -> 採用的項目數
+        self.latencies = collections.defaultdict(list)  # 模型 -> 每次呼叫秒數
+        _routers.append(self)
+
+    @property
+    def label(self) -> str:
+        return " → ".join(self.tiers)
+
+    def _accept(self, verdict: Verdict):
+        """ 回傳 None 表示採用，否則回傳升級原因 """
+        if not verdict.ok:
+            return verdict.reason or "檢查未通過"
+        if verdict.confidence is not None and verdict.confidence < self.min_confidence:
+            return f"信心 {verdict.confidence:.2f} < {self.min_confidence:.2f}"
+        return None
+
+    def route(self, prompt: str) -> RouteResult:
+        """ 單一提示詞：validate(文字, 提示詞) 檢查整份回覆 """
+        return self.route_items([prompt], lambda items: items[0],
+                                lambda text, items: [self.validate(text, items[0])])[0]
+
+    def route_items(self, items, render, parse=None):
+        """
+        一次送出多個項目：render(項目列表) 組成提示詞，parse(文字, 項目列表) 回傳與項目等長的 Verdict 列表
+        （未給 parse 時整份回覆只對應一個項目）。回傳與 items 等長的 RouteResult 列表。
+        """
+        parse = parse or (lambda text, batch: [self.validate(text, batch[0])])
+        results = [None] * len(items)
+        pending = list(range(len(items)))
+        with self._lock:
+            self.items += len(items)
+        for tier, model in enumerate(self.tiers):
+            last = tier == len(self.tiers) - 1
+            batch = [items[i] for i in pending]
+            prompt = render(batch)
+            if self.ask_confidence:
+                prompt += CONFIDENCE_INSTRUCTION
+            start = time.perf_counter()
+            with tracing.span("route", task=self.task, model=model, tier=tier, items=len(batch)) as span:
+                try:
+                    raw = self.generate(model, prompt)
+                except Exception as e:
+                    self._record_latency(model, time.perf_counter() - start)
+                    if last:
+                        raise
+                    verdicts = [Verdict(False, f"呼叫失敗：{type(e).__name__}") for _ in batch]
+                    raw = ""
+                else:
+                    self._record_latency(model, time.perf_counter() - start)
+                    text, confidence = split_confidence(raw) if self.ask_confidence else (raw, None)
+                    verdicts = list(parse(text, batch))
+                    verdicts += [Verdict(False, "回覆項目數不足")] * (len(batch) - len(verdicts))
+                    for verdict in verdicts:
+                        if verdict.confidence is None:
+                            verdict.confidence = confidence
+                        if verdict.value is None:
+                            verdict.value = text
+                next_pending = []
+                escalations = collections.Counter()
+                unvalidated = 0
+                for index, verdict in zip(pending, verdicts):
+                    reason = self._accept(verdict)
+                    self._log(index, model, tier, reason, verdict, time.perf_counter() - start,
+                              unvalidated=last and reason is not None)
+                    if reason is None or last:
+                        results[index] = RouteResult(verdict.value, raw, model, tier, verdict, reason)
+                        with self._lock:
+                            self.accepted[model] += 1
+                            if reason is not None:
+                                self.invalid_final += 1
+                                unvalidated += 1
+                    else:
+                        next_pending.append(index)
+                        escalations[reason] += 1
+                        with self._lock:
+                            self.reasons[reason.split(" ")[0]] += 1
+                span.set(escalated=len(next_pending), unvalidated=unvalidated)
+                if unvalidated:
+                    print(f"[路由] {self.task}：{unvalidated}/{len(batch)} 項在最後一層 {model} 仍未通過檢查，"
+                          f"以未驗證結果回傳")
+            if next_pending:
+                if tier == 0:
+                    with self._lock:
+                        self.escalated += len(next_pending)
+                print(f"[路由] {self.task}：{len(next_pending)}/{len(batch)} 項由 {model} 升級至 "
+                      f"{self.tiers[tier + 1]}（{'、'.join(f'{r} ×{n}' for r, n in escalations.items())}）")
+            pending = next_pending
+            if not pending:
+                break
+        return results
+
+    def _record_latency(self, model: str, seconds: float):
+        with self._lock:
+            self.latencies[model].append(seconds)
+
+    def _log(self, index: int, model: str, tier: int, reason, verdict: Verdict, seconds: float,
+             unvalidated: bool = False):
+        if not ROUTER_LOG:
+            return
+        record = {"time": datetime.now().isoformat(timespec="milliseconds"), "task": self.task,
+                  "item": index, "model": model, "tier": tier, "accepted": reason is None,
+                  "unvalidated": unvalidated, "reason": reason, "confidence": verdict.confidence,
+                  "seconds": round(seconds, 3)}
+        with _log_lock, open(ROUTER_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "task": self.task, "tiers": list(self.tiers), "items": self.items,
+                "escalated": self.escalated,
+                "escalation_rate": self.escalated / self.items if self.items else 0.0,
+                "invalid_final": self.invalid_final, "reasons": dict(self.reasons),
+                "accepted": dict(self.accepted),
+                "latency": {model: {"calls": len(values), "p50": statistics.median(values),
+                                    "max": max(values)}
+                            for model, values in self.latencies.items() if values},
+            }
+
+    def report_line(self) -> str:
+        s = self.stats()
+        tiers = "；".join(f"{model} {lat['calls']} 次 p50 {lat['p50']:.2f}s"
+                         for model, lat in s["latency"].items())
+        reasons = "、".join(f"{r} {n}" for r, n in s["reasons"].items())
+        return (f"  {s['task']}: {s['items']} 項，升級 {s['escalated']} 項（{s['escalation_rate'] * 100:.1f}%）"
+                + (f"，最後一層仍未通過 {s['invalid_final']} 項" if s["invalid_final"] else "")
+                + (f"；{tiers}" if tiers else "") + (f"；原因 {reasons}" if reasons else ""))
+
+
+_routers = []
+_log_lock = threading.Lock()
+
+
+def report() -> str:
+    lines = ["模型路由統計："]
+    lines.extend(router.report_line() for router in _routers if router.items)
+    return "\n".join(lines)
+
+
+def _self_check():
+    """ 以假模型驗證：第一層只有部分項目通過，升級時只重送沒通過的項目 """
+    calls = []
+
+    def generate(model, prompt):
+        batch = json.loads(prompt.split("\n", 1)[0])
+        calls.append((model, batch))
+        # 便宜模型對奇數項目給出無效結果、對 4 給出低信心
+        return json.dumps([{"item": i, "score": (0 if model == "cheap" and i % 2 else 3),
+                            "confidence": (0.3 if model == "cheap" and i == 4 else 0.9)} for i in batch])
+
+    def parse(text, batch):
+        verdicts = []
+        for entry in json.loads(text):
+            ok = 1 <= entry["score"] <= 5
+            verdicts.append(Verdict(ok, "分數無效", entry["confidence"], entry["score"]))
+        return verdicts
+
+    router = ModelRouter("self-check", generate, tiers=("cheap", "strong"))
+    router.tiers = ("cheap", "strong")  # 不受 ROUTER_CASCADE 影響
+    results = router.route_items(list(range(6)), lambda batch: json.dumps(batch) + "\n", parse)
+    assert calls == [("cheap", [0, 1, 2, 3, 4, 5]), ("strong", [1, 3, 4, 5])], calls
+    assert [r.model for r in results] == ["cheap", "strong", "cheap", "strong", "strong", "strong"]
+    assert all(r.value == 3 for r in results)
+    assert router.stats()["escalated"] == 4
+
+    text, confidence = split_confidence("報告內容\n| a | b |\n\n**信心：** 0.85")
+    assert text == "報告內容\n| a | b |" and confidence == 0.85, (text, confidence)
+    assert split_confidence("沒有信心行")[1] is None
+    assert parse_confidence("85%") == 0.85
+    print(report())
+    print("自我檢查通過。")
+
+
+if __name__ == "__main__":
+    _self_check()
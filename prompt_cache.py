@@ -0,0 +1,338 @@
+"""
+靜態提示詞前綴快取
+
+hw5 的 HEXACO 定義、hw2 的評分標準、hw4 的分析規則，每次呼叫都重新組字串並整段重送。
+這裡把提示詞拆成「固定前綴 + 變動後綴」：
+  - PromptTemplate：前綴只組一次，並預先計算雜湊與估計 token 數
+  - PromptCache：呼叫時若提示詞以已登記的前綴開頭，就改用供應商端的 context cache，
+    每個快取期間 (ttl) 內前綴只上傳一次；前綴低於供應商的最小快取長度時不登記、直接整段送出，
+    建立失敗或快取已被供應商移除時也退回整段送出
+  - 統計每個範本省下的前綴 token 數，於每次執行結束時回報
+  - 使用者可編輯的提示詞（例如 hw4 的自訂規則）以 register(..., pin=False) 登記，
+    只保留最近使用的 MAX_TRANSIENT 個，避免長時間執行的 Gradio 行程無限累積
+
+後端：
+  - GatewayContextCache：經由 llm_gateway 呼叫 Gemini cachedContents
+  - LocalContextCache：本機替身，記錄前綴實際上傳次數，用來驗證快取行為
+
+直接執行本檔會以 LocalContextCache 做自我檢查：
+    python prompt_cache.py
+"""
+import collections
+import hashlib
+import os
+import re
+import threading
+import time
+
+DEFAULT_TTL = int(os.getenv("PROMPT_CACHE_TTL", "600"))  # 秒
+MAX_TRANSIENT = int(os.getenv("PROMPT_CACHE_MAX_TRANSIENT", "16"))
+# 快取到期前提早這麼多秒重建，避免送出時剛好過期
+EXPIRY_MARGIN = 30
+# Gemini cachedContents 的最小前綴長度，低於此值建立快取必定失敗
+GEMINI_MIN_CACHE_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+
+_CJK = re.compile(r'[\u3000-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """ 粗估 token 數：中日韓文字約一字一 token，其餘約四個字元一 token """
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class PromptTemplate:
+    """ 固定前綴在建立時組好一次，之後只需接上變動的後綴 """
+
+    def __init__(self, name: str, prefix: str, separator: str = ""):
+        self.name = name
+        self.prefix = prefix
+        self.separator = separator
+        self.key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+        self.prefix_tokens = estimate_tokens(prefix)
+
+    def render(self, suffix: str) -> str:
+        return self.prefix + self.separator + suffix
+
+    def split(self, prompt: str):
+        """ 若 prompt 以本範本的前綴開頭，回傳後綴；否則回傳 None """
+        head = self.prefix + self.separator
+        if prompt.startswith(head):
+            return prompt[len(head):]
+        return None
+
+
+# ----- 後端 -----
+
+
+class StaleCacheError(Exception):
+    """ 供應商拒絕快取 handle（已過期或已刪除），應丟棄 handle 並整段重送 """
+
+
+class GatewayContextCache:
+    """ 經由 llm_gateway 使用 Gemini 的 cachedContents（hw2、hw4、hw5 共用） """
+
+    min_prefix_tokens = GEMINI_MIN_CACHE_TOKENS
+
+    def create(self, model: str, prefix: str, ttl: int):
+        import llm_gateway
+        return llm_gateway.create_cached_content_sync(model, prefix, ttl)
+
+    def generate(self, model: str, handle, suffix: str) -> str:
+        import llm_gateway
+        try:
+            return llm_gateway.generate_sync(model, suffix, cached_content=handle).text
+        except llm_gateway.GatewayHTTPError as e:
+            # 過期或已刪除的快取：Gemini 回 400/403/404，訊息提及 CachedContent
+            if e.status in (400, 403, 404) and "cache" in str(e).lower():
+                raise StaleCacheError(str(e)) from e
+            raise
+
+    def generate_inline(self, model: str, prompt: str) -> str:
+        import llm_gateway
+        return llm_gateway.generate_sync(model, prompt).text
+
+
+class LocalContextCache:
+    """
+    本機替身：不連網，把「前綴 + 後綴」交給 responder 產生回覆，
+    並記錄前綴實際上傳的次數 (uploads) 與每次請求實際送出的內容 (requests)。
+    """
+
+    def __init__(self, responder=None, min_prefix_tokens: int = 0):
+        self.responder = responder or (lambda prompt: f"ok:{len(prompt)}")
+        self.min_prefix_tokens = min_prefix_tokens
+        self.uploads = []
+        self.requests = []
+        self.expired = set()  # 模擬供應商端已移除的快取（以前綴表示）
+
+    def create(self, model: str, prefix: str, ttl: int):
+        if estimate_tokens(prefix) < self.min_prefix_tokens:
+            raise ValueError("前綴太短，無法建立快取")
+        self.uploads.append((model, prefix))
+        return {"prefix": prefix, "model": model}
+
+    def generate(self, model: str, handle, suffix: str) -> str:
+        if handle["prefix"] in self.expired:
+            raise StaleCacheError("CachedContent not found")
+        self.requests.append((model, suffix))
+        return self.responder(handle["prefix"] + suffix)
+
+    def generate_inline(self, model: str, prompt: str) -> str:
+        self.requests.append((model, prompt))
+        return self.responder(prompt)
+
+
+# ----- 快取管理 -----
+
+
+class PromptCache:
+    """ 依範本前綴管理供應商端快取，並統計節省的 token 數 """
+
+    def __init__(self, backend, ttl: int = DEFAULT_TTL, max_transient: int = MAX_TRANSIENT):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_transient = max_transient
+        self.templates = {}
+        self._transient = collections.OrderedDict()  # 未固定的範本 key，依最近使用排序
+        self._handles = {}       # (模型, 範本 key) -> (handle, 到期時間)；handle 為 None 表示此期間無法快取
+        self._create_locks = {}  # (模型, 範本 key) -> Lock，同一前綴同時只建立一次快取
+        self._stats = {}
+        self._skipped = set()    # 因低於最小快取長度而未登記的範本名稱（自訂規則共用名稱，集合不會無限增長）
+        self._lock = threading.Lock()
+
+    def register(self, template: PromptTemplate, pin: bool = True) -> PromptTemplate:
+        """
+        登記範本（重複登記相同前綴不會有影響）。
+        pin=False 的範本只保留最近使用的 max_transient 個，超過時移除最久未用的範本與其統計。
+        前綴低於後端最小快取長度的範本不登記，呼叫時直接整段送出，不必每個期間白送一次建立請求。
+        """
+        if template.prefix_tokens < self.backend.min_prefix_tokens:
+            with self._lock:
+                first = template.name not in self._skipped
+                self._skipped.add(template.name)
+            if first:
+                print(f"提示詞前綴 {template.name} 約 {template.prefix_tokens} tokens，"
+                      f"低於快取下限 {self.backend.min_prefix_tokens}，改為整段送出")
+            return template
+        with self._lock:
+            template = self.templates.setdefault(template.key, template)
+            self._stats.setdefault(template.key, {
+                "name": template.name, "calls": 0, "cached_calls": 0,
+                "uploads": 0, "prefix_tokens": template.prefix_tokens,
+                "prefix_tokens_sent": 0})
+            if not pin or template.key in self._transient:
+                self._transient[template.key] = True
+                self._transient.move_to_end(template.key)
+                while len(self._transient) > self.max_transient:
+                    self._evict(self._transient.popitem(last=False)[0])
+        return template
+
+    def _evict(self, key: str):
+        """ 呼叫端須持有 self._lock；供應商端的快取到期後自行刪除 """
+        self.templates.pop(key, None)
+        self._stats.pop(key, None)
+        for handle_key in [k for k in self._handles if k[1] == key]:
+            self._handles.pop(handle_key)
+            self._create_locks.pop(handle_key, None)
+
+    def match(self, prompt: str):
+        """ 找出 prompt 開頭符合的最長前綴範本，回傳 (範本, 後綴)；沒有符合則 (None, prompt) """
+        best = None
+        with self._lock:
+            templates = list(self.templates.values())
+        for template in templates:
+            suffix = template.split(prompt)
+            if suffix is not None and (best is None or len(template.prefix) > len(best[0].prefix)):
+                best = (template, suffix)
+        return best or (None, prompt)
+
+    def _handle(self, model: str, template: PromptTemplate, stats: dict):
+        """
+        取得有效的快取 handle。建立快取需要一次網路請求，只在該 (模型, 範本) 的鎖內進行，
+        不佔用全域鎖，其他範本或已有快取的呼叫不必等待。
+        """
+        key = (model, template.key)
+        with self._lock:
+            handle, expires = self._handles.get(key, (None, 0))
+            if time.time() < expires:
+                return handle
+            create_lock = self._create_locks.setdefault(key, threading.Lock())
+        with create_lock:
+            # 等鎖期間可能已由其他執行緒建立
+            with self._lock:
+                handle, expires = self._handles.get(key, (None, 0))
+                if time.time() < expires:
+                    return handle
+            try:
+                handle = self.backend.create(model, template.prefix, self.ttl)
+                with self._lock:
+                    stats["uploads"] += 1
+                    stats["prefix_tokens_sent"] += template.prefix_tokens
+                print(f"已建立提示詞前綴快取：{template.name} ({model})")
+            except Exception as e:
+                print(f"無法建立提示詞前綴快取 {template.name}，本期間改為整段送出：{e}")
+                handle = None
+            with self._lock:
+                if template.key in self.templates:
+                    self._handles[key] = (handle, time.time() + self.ttl - EXPIRY_MARGIN)
+            return handle
+
+    def generate(self, model: str, prompt: str) -> str:
+        """ 送出提示詞；前綴有快取時只送後綴 """
+        template, suffix = self.match(prompt)
+        if template is None:
+            return self.backend.generate_inline(model, prompt)
+        with self._lock:
+            stats = self._stats.get(template.key)
+            if stats is None:  # 比對後剛好被移除
+                stats = {"calls": 0, "cached_calls": 0, "uploads": 0, "prefix_tokens_sent": 0}
+            if template.key in self._transient:
+                self._transient.move_to_end(template.key)
+        handle = self._handle(model, template, stats)
+        with self._lock:
+            stats["calls"] += 1
+            if handle is not None:
+                stats["cached_calls"] += 1
+            else:
+                stats["prefix_tokens_sent"] += template.prefix_tokens
+        if handle is None:
+            return self.backend.generate_inline(model, prompt)
+        try:
+            return self.backend.generate(model, handle, suffix)
+        except StaleCacheError as e:
+            print(f"提示詞前綴快取 {template.name} 已失效，改為整段送出並於下次重建：{e}")
+            with self._lock:
+                if self._handles.get((model, template.key), (None, 0))[0] is handle:
+                    self._handles.pop((model, template.key))
+                stats["cached_calls"] -= 1
+                stats["prefix_tokens_sent"] += template.prefix_tokens
+            return self.backend.generate_inline(model, prompt)
+
+    def stats(self):
+        """ 每個範本的統計，tokens_saved = 不快取時應送出的前綴 token - 實際送出的前綴 token """
+        with self._lock:
+            result = []
+            for s in self._stats.values():
+                s = dict(s)
+                s["tokens_saved"] = s["calls"] * s["prefix_tokens"] - s["prefix_tokens_sent"]
+                result.append(s)
+            return result
+
+    def report(self) -> str:
+        lines = ["提示詞前綴快取統計："]
+        for s in self.stats():
+            lines.append(
+                f"  {s['name']}: 呼叫 {s['calls']} 次（快取 {s['cached_calls']} 次），"
+                f"前綴上傳 {s['uploads']} 次，省下約 {s['tokens_saved']} tokens")
+        return "\n".join(lines)
+
+
+def _self_check():
+    """ 以本機替身驗證：同一快取期間內前綴只上傳一次，過期後重新上傳一次 """
+    backend = LocalContextCache()
+    cache = PromptCache(backend, ttl=EXPIRY_MARGIN + 1)
+    template = cache.register(PromptTemplate("demo", "固定規則" * 500, "\n\n"))
+    for i in range(5):
+        cache.generate("local-model", template.render(f"資料 {i}"))
+    assert len(backend.uploads) == 1, backend.uploads
+    assert all(not req.startswith(template.prefix) for _, req in backend.requests)
+    time.sleep(1.1)
+    cache.generate("local-model", template.render("過期後"))
+    assert len(backend.uploads) == 2, backend.uploads
+    cache.generate("local-model", "沒有登記前綴的提示詞")
+    assert backend.requests[-1][1] == "沒有登記前綴的提示詞"
+
+    # 前綴低於最小快取長度時不登記，直接整段送出
+    short = LocalContextCache(min_prefix_tokens=10 ** 6)
+    fallback = PromptCache(short)
+    template = fallback.register(PromptTemplate("short", "短前綴", "\n"))
+    fallback.generate("local-model", template.render("x"))
+    assert short.uploads == [] and short.requests[-1][1] == template.render("x")
+    assert fallback.templates == {} and fallback.stats() == []
+
+    # 供應商已移除快取：丟棄 handle、整段重送，下次呼叫重建
+    stale = LocalContextCache()
+    recovering = PromptCache(stale)
+    template = recovering.register(PromptTemplate("stale", "固定規則" * 10, "\n"))
+    recovering.generate("local-model", template.render("a"))
+    stale.expired.add(template.prefix)
+    assert recovering.generate("local-model", template.render("b")) == f"ok:{len(template.render('b'))}"
+    assert stale.requests[-1][1] == template.render("b")
+    stale.expired.clear()
+    recovering.generate("local-model", template.render("c"))
+    assert len(stale.uploads) == 2 and stale.requests[-1][1] == "c"
+
+    # 未固定的範本只保留最近使用的 max_transient 個，固定的範本不受影響
+    bounded = PromptCache(LocalContextCache(), max_transient=2)
+    pinned = bounded.register(PromptTemplate("pinned", "固定"))
+    for i in range(5):
+        bounded.generate("local-model", bounded.register(PromptTemplate("custom", f"自訂{i}"), pin=False).render("x"))
+    assert set(bounded.templates) == {pinned.key, PromptTemplate("", "自訂3").key, PromptTemplate("", "自訂4").key}
+    assert len(bounded.stats()) == 3 and len(bounded._handles) == 2
+
+    # 建立快取時不持有全域鎖：一個範本建立中，其他範本照常送出
+    started, release = threading.Event(), threading.Event()
+
+    class SlowCreate(LocalContextCache):
+        def create(self, model, prefix, ttl):
+            if prefix == "慢":
+                started.set()
+                release.wait(5)
+            return super().create(model, prefix, ttl)
+
+    concurrent = PromptCache(SlowCreate())
+    slow = concurrent.register(PromptTemplate("slow", "慢"))
+    fast = concurrent.register(PromptTemplate("fast", "快"))
+    worker = threading.Thread(target=concurrent.generate, args=("local-model", slow.render("x")))
+    worker.start()
+    started.wait(5)
+    assert concurrent.generate("local-model", fast.render("y")) == "ok:2"
+    release.set()
+    worker.join()
+    print(cache.report())
+    print("自我檢查通過。")
+
+
+if __name__ == "__main__":
+    _self_check()
@@ -0,0 +1,101 @@
+import random
+import time
+
+import pytest
+
+from hw2_store import ScoreStore, parse_score
+
+ITEMS = ["溝通技巧（語速與音量適當性）", "耐心與情緒管理（冷靜處理衝突）", "專業知識（業務熟悉度）"]
+DAY = 86400
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ScoreStore(str(tmp_path / "scores.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def filled(store):
+    """ 三位專員、跨約 14 個月、每次執行 5 筆逐字稿，部分分數無效 """
+    rng = random.Random(0)
+    now = time.time()
+    for r in range(40):
+        scored_at = now - rng.random() * 420 * DAY
+        agent = f"專員{r % 3}"
+        run_id = store.start_run(f"run{r}.csv", "test-model", scored_at)
+        rows = []
+        for i in range(5):
+            result = {item: str(rng.randint(1, 5)) for item in ITEMS}
+            if i == 0:
+                result[ITEMS[0]] = "N/A"
+            rows.append((i, result, f"run{r}.csv", agent))
+        store.add_scores(run_id, rows, scored_at)
+    return store
+
+
+def as_dict(rows):
+    return {tuple(row[:-2]): (pytest.approx(row[-2]), row[-1]) for row in rows}
+
+
+def test_parse_score():
+    assert parse_score("4") == 4 and parse_score(4) == 4 and parse_score("4 分") == 4
+    assert parse_score("4.0") == 4
+    for value in ("0", "6", "4.5", "N/A", "", None):
+        assert parse_score(value) is None
+
+
+def test_invalid_scores_are_skipped(filled):
+    total = filled.conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+    assert total == 40 * (5 * len(ITEMS) - 1)
+
+
+@pytest.mark.parametrize("by", ["criterion", "agent"])
+def test_rollup_from_monthly_matches_raw_scores(filled, by):
+    # since=0 不改變結果，但會改走逐筆的 scores 表
+    assert as_dict(filled.rollup(by)) == as_dict(filled.rollup(by, since=0))
+
+
+def test_rollup_agent_filter_matches_raw_scores(filled):
+    assert as_dict(filled.rollup("agent", agent="專員1")) == as_dict(filled.rollup("agent", agent="專員1", since=0))
+    assert {row[0] for row in filled.rollup("agent", agent="專員1")} == {"專員1"}
+
+
+@pytest.mark.parametrize("period", ["month", "year"])
+@pytest.mark.parametrize("agent", [None, "專員2"])
+def test_trend_from_monthly_matches_raw_scores(filled, period, agent):
+    from_monthly = filled.trend("耐心與情緒管理", agent=agent, period=period)
+    from_scores = filled.trend("耐心與情緒管理", agent=agent, period=period, since=0)
+    assert from_monthly and as_dict(from_monthly) == as_dict(from_scores)
+
+
+def test_monthly_table_totals_match_scores(filled):
+    monthly = dict(((cid, agent, month), (total, count)) for cid, agent, month, total, count in filled.conn.execute(
+        "SELECT criterion_id, agent, month, score_sum, score_count FROM monthly"))
+    raw = dict(((cid, agent, month), (total, count)) for cid, agent, month, total, count in filled.conn.execute(
+        "SELECT criterion_id, agent, strftime('%Y-%m', scored_at, 'unixepoch', 'localtime'),"
+        " SUM(score), COUNT(*) FROM scores GROUP BY 1, 2, 3"))
+    assert monthly == raw
+
+
+def test_failed_batch_rolls_back_scores_and_monthly(store):
+    run_id = store.start_run("x.csv")
+
+    class Boom(dict):
+        def items(self):
+            raise RuntimeError("boom")
+
+    store.add_scores(run_id, [(0, {ITEMS[0]: "3"}, "x", "專員0")])
+    with pytest.raises(RuntimeError):
+        store.add_scores(run_id, [(1, {ITEMS[0]: "5"}, "x", "專員0"), (2, Boom(), "x", "專員0")])
+    assert store.conn.execute("SELECT COUNT(*), SUM(score) FROM scores").fetchone() == (1, 3)
+    assert store.conn.execute("SELECT SUM(score_count), SUM(score_sum) FROM monthly").fetchone() == (1, 3)
+    assert store.rollup()[0][2:] == (3.0, 1)
+
+
+def test_trend_uses_covering_index(filled):
+    cid = filled._criterion_filter("耐心與情緒管理")[0][0]
+    plan = " ".join(filled.explain(
+        "SELECT AVG(score) FROM scores WHERE criterion_id = ? AND agent = ? GROUP BY scored_at", (cid, "專員0")))
+    assert "idx_scores_trend" in plan
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from hw5_audio import SAMPLE_RATE, TimestampMap, trim_silence
+
+
+def test_timestamp_map_converts_trimmed_time_to_original():
+    # 原始錄音的 1–3 秒與 10–12 秒為語音，裁切後接在一起
+    pieces = [(0, 1 * SAMPLE_RATE, 2 * SAMPLE_RATE), (2 * SAMPLE_RATE, 10 * SAMPLE_RATE, 2 * SAMPLE_RATE)]
+    timestamps = TimestampMap(pieces)
+    assert timestamps.to_original(0.0) == pytest.approx(1.0)
+    assert timestamps.to_original(1.5) == pytest.approx(2.5)
+    assert timestamps.to_original(2.0) == pytest.approx(10.0)
+    assert timestamps.to_original(3.25) == pytest.approx(11.25)
+    # 超過最後一段的時間夾在該段結尾
+    assert timestamps.to_original(9.0) == pytest.approx(12.0)
+
+
+def test_timestamp_map_segments_and_empty_map():
+    timestamps = TimestampMap([(0, 5 * SAMPLE_RATE, 3 * SAMPLE_RATE)])
+    segments = timestamps.map_segments([{"start": 0.5, "end": 2.0, "text": "你好"}])
+    assert segments == [{"start": pytest.approx(5.5), "end": pytest.approx(7.0), "text": "你好"}]
+    assert TimestampMap([]).to_original(4.2) == 4.2
+
+
+def test_trim_silence_round_trips_speech_positions():
+    rng = np.random.default_rng(0)
+    audio = np.zeros(SAMPLE_RATE * 12, dtype=np.float32)
+    speech = [(2, 4), (8, 10)]
+    for start, end in speech:
+        audio[start * SAMPLE_RATE:end * SAMPLE_RATE] = 0.3 * rng.standard_normal((end - start) * SAMPLE_RATE)
+    trimmed, timestamps = trim_silence(audio)
+    assert len(trimmed) < len(audio)
+    # 裁切後第一段語音的中點換算回原始時間，仍落在第一段語音內
+    first_piece = timestamps.pieces[0]
+    middle = (first_piece[0] + first_piece[2] / 2) / SAMPLE_RATE
+    assert 2 <= timestamps.to_original(middle) <= 4
+    second_piece = timestamps.pieces[-1]
+    assert 8 <= timestamps.to_original((second_piece[0] + second_piece[2] / 2) / SAMPLE_RATE) <= 10
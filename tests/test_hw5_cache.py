@@ -0,0 +1,33 @@
+import json
+import os
+
+import pytest
+
+import hw5_cache
+from hw5_cache import TranscriptCache, cache_key
+
+
+def test_cache_key_separates_trim_and_mode():
+    keys = {cache_key("a" * 64, "whisper:medium", "zh", mode, trim)
+            for mode in ("full", "segmented") for trim in (True, False)}
+    assert len(keys) == 4
+
+
+def test_put_removes_temp_file_when_write_fails(tmp_path, monkeypatch):
+    cache = TranscriptCache(str(tmp_path))
+
+    def broken_dump(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(hw5_cache.json, "dump", broken_dump)
+    with pytest.raises(OSError):
+        cache.put("key", "逐字稿")
+    assert os.listdir(tmp_path) == []
+
+
+def test_put_then_get_round_trips(tmp_path):
+    cache = TranscriptCache(str(tmp_path))
+    cache.put("key", "逐字稿", model="stub")
+    assert cache.get("key") == "逐字稿"
+    with open(tmp_path / "key.json", encoding="utf-8") as f:
+        assert json.load(f)["model"] == "stub"
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+import hw5
+
+
+@pytest.mark.parametrize("text", [
+    "！開頭就是標點。接著一句？\n？換行後緊接標點\n\n最後一句",
+    "\n\n。。前面只有換行與標點",
+    "沒有任何標點的一長串文字" * 30,
+    "你好。" * 200,
+    "  \n",
+    "",
+])
+def test_split_transcript_keeps_every_character(text):
+    chunks = hw5.split_transcript(text, max_chars=40)
+    assert "".join(chunks) == text
+
+
+def test_split_transcript_random_text_round_trips():
+    rng = random.Random(0)
+    for _ in range(500):
+        text = "".join(rng.choice("ab 。！？!?\n") for _ in range(rng.randint(1, 300)))
+        chunks = hw5.split_transcript(text, max_chars=rng.randint(1, 40))
+        assert "".join(chunks) == text
+        assert all(chunk.strip() for chunk in chunks) or not text.strip()
+
+
+def test_split_transcript_respects_limit_on_sentence_boundaries():
+    text = "這是一句話。" * 50
+    chunks = hw5.split_transcript(text, max_chars=30)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 30 for chunk in chunks)
+    assert all(chunk.endswith("。") for chunk in chunks)
+
+
+def test_split_transcript_short_text_is_single_chunk():
+    assert hw5.split_transcript("短短一句。", max_chars=100) == ["短短一句。"]
+
+
+def test_renumber_qa_makes_numbers_continuous():
+    chunks = [
+        "問題1: 你好？\n回答1: 你好。\n問題2: 你是誰？\n回答2: 小明。",
+        "問題1: 興趣？\n回答1: 閱讀。",
+        "**問題 [1]**: 還有嗎？\n**回答 [1]**: 沒有。",
+    ]
+    merged = hw5.renumber_qa(chunks)
+    assert "問題3: 興趣？" in merged and "回答3: 閱讀。" in merged
+    assert "**問題 [4]**" in merged and "**回答 [4]**" in merged
+    assert merged.count("\n\n") == 2
+
+
+def test_renumber_qa_leaves_chunks_without_numbers_alone():
+    merged = hw5.renumber_qa(["沒有編號的段落", "問題1: a\n回答1: b"])
+    assert merged == "沒有編號的段落\n\n問題1: a\n回答1: b"
+
+
+@pytest.mark.parametrize("text", [
+    "問題1: 你好？\n回答1: 你好。",
+    "問題[1]: 你好？\n回答[1]: 你好。",
+    "**問題 [1]**: 你好？\n**回答 [1]**: 你好。",
+    "**問題1**：你好？\n**回答1**：你好。",
+])
+def test_validate_formatting_accepts_prompt_output_forms(text):
+    assert hw5.validate_formatting(text, "").ok
+
+
+def test_validate_formatting_rejects_missing_answers():
+    verdict = hw5.validate_formatting("問題1: a\n問題2: b\n問題3: c\n回答1: x", "")
+    assert not verdict.ok
@@ -0,0 +1,81 @@
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import hw5_transcribe
+
+from hw5_transcribe import SAMPLE_RATE, merge_overlap, split_audio, stitch
+
+
+def test_merge_overlap_removes_repeated_seam():
+    prev = "今天天氣很好我們一起去公園散步"
+    nxt = "一起去公園散步然後吃午餐"
+    assert merge_overlap(prev, nxt) == "今天天氣很好我們一起去公園散步然後吃午餐"
+
+
+def test_merge_overlap_tolerates_small_misrecognition_at_edges():
+    prev = "我們在會議上討論了專案的時程安排"
+    nxt = "了專案的時程安排接下來要分工"
+    assert merge_overlap(prev, nxt) == "我們在會議上討論了專案的時程安排接下來要分工"
+
+
+def test_merge_overlap_without_match_concatenates():
+    assert merge_overlap("第一段內容", "完全不同的文字") == "第一段內容完全不同的文字"
+    # 共同片段太短不視為重疊
+    assert merge_overlap("結尾是好的", "好的開頭") == "結尾是好的好的開頭"
+
+
+def test_merge_overlap_ignores_match_far_from_seam():
+    prev = "重複片段ABCD出現在很前面" + "後面還有許多其他不相干的文字內容" * 2
+    nxt = "重複片段ABCD"
+    assert merge_overlap(prev, nxt) == prev + nxt
+
+
+def test_merge_overlap_empty_sides():
+    assert merge_overlap("", "abc") == "abc"
+    assert merge_overlap("abc", "") == "abc"
+
+
+def test_stitch_strips_and_merges_in_order():
+    texts = [" 第一段說到一起去公園 ", "一起去公園散步之後回家", "之後回家睡覺"]
+    assert stitch(texts) == "第一段說到一起去公園散步之後回家睡覺"
+
+
+def test_split_audio_short_audio_is_single_segment():
+    audio = np.zeros(SAMPLE_RATE * 10, dtype=np.float32)
+    assert split_audio(audio, window_s=30) == [(0, len(audio))]
+
+
+def test_split_audio_fixed_windows_overlap_and_cover_audio():
+    audio = np.zeros(SAMPLE_RATE * 100, dtype=np.float32)
+    segments = split_audio(audio, window_s=30, overlap_s=2, mode="fixed")
+    assert segments[0][0] == 0 and segments[-1][1] == len(audio)
+    for (s1, e1), (s2, e2) in zip(segments, segments[1:]):
+        assert e1 - s2 == 2 * SAMPLE_RATE
+        assert e1 - s1 == 30 * SAMPLE_RATE
+
+
+def test_split_audio_silence_mode_cuts_in_quiet_gap():
+    rng = np.random.default_rng(0)
+    audio = (0.3 * rng.standard_normal(SAMPLE_RATE * 60)).astype(np.float32)
+    gap = slice(int(27.5 * SAMPLE_RATE), int(28.5 * SAMPLE_RATE))
+    audio[gap] = 0.0
+    segments = split_audio(audio, window_s=30, overlap_s=2, search_s=5, mode="silence")
+    first_end = segments[0][1]
+    assert gap.start <= first_end <= gap.stop
+    assert segments[1][0] == first_end - 2 * SAMPLE_RATE
+    assert segments[-1][1] == len(audio)
+
+
+def test_get_pool_replaces_broken_pool():
+    # 未知的引擎名稱讓子行程初始化失敗，行程池因而損壞
+    backend = SimpleNamespace(name="missing-engine", model_name="x", threads=1)
+    try:
+        pool = hw5_transcribe.get_pool(backend, 1)
+        with pytest.raises(BrokenProcessPool):
+            pool.submit(hw5_transcribe._wait_all, None, 0).result(timeout=60)
+        assert hw5_transcribe.get_pool(backend, 1) is not pool
+    finally:
+        hw5_transcribe.shutdown_pool()
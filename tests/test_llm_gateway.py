@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+import llm_gateway
+from llm_gateway import CircuitBreaker, CircuitOpenError, GatewayError, GatewayPolicy, LLMGateway
+from mock_gemini_server import MockGeminiServer
+
+
+def open_breaker(threshold=2):
+    breaker = CircuitBreaker(failure_threshold=threshold, reset_timeout=0.0)
+    for _ in range(threshold):
+        breaker.record_failure()
+    assert breaker.state == "open"
+    return breaker
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+
+def test_half_open_allows_single_probe():
+    breaker = open_breaker()
+    assert breaker.admit() == "probe"
+    assert breaker.state == "half_open"
+    assert breaker.admit() is None
+
+
+def test_probe_success_closes_and_failure_reopens():
+    breaker = open_breaker()
+    assert breaker.admit() == "probe"
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+    breaker = open_breaker()
+    breaker.reset_timeout = 60
+    breaker.opened_at = 0.0
+    assert breaker.admit() == "probe"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+
+def test_release_frees_probe_without_changing_state():
+    breaker = open_breaker()
+    ticket = breaker.admit()
+    breaker.release(ticket)
+    assert breaker.state == "half_open"
+    assert breaker.admit() == "probe"
+    # 一般放行的請求歸還時不影響試探名額
+    breaker.release("closed")
+    assert breaker.admit() is None
+
+
+@pytest.fixture
+def server():
+    server = MockGeminiServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.mark.parametrize("status", [400, 404, 429])
+def test_half_open_probe_non_5xx_does_not_wedge_breaker(server, status):
+    policy = GatewayPolicy(max_retries=0, base_delay=0.01, max_delay=0.01,
+                           failure_threshold=1, reset_timeout=0.0)
+    model = f"probe-{status}-model"
+
+    async def check():
+        gateway = LLMGateway(api_key="test", base_url=server.base_url, policy=policy)
+        try:
+            breaker = llm_gateway.get_breaker(model, policy)
+            breaker.record_failure()
+            assert breaker.state == "open"
+            server.fail_next(1, status=status)
+            with pytest.raises(GatewayError) as excinfo:
+                await gateway.generate(model, "x")
+            assert not isinstance(excinfo.value, CircuitOpenError)
+            # 4xx 代表服務有回應，應關閉；429 不改變狀態但要歸還試探名額
+            assert breaker.state == ("half_open" if status == 429 else "closed")
+            response = await gateway.generate(model, "x")
+            assert response.text == f"mock:{model}:1"
+            assert breaker.state == "closed"
+        finally:
+            await gateway.aclose()
+
+    asyncio.run(check())
+
+
+def test_cancelled_probe_releases_slot(server):
+    policy = GatewayPolicy(max_retries=0, failure_threshold=1, reset_timeout=0.0)
+    model = "cancelled-probe-model"
+    server.latency = 1.0
+
+    async def check():
+        gateway = LLMGateway(api_key="test", base_url=server.base_url, policy=policy)
+        try:
+            breaker = llm_gateway.get_breaker(model, policy)
+            breaker.record_failure()
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(gateway.generate(model, "x"), 0.2)
+            assert breaker.state == "half_open"
+            assert breaker.admit() == "probe"
+        finally:
+            await gateway.aclose()
+
+    asyncio.run(check())
+
+
+def test_backoff_sleep_releases_concurrency_slots(server):
+    policy = GatewayPolicy(max_concurrency=1, max_retries=1, failure_threshold=5)
+
+    async def check():
+        gateway = LLMGateway(api_key="test", base_url=server.base_url, policy=policy)
+        try:
+            server.fail_next(1, status=429, retry_after=1)
+            throttled = asyncio.create_task(gateway.generate("throttled-model", "x"))
+            await asyncio.sleep(0.3)
+            # 受限流的請求在退避等待中，不應占住唯一的全域名額
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            await gateway.generate("healthy-model", "x")
+            assert loop.time() - start < 0.5
+            await throttled
+        finally:
+            await gateway.aclose()
+
+    asyncio.run(check())
+
+
+def test_gateways_of_closed_loops_are_dropped():
+    async def use_gateway():
+        return llm_gateway.get_gateway()
+
+    first = asyncio.run(use_gateway())
+    second = asyncio.run(use_gateway())
+    assert first is not second
+    assert first not in llm_gateway._gateways.values()
+
+    async def close():
+        llm_gateway.get_gateway()
+        await llm_gateway.close_gateway()
+        assert asyncio.get_running_loop() not in llm_gateway._gateways
+
+    asyncio.run(close())
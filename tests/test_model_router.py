@@ -0,0 +1,116 @@
+import json
+
+import pytest
+
+import model_router
+from model_router import ModelRouter, Verdict, parse_confidence, split_confidence
+
+
+def make_router(generate, **kwargs):
+    router = ModelRouter("test", generate, **kwargs)
+    router.tiers = ("cheap", "strong")  # 不受 ROUTER_CASCADE 影響
+    return router
+
+
+def json_batch(batch):
+    return json.dumps(batch)
+
+
+def parse_scores(text, batch):
+    return [Verdict(1 <= entry["score"] <= 5, "分數無效", entry.get("confidence"), entry["score"])
+            for entry in json.loads(text)]
+
+
+def test_route_items_escalates_only_failing_items():
+    calls = []
+
+    def generate(model, prompt):
+        batch = json.loads(prompt)
+        calls.append((model, batch))
+        return json.dumps([{"score": 0 if model == "cheap" and i % 2 else 3,
+                            "confidence": 0.3 if model == "cheap" and i == 4 else 0.9} for i in batch])
+
+    router = make_router(generate)
+    results = router.route_items(list(range(6)), json_batch, parse_scores)
+    assert calls == [("cheap", [0, 1, 2, 3, 4, 5]), ("strong", [1, 3, 4, 5])]
+    assert [r.model for r in results] == ["cheap", "strong", "cheap", "strong", "strong", "strong"]
+    assert [r.escalated for r in results] == [False, True, False, True, True, True]
+    stats = router.stats()
+    assert stats["escalated"] == 4 and stats["invalid_final"] == 0
+    assert stats["reasons"] == {"分數無效": 3, "信心": 1}
+
+
+def test_last_tier_is_accepted_even_if_invalid():
+    router = make_router(lambda model, prompt: json.dumps([{"score": 0}]))
+    result = router.route_items([1], json_batch, parse_scores)[0]
+    assert result.model == "strong" and result.value == 0
+    assert not result.validated
+    assert router.stats()["invalid_final"] == 1
+
+
+def test_unvalidated_final_result_is_logged(tmp_path, monkeypatch):
+    log = tmp_path / "router.jsonl"
+    monkeypatch.setattr(model_router, "ROUTER_LOG", str(log))
+    router = make_router(lambda model, prompt: json.dumps([{"score": 3} for _ in json.loads(prompt)]))
+    results = router.route_items([1, 2], json_batch, parse_scores)
+    assert [r.validated for r in results] == [True, True]
+    router.route_items([1], json_batch, lambda text, batch: [Verdict(False, "分數無效")])
+    records = [json.loads(line) for line in log.read_text(encoding="utf-8").splitlines()]
+    assert [(r["model"], r["accepted"], r["unvalidated"]) for r in records] == [
+        ("cheap", True, False), ("cheap", True, False),
+        ("cheap", False, False), ("strong", False, True)]
+
+
+def test_short_reply_pads_missing_items_as_failures():
+    def generate(model, prompt):
+        batch = json.loads(prompt)
+        return json.dumps([{"score": 3}] * (1 if model == "cheap" else len(batch)))
+
+    results = make_router(generate).route_items(["a", "b", "c"], json_batch, parse_scores)
+    assert [r.model for r in results] == ["cheap", "strong", "strong"]
+
+
+def test_cheap_tier_exception_escalates_but_last_tier_raises():
+    def generate(model, prompt):
+        if model == "cheap":
+            raise RuntimeError("boom")
+        return "ok"
+
+    result = make_router(generate).route("prompt")
+    assert result.model == "strong" and result.value == "ok"
+
+    def always_fails(model, prompt):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        make_router(always_fails).route("prompt")
+
+
+def test_ask_confidence_appends_instruction_and_strips_line():
+    prompts = []
+
+    def generate(model, prompt):
+        prompts.append(prompt)
+        return "報告內容\n信心：0.4" if model == "cheap" else "報告內容\n信心：95%"
+
+    result = make_router(generate, ask_confidence=True).route("寫報告")
+    assert all(p.endswith(model_router.CONFIDENCE_INSTRUCTION) for p in prompts)
+    assert result.model == "strong"
+    assert result.value == "報告內容" and result.verdict.confidence == pytest.approx(0.95)
+
+
+def test_confidence_parsing():
+    assert parse_confidence("0.85") == 0.85
+    assert parse_confidence("85%") == 0.85
+    assert parse_confidence(".5") == 0.5
+    assert parse_confidence("很高") is None
+    assert parse_confidence(None) is None
+    assert split_confidence("內容\n**信心：** 0.7") == ("內容", 0.7)
+    assert split_confidence("沒有信心行") == ("沒有信心行", None)
+
+
+def test_low_confidence_final_result_reports_reason():
+    router = make_router(lambda model, prompt: json.dumps([{"score": 3, "confidence": 0.1}]))
+    result = router.route_items([1], json_batch, parse_scores)[0]
+    assert result.model == "strong" and not result.validated
+    assert result.reason.startswith("信心")
@@ -0,0 +1,9 @@
+import importlib
+
+import pytest
+
+
+@pytest.mark.parametrize("module", ["prompt_cache", "model_router", "llm_gateway"])
+def test_module_self_check(module):
+    """ 各模組的 _self_check() 只用本機替身或模擬端點，納入測試自動執行 """
+    importlib.import_module(module)._self_check()
@@ -0,0 +1,348 @@
+"""
+各流程的分段計時與按需剖析
+
+一次 hw5 分析花了四分鐘，卻看不出時間是花在 Whisper、兩次 Gemini 呼叫還是 PDF；hw4 的區塊、
+hw2 的批次也一樣。這裡提供輕量的 span 記錄：
+  - tracing.request("hw5", file=...) 包住一次請求；tracing.span("transcribe", ...) 記錄其中一段，
+    可附上大小、token 數等屬性（span.set(...) 可在結束前補上）
+  - span 名稱統一為 transcribe / format / analyse / render_pdf / read_csv / llm_call
+  - 請求結束時輸出 Chrome trace 格式 JSON（chrome://tracing 或 https://ui.perfetto.dev 開啟），
+    並印出各段合計耗時
+  - 追蹤中的請求以 contextvars 傳遞；丟到執行緒池的工作用 tracing.wrap(fn) 帶過去
+
+環境變數（未開啟時 span 幾乎沒有額外成本）：
+  TRACE=1                     每個請求輸出一份 trace JSON
+  TRACE_DIR                   輸出資料夾（預設 traces）
+  TRACE_PROFILE=cprofile      同時以 cProfile 剖析請求所在的執行緒，輸出 .prof 並印出前 20 名
+  TRACE_PROFILE=sample        每 TRACE_SAMPLE_MS 毫秒（預設 5）取樣所有執行緒的呼叫堆疊，
+                              輸出 flamegraph 用的 .folded 檔
+  TRACE_PROFILE_REQUESTS      只剖析最前面幾個請求（預設 1），正式環境開啟也只會多花一次請求的成本
+"""
+import collections
+import contextvars
+import cProfile
+import functools
+import inspect
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILE_MODE = os.getenv("TRACE_PROFILE", "").lower()
+TRACE_ENABLED = os.getenv("TRACE", "0") == "1" or bool(PROFILE_MODE)
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+PROFILE_REQUESTS = int(os.getenv("TRACE_PROFILE_REQUESTS", "1"))
+SAMPLE_INTERVAL = float(os.getenv("TRACE_SAMPLE_MS", "5")) / 1000
+
+_current = contextvars.ContextVar("tracing_current", default=None)
+_profiled = 0
+_profiled_lock = threading.Lock()
+
+
+def _now_us() -> float:
+    return time.perf_counter_ns() / 1000
+
+
+def _lane():
+    """ 回傳 (tid, 名稱)；同一執行緒上的多個 asyncio 工作會交錯執行，各自給一列以免 span 重疊 """
+    name = threading.current_thread().name
+    try:
+        import asyncio
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return id(task), f"{name} {task.get_name()}"
+    return threading.get_ident(), name
+
+
+class Span:
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.args = dict(attrs)
+        self.tid, self.lane = _lane()
+        self.start = _now_us()
+        self.end = None
+
+    def set(self, **attrs):
+        self.args.update(attrs)
+        return self
+
+    @property
+    def seconds(self) -> float:
+        return ((self.end or _now_us()) - self.start) / 1e6
+
+
+class _NullSpan:
+    """ 沒有追蹤中的請求時使用，所有操作皆為空 """
+
+    def set(self, **attrs):
+        return self
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """ 一次請求的所有 span """
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self._lock = threading.Lock()
+        self.root = Span(name, attrs)
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def annotate(self, **attrs):
+        self.root.set(**attrs)
+
+    def finish(self):
+        self.root.end = _now_us()
+
+    def to_chrome(self) -> dict:
+        """ Chrome trace event 格式：每個 span 一個完整事件 (ph="X")，時間單位為微秒 """
+        pid = os.getpid()
+        events = []
+        threads = {}
+        for span in [self.root] + self.spans:
+            threads.setdefault(span.tid, span.lane)
+            events.append({"name": span.name, "cat": self.name, "ph": "X", "pid": pid,
+                           "tid": span.tid, "ts": span.start,
+                           "dur": (span.end or _now_us()) - span.start,
+                           "args": {k: v if isinstance(v, (int, float, bool, type(None))) else str(v)
+                                    for k, v in span.args.items()}})
+        for tid, lane in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": lane}})
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"request": self.name, **{k: str(v) for k, v in self.attrs.items()}}}
+
+    def summary(self) -> str:
+        """ 各 span 名稱的次數與合計秒數（平行執行的 span 合計可能超過總耗時） """
+        totals = collections.OrderedDict()
+        for span in sorted(self.spans, key=lambda s: s.start):
+            count, seconds = totals.get(span.name, (0, 0.0))
+            totals[span.name] = (count + 1, seconds + span.seconds)
+        parts = [f"{name} {seconds:.2f}s" + (f" x{count}" if count > 1 else "")
+                 for name, (count, seconds) in totals.items()]
+        return f"[trace] {self.name} 總計 {self.root.seconds:.2f} 秒：" + (" / ".join(parts) or "無 span")
+
+    def save(self, directory: str = None) -> str:
+        directory = directory or TRACE_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.file_stem()}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome(), f, ensure_ascii=False)
+        return path
+
+    def file_stem(self) -> str:
+        if not hasattr(self, "_stem"):
+            label = re.sub(r"[^\w.-]+", "_", self.name)
+            self._stem = f"{label}-{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        return self._stem
+
+
+def current() -> Trace:
+    return _current.get()
+
+
+def annotate(**attrs):
+    """ 在目前請求上附加屬性（例如檔名、列數） """
+    trace = _current.get()
+    if trace is not None:
+        trace.annotate(**attrs)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """ 記錄一段耗時；沒有追蹤中的請求時不做任何事 """
+    trace = _current.get()
+    if trace is None:
+        yield NULL_SPAN
+        return
+    s = Span(name, attrs)
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=type(e).__name__)
+        raise
+    finally:
+        s.end = _now_us()
+        trace.add(s)
+
+
+def wrap(fn):
+    """ 把目前的追蹤帶進執行緒池：executor.submit(tracing.wrap(fn), ...) """
+    if _current.get() is None:
+        return fn
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+    return run
+
+
+# ----- 剖析 -----
+
+
+class _CProfiler:
+    """ cProfile 只剖析啟用它的執行緒；產生器版本會在每一步重新啟用 """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def resume(self):
+        self.profile.enable()
+
+    def pause(self):
+        self.profile.disable()
+
+    def save(self, stem: str) -> str:
+        path = os.path.join(TRACE_DIR, f"{stem}.prof")
+        self.profile.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats("cumulative").print_stats(20)
+        print(out.getvalue())
+        return path
+
+
+class _Sampler:
+    """ 背景執行緒定期取樣所有執行緒的堆疊，累計成 flamegraph 的 folded 格式 """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trace-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def resume(self):
+        pass
+
+    def pause(self):
+        pass
+
+    def save(self, stem: str) -> str:
+        self._stop.set()
+        self._thread.join()
+        path = os.path.join(TRACE_DIR, f"{stem}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        leaf = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaf[stack.rsplit(";", 1)[-1]] += count
+        total = sum(self.stacks.values()) or 1
+        print(f"取樣 {total} 次，最常出現在堆疊頂端的函式：")
+        for frame, count in leaf.most_common(15):
+            print(f"  {count / total * 100:5.1f}%  {frame}")
+        return path
+
+
+def _start_profiler():
+    global _profiled
+    if PROFILE_MODE not in ("cprofile", "sample"):
+        return None
+    with _profiled_lock:
+        if _profiled >= PROFILE_REQUESTS:
+            return None
+        _profiled += 1
+    return _CProfiler() if PROFILE_MODE == "cprofile" else _Sampler()
+
+
+def _finish(trace: Trace, profiler):
+    trace.finish()
+    path = trace.save()
+    print(trace.summary())
+    print(f"[trace] 已輸出 {path}")
+    if profiler is not None:
+        print(f"[trace] 剖析結果：{profiler.save(trace.file_stem())}")
+
+
+@contextmanager
+def request(name: str, **attrs):
+    """ 追蹤一次請求；TRACE / TRACE_PROFILE 未開啟時只回傳 None """
+    if not TRACE_ENABLED:
+        yield None
+        return
+    trace = Trace(name, **attrs)
+    profiler = _start_profiler()
+    token = _current.set(trace)
+    if profiler is not None:
+        profiler.resume()
+    try:
+        yield trace
+    finally:
+        if profiler is not None:
+            profiler.pause()
+        _current.reset(token)
+        _finish(trace, profiler)
+
+
+def traced(name: str):
+    """
+    把整個函式當成一次請求追蹤。產生器函式（例如 Gradio 的串流處理函式）每一步可能在不同執行緒執行，
+    因此每次取下一個值時才把追蹤設為目前的 context，直到產生器結束才輸出。
+    """
+    def decorator(fn):
+        if not inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def call(*args, **kwargs):
+                with request(name):
+                    return fn(*args, **kwargs)
+            return call
+
+        @functools.wraps(fn)
+        def generate(*args, **kwargs):
+            if not TRACE_ENABLED:
+                yield from fn(*args, **kwargs)
+                return
+            trace = Trace(name)
+            profiler = _start_profiler()
+            gen = fn(*args, **kwargs)
+            try:
+                while True:
+                    token = _current.set(trace)
+                    if profiler is not None:
+                        profiler.resume()
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                    finally:
+                        if profiler is not None:
+                            profiler.pause()
+                        _current.reset(token)
+                    yield item
+            finally:
+                gen.close()
+                _finish(trace, profiler)
+        return generate
+    return decorator